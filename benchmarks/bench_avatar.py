@@ -0,0 +1,53 @@
+"""Avatar update latency: what the request waits for before and after the pipeline.
+
+Encodes a camera-sized JPEG in memory and times the work an avatar update does on the request path:
+
+* ``hash`` - ``digest`` of the upload, which is all an unchanged avatar costs;
+* ``resize`` - ``resize`` to the 250x250 JPEG, done before the 202 is returned;
+* ``upload bytes`` - how much the background worker sends to Cloudinary instead of the original file.
+
+The Cloudinary upload itself, which used to run on the event loop, is no longer part of the response time.
+
+    python -m benchmarks.bench_avatar --width 4000 --height 3000
+"""
+import argparse
+import io
+import time
+
+from PIL import Image
+
+from src.services.avatars import digest, resize
+
+
+def make_photo(width: int, height: int) -> bytes:
+    image = Image.radial_gradient('L').resize((width, height)).convert('RGB')
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=92)
+    return out.getvalue()
+
+
+def measure(fn, data: bytes, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(width: int, height: int, repeat: int):
+    photo = make_photo(width, height)
+    avatar = resize(photo)
+    print(f"original      {len(photo) / 1024:10.1f} KiB")
+    print(f"upload bytes  {len(avatar) / 1024:10.1f} KiB")
+    print(f"hash          {measure(digest, photo, repeat) * 1000:10.2f} ms")
+    print(f"resize        {measure(resize, photo, repeat) * 1000:10.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main(args.width, args.height, args.repeat)
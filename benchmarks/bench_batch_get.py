@@ -0,0 +1,117 @@
+"""Fetching many users: one request per id vs. the batch endpoint.
+
+Fills a SQLite database with ``--rows`` users and, for every batch size, compares
+
+* ``repository`` - ``get_user_by_id`` awaited once per id vs. one ``get_users_by_keys`` query;
+* ``route`` - one ``GET /api/users/{id}`` per id vs. one ``POST /api/users/batch``, through auth,
+  role check, rate limiter and response cache (Redis is stubbed out).
+
+    python -m benchmarks.bench_batch_get --rows 10000 --sizes 10 50 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import date
+from unittest.mock import AsyncMock, patch
+
+import httpx
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import NullPool
+
+from main import app
+from src.database.db import get_db
+from src.database.models import Base, Guest, Role, User
+from src.repository import users as repository_users
+from src.services.auth import auth_service
+from src.services.cache import principal_cache, response_cache
+from src.services.rate_limit import rate_limiter, Quota
+from src.services.token_versions import token_versions
+
+
+async def prepare_db(path: str, rows: int):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}', poolclass=NullPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_maker() as db:
+        await db.execute(insert(User), [
+            {'firstname': 'Bench', 'lastname': f'User{i}', 'email': f'user{i}@example.com', 'phone': '+380001234567',
+             'birthday': date(1990, 1, 1), 'additional_info': 'benchmark'} for i in range(rows)])
+        guest = Guest(guest_name='bench', email='bench@example.com', password='-', confirmed=True, roles=Role.admin)
+        db.add(guest)
+        await db.commit()
+        token = await auth_service.create_access_token(data=await auth_service.create_claims(guest))
+    return engine, session_maker, token
+
+
+def stub_redis(stack: ExitStack):
+    for target in (principal_cache, response_cache, token_versions):
+        redis_mock = stack.enter_context(patch.object(target, 'r', new_callable=AsyncMock))
+        redis_mock.get.return_value = None
+        redis_mock.mget.return_value = [None, None]
+    redis_mock = stack.enter_context(patch.object(rate_limiter, 'r', new_callable=AsyncMock))
+    redis_mock.evalsha.side_effect = lambda sha, numkeys, *args: [0] * numkeys
+    stack.enter_context(patch.dict(rate_limiter.quotas, {role: Quota(10 ** 9, 60) for role in Role}))
+
+
+async def best(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - started)
+    return min(times) * 1000
+
+
+async def main(rows: int, sizes, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        stub_redis(stack)
+        engine, session_maker, token = await prepare_db(os.path.join(tmp, 'bench.db'), rows)
+
+        async def override_get_db():
+            async with session_maker() as session:
+                yield session
+
+        app.dependency_overrides[get_db] = override_get_db
+        headers = {'Authorization': f'Bearer {token}'}
+        print(f"{'ids':>5} {'repo loop ms':>13} {'repo batch ms':>14} {'route loop ms':>14} {'route batch ms':>15}")
+        async with httpx.AsyncClient(app=app, base_url='http://bench') as client:
+            for size in sizes:
+                ids = random.sample(range(1, rows + 1), size)
+
+                async def repo_loop():
+                    async with session_maker() as db:
+                        for user_id in ids:
+                            await repository_users.get_user_by_id(user_id, db)
+
+                async def repo_batch():
+                    async with session_maker() as db:
+                        await repository_users.get_users_by_keys(ids, [], db)
+
+                async def route_loop():
+                    for user_id in ids:
+                        response = await client.get(f'/api/users/{user_id}', headers=headers)
+                        assert response.status_code == 200, response.text
+
+                async def route_batch():
+                    response = await client.post('/api/users/batch', json={'ids': ids}, headers=headers)
+                    assert response.status_code == 200, response.text
+
+                print(f"{size:>5} {await best(repo_loop, repeat):>13.1f} {await best(repo_batch, repeat):>14.1f} "
+                      f"{await best(route_loop, repeat):>14.1f} {await best(route_batch, repeat):>15.1f}")
+        app.dependency_overrides.pop(get_db, None)
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.sizes, args.repeat))
@@ -0,0 +1,300 @@
+"""Throughput and latency of every router, compared against a stored baseline.
+
+Runs the application in-process behind an ASGI client. Redis is replaced by an in-memory fake and the database is
+a fresh SQLite file, or ``--database-url`` (a scratch database: its tables are dropped and recreated). Both are
+swapped in through the resource registry, so requests take the same path as in production: auth, role check,
+rate limiter, response cache and repository. Every endpoint of ``users``, ``find``, ``auth`` and ``guest`` gets
+``--warmup`` untimed requests, then ``--requests`` timed ones from ``--concurrency`` concurrent clients
+(endpoints that hash a password with bcrypt get a tenth of them). Requests/sec and p50/p95/p99 latencies are
+reported per endpoint.
+
+With ``--save-baseline`` the results are written to ``--baseline``. Otherwise, if that file exists, every
+endpoint is compared with it, and the exit status is 1 when one lost more than ``--threshold`` of its
+requests/sec or its p95 grew by more than ``--threshold``. Baselines only compare runs on the same machine.
+
+    python -m benchmarks.bench_endpoints --rows 2000 --requests 200 --concurrency 8
+    python -m benchmarks.bench_endpoints --save-baseline
+    python -m benchmarks.bench_endpoints --threshold 0.15
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+from unittest.mock import patch
+
+import httpx
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from main import app
+from src.conf.config import settings
+from src.database.db import DBSession
+from src.database.models import Base, Guest, Role, User
+from src.services.auth import auth_service
+from src.services.rate_limit import rate_limiter, Quota
+from src.services.refresh_tokens import refresh_families
+from src.services.resources import resources
+
+BASELINE = Path(__file__).with_name('baseline_endpoints.json')
+EMAIL = 'bench@example.com'
+PASSWORD = 'benchmark-password'
+
+
+class FakeRedis:
+    """The Redis commands the application uses, kept in a dict. Expiry is ignored."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None, xx=False, get=False):
+        current = self.data.get(key)
+        if not xx or current is not None:
+            self.data[key] = value.encode() if isinstance(value, str) else value
+        return current if get else True
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def incr(self, key):
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value).encode()
+        return value
+
+    async def script_load(self, script):
+        return 'sync'
+
+    async def evalsha(self, sha, numkeys, *args):
+        # the rate limiter's SYNC_SCRIPT: add the local hits of each key pair and return the global counts
+        keys, argv = args[:numkeys], args[numkeys:]
+        counts = []
+        for pair in range(numkeys // 2):
+            for key, delta in zip(keys[2 * pair:2 * pair + 2], argv[3 * pair:3 * pair + 2]):
+                value = int(self.data.get(key, 0)) + int(delta)
+                self.data[key] = str(value).encode()
+                counts.append(value)
+        return counts
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def close(self):
+        self.data.clear()
+
+
+class FakePipeline:
+    def __init__(self, r: FakeRedis):
+        self.r = r
+        self.commands = []
+
+    def set(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+        return self
+
+    async def execute(self):
+        return [await self.r.set(*args, **kwargs) for args, kwargs in self.commands]
+
+
+@dataclass
+class Endpoint:
+    name: str
+    send: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]
+    status: int = 200
+    share: float = 1.0
+
+
+@dataclass
+class Context:
+    rows: int
+    headers: Dict[str, str]
+    refresh_tokens: List[str]
+
+
+async def prepare_db(url: str, rows: int):
+    engine = create_async_engine(url)
+    resources.register("engine", lambda: engine, close=lambda engine: engine.dispose())
+    async with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            await conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with DBSession() as db:
+        await db.execute(insert(User), [
+            {'firstname': f'Bench{i % 50}', 'lastname': f'User{i}', 'email': f'user{i}@example.com',
+             'phone': f'+38000{i:07d}', 'birthday': date(1970, 1, 1) + timedelta(days=i * 37 % 18000),
+             'additional_info': 'benchmark'} for i in range(rows)])
+        guest = Guest(guest_name='bench', email=EMAIL, password=await auth_service.get_password_hash(PASSWORD),
+                      avatar='https://example.com/bench.jpg', confirmed=True, roles=Role.admin)
+        db.add(guest)
+        await db.commit()
+        claims = await auth_service.create_claims(guest)
+    return claims
+
+
+async def refresh_tokens(claims: dict, count: int) -> List[str]:
+    tokens = []
+    for _ in range(count):
+        jti = refresh_families.new_id()
+        family = await refresh_families.start(jti, settings.refresh_token_ttl)
+        tokens.append(await auth_service.create_refresh_token(data={**claims, "jti": jti, "fam": family},
+                                                              expires_delta=settings.refresh_token_ttl))
+    return tokens
+
+
+def endpoints(ctx: Context) -> List[Endpoint]:
+    seq = itertools.count()
+    headers = ctx.headers
+
+    def user_id():
+        return random.randint(1, ctx.rows)
+
+    def new_user():
+        return {'firstname': 'New', 'lastname': 'Bench', 'email': f'new{next(seq)}@example.com'}
+
+    def refresh_headers():
+        return {'Authorization': f'Bearer {ctx.refresh_tokens.pop()}'}
+
+    since = (datetime.utcnow() - timedelta(minutes=5)).isoformat()
+    return [
+        Endpoint('users.list', lambda c: c.get('/api/users/', params={'limit': 20}, headers=headers)),
+        Endpoint('users.list_by_last_name', lambda c: c.get('/api/users/', params={
+            'limit': 20, 'order_by': 'last_name'}, headers=headers)),
+        Endpoint('users.get', lambda c: c.get(f'/api/users/{user_id()}', headers=headers)),
+        Endpoint('users.batch', lambda c: c.post('/api/users/batch', json={
+            'ids': random.sample(range(1, ctx.rows + 1), min(50, ctx.rows))}, headers=headers)),
+        Endpoint('users.create', lambda c: c.post('/api/users/', json=new_user(), headers=headers), status=201),
+        Endpoint('users.update', lambda c: c.put(f'/api/users/{user_id()}', json=new_user(), headers=headers)),
+        Endpoint('users.bulk_update_dry_run', lambda c: c.post('/api/users/bulk/update', json={
+            'where': {'lastname': {'startswith': 'User1'}}, 'set': {'additional_info': 'bulk'}, 'dry_run': True},
+            headers=headers)),
+        Endpoint('users.export_since', lambda c: c.get('/api/users/export', params={'since': since},
+                                                       headers=headers), share=0.2),
+        Endpoint('find.prefix', lambda c: c.get('/api/find/', params={
+            'q': f'User{random.randint(1, 99)}', 'mode': 'prefix'}, headers=headers)),
+        Endpoint('find.fuzzy', lambda c: c.get('/api/find/', params={
+            'q': f'Bench{random.randint(0, 49)}', 'mode': 'fuzzy'}, headers=headers)),
+        Endpoint('find.birthday_list', lambda c: c.get('/api/find/birthday_list', params={'shift': 7},
+                                                       headers=headers)),
+        Endpoint('find.phone', lambda c: c.get('/api/find/phone', params={
+            'value': f'+38000{user_id() - 1:07d}'}, headers=headers)),
+        Endpoint('auth.login', lambda c: c.post('/api/auth/login', data={
+            'username': EMAIL, 'password': PASSWORD}), share=0.1),
+        Endpoint('auth.refresh_token', lambda c: c.get('/api/auth/refresh_token', headers=refresh_headers())),
+        Endpoint('auth.signup', lambda c: c.post('/api/auth/signup', json={
+            'guest_name': 'new', 'email': f'guest{next(seq)}@example.com', 'password': PASSWORD}),
+            status=201, share=0.1),
+        Endpoint('guest.me', lambda c: c.get('/api/users/me/', headers=headers)),
+        Endpoint('guest.avatar_status', lambda c: c.get('/api/users/me/avatar', headers=headers)),
+    ]
+
+
+def percentile(cuts: List[float], p: int) -> float:
+    return cuts[p - 1] * 1000
+
+
+async def measure(client: httpx.AsyncClient, endpoint: Endpoint, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    todo = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in todo:
+            started = time.perf_counter()
+            response = await endpoint.send(client)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != endpoint.status:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {'requests': requests, 'errors': errors, 'rps': requests / elapsed,
+            'p50': percentile(cuts, 50), 'p95': percentile(cuts, 95), 'p99': percentile(cuts, 99)}
+
+
+def compare(result: dict, baseline: Optional[dict], threshold: float) -> str:
+    if baseline is None:
+        return ''
+    rps = result['rps'] / baseline['rps'] - 1
+    p95 = result['p95'] / baseline['p95'] - 1
+    verdict = 'REGRESSION' if rps < -threshold or p95 > threshold else 'ok'
+    return f"{rps:>+8.1%} {p95:>+8.1%}  {verdict}"
+
+
+async def main(args) -> int:
+    baseline = None
+    if not args.save_baseline and args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())['endpoints']
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        resources.register("redis", FakeRedis, close=lambda client: client.close())
+        stack.enter_context(patch.dict(rate_limiter.quotas, {role: Quota(10 ** 9, 60) for role in Role}))
+        claims = await prepare_db(url, args.rows)
+        access_token = await auth_service.create_access_token(data=claims)
+        total = args.warmup + args.requests
+        ctx = Context(args.rows, {'Authorization': f'Bearer {access_token}'}, await refresh_tokens(claims, total))
+
+        results = {}
+        print(f"{'endpoint':<26} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}"
+              + (f" {'req/s':>8} {'p95':>8}  vs baseline" if baseline else ''))
+        async with httpx.AsyncClient(app=app, base_url='http://bench') as client:
+            for endpoint in endpoints(ctx):
+                if args.only and not any(endpoint.name.startswith(prefix) for prefix in args.only):
+                    continue
+                requests = max(2, int(args.requests * endpoint.share))
+                await measure(client, endpoint, max(1, int(args.warmup * endpoint.share)), args.concurrency)
+                result = results[endpoint.name] = await measure(client, endpoint, requests, args.concurrency)
+                print(f"{endpoint.name:<26} {result['rps']:>8.1f} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+                      f"{result['p99']:>8.2f} {result['errors']:>6} "
+                      f"{compare(result, (baseline or {}).get(endpoint.name), args.threshold)}")
+        await resources.aclose()
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({
+            'settings': {'rows': args.rows, 'requests': args.requests, 'concurrency': args.concurrency,
+                         'database': 'sqlite' if args.database_url is None else 'external'},
+            'endpoints': results}, indent=2))
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"no baseline at {args.baseline}; run with --save-baseline to store one")
+        return 0
+    regressions = [name for name, result in results.items()
+                   if compare(result, baseline.get(name), args.threshold).endswith('REGRESSION')]
+    if regressions:
+        print(f"{len(regressions)} endpoint(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--database-url', help='a scratch database instead of a temporary SQLite file')
+    parser.add_argument('--only', nargs='+', help='endpoint name prefixes, e.g. users find.prefix')
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed loss of req/s and growth of p95, as a fraction')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,107 @@
+"""Login throughput vs. latency of an unrelated endpoint.
+
+Fires ``--logins`` concurrent ``POST /api/auth/login`` requests in-process and, while they run,
+probes ``GET /`` every few milliseconds. Each pool size is measured against the old behaviour of
+verifying the bcrypt hash on the event loop (``inline``).
+
+    python -m benchmarks.bench_login --logins 32 --sizes 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import AsyncMock, patch
+
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import NullPool
+
+from main import app
+from src.database.db import get_db
+from src.database.models import Base, Guest
+from src.services.auth import Auth, auth_service
+from src.services.cache import principal_cache
+from src.services.workers import WorkerPool
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'benchmark-password'
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] * 1000
+
+
+async def prepare_db(path: str):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}', poolclass=NullPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_maker() as db:
+        db.add(Guest(guest_name='bench', email=EMAIL, password=auth_service.pwd_context.hash(PASSWORD),
+                     confirmed=True))
+        await db.commit()
+
+    async def override_get_db():
+        async with session_maker() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    return engine
+
+
+async def run(client: httpx.AsyncClient, logins: int):
+    stop = asyncio.Event()
+    probes = []
+
+    async def probe():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await client.get('/')
+            probes.append(time.perf_counter() - started)
+            await asyncio.sleep(0.005)
+
+    async def login():
+        response = await client.post('/api/auth/login', data={'username': EMAIL, 'password': PASSWORD})
+        assert response.status_code == 200, response.text
+
+    prober = asyncio.ensure_future(probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+    return logins / elapsed, percentile(probes, 50), percentile(probes, 99)
+
+
+async def main(logins: int, sizes):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = await prepare_db(os.path.join(tmp, 'bench.db'))
+        with patch.object(principal_cache, 'r', new_callable=AsyncMock):
+            async with httpx.AsyncClient(app=app, base_url='http://bench') as client:
+                await run(client, 1)
+                print(f"{'pool':>8} {'logins/s':>10} {'GET / p50 ms':>14} {'GET / p99 ms':>14}")
+
+                async def inline_verify(self, plain_password, hashed_password):
+                    return self.pwd_context.verify(plain_password, hashed_password)
+
+                with patch.object(Auth, 'verify_password', inline_verify):
+                    rate, p50, p99 = await run(client, logins)
+                print(f"{'inline':>8} {rate:>10.1f} {p50:>14.2f} {p99:>14.2f}")
+
+                for size in sizes:
+                    pool = WorkerPool(size, logins, 60, name='bench')
+                    with patch.object(Auth, 'password_pool', pool):
+                        rate, p50, p99 = await run(client, logins)
+                    pool.shutdown()
+                    print(f"{size:>8} {rate:>10.1f} {p50:>14.2f} {p99:>14.2f}")
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=32)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.sizes))
@@ -0,0 +1,58 @@
+"""Per-request overhead of MetricsMiddleware.
+
+Drives a minimal ASGI app directly (no HTTP client, no event loop hops) with and without the
+middleware and reports the difference per request.
+
+    python -m benchmarks.bench_metrics --requests 200000
+"""
+import argparse
+import asyncio
+import time
+
+from src.services.metrics import MetricsMiddleware
+
+
+class Route:
+    path = '/api/users/{user_id}'
+
+
+async def endpoint(scope, receive, send):
+    scope['route'] = Route
+    await receive()
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'{"id": 1}'})
+
+
+async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def send(message):
+    pass
+
+
+async def measure(app, requests: int) -> float:
+    started = time.perf_counter_ns()
+    for _ in range(requests):
+        await app({'type': 'http', 'method': 'GET', 'path': '/api/users/1'}, receive, send)
+    return (time.perf_counter_ns() - started) / requests
+
+
+async def main(requests: int, rounds: int):
+    instrumented = MetricsMiddleware(endpoint)
+    await measure(instrumented, 1000)
+    bare, metered = [], []
+    for _ in range(rounds):
+        bare.append(await measure(endpoint, requests))
+        metered.append(await measure(instrumented, requests))
+    bare, metered = min(bare), min(metered)
+    print(f"{'bare ns/req':>12} {'metered ns/req':>15} {'overhead us':>12}")
+    print(f"{bare:>12.0f} {metered:>15.0f} {(metered - bare) / 1000:>12.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.rounds))
@@ -0,0 +1,55 @@
+"""Rate limiter cost per request and Redis calls per request.
+
+Replays requests from a pool of principals against ``RateLimiter.check`` with a stub Redis that answers the
+sync script instantly, so the numbers are the in-process cost of a decision:
+
+* ``us/check`` - average time of one ``check``, syncs included;
+* ``redis calls`` - script calls made, which grow with elapsed time and active principals, not with requests.
+
+    python -m benchmarks.bench_rate_limit --requests 200000 --principals 100 1000 10000
+"""
+import argparse
+import asyncio
+import time
+
+from src.database.models import Role
+from src.services.rate_limit import RateLimiter, Quota
+
+
+class StubRedis:
+    def __init__(self):
+        self.calls = 0
+
+    async def script_load(self, script):
+        return "sha"
+
+    async def evalsha(self, sha, numkeys, *args):
+        self.calls += 1
+        return [0] * numkeys
+
+
+async def measure(requests: int, principals: int, sync_interval: float):
+    r = StubRedis()
+    limiter = RateLimiter(r, {role: Quota(10 ** 9, 60) for role in Role}, sync_interval)
+    keys = [f"users:{i}" for i in range(principals)]
+    started = time.perf_counter()
+    for i in range(requests):
+        await limiter.check(keys[i % principals], Role.guest)
+    elapsed = time.perf_counter() - started
+    return elapsed / requests * 1e6, r.calls, elapsed
+
+
+async def main(requests: int, principals, sync_interval: float):
+    print(f"{'principals':>10} {'us/check':>9} {'redis calls':>12} {'seconds':>8}")
+    for count in principals:
+        per_check, calls, elapsed = await measure(requests, count, sync_interval)
+        print(f"{count:>10} {per_check:>9.2f} {calls:>12} {elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--principals', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--sync-interval', type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.principals, args.sync_interval))
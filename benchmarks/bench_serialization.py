@@ -0,0 +1,69 @@
+"""List serialization throughput: response_model validation vs. the orjson fast path.
+
+Builds detached ``User`` rows in memory and serializes a ``UserPage`` of each size the way a route does:
+
+* ``response_model`` - FastAPI validates the ORM objects through ``UserPage`` (orm_mode) and renders
+  the result with ``JSONResponse`` (stdlib json), which is what every route does by default;
+* ``orjson`` - ``user_serializer.dump_many`` copies the fields and ``ORJSONResponse`` renders them.
+
+    python -m benchmarks.bench_serialization --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import time
+from datetime import date, datetime
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from pydantic.fields import ModelField
+
+from src.database.models import User
+from src.services.serializers import user_serializer
+from src.shemas import UserPage
+
+PAGE_FIELD = ModelField.infer(name='Response', value=..., annotation=UserPage, class_validators={},
+                              config=UserPage.__config__)
+
+
+def make_users(count: int):
+    now = datetime(2023, 5, 1, 12, 30, 15, 123456)
+    return [User(id=i, firstname=f'First{i}', lastname=f'Last{i}', email=f'user{i}@example.com',
+                 phone='+380001234567', birthday=date(1990, 1 + i % 12, 1 + i % 28), additional_info='benchmark',
+                 created_at=now, updated_at=now) for i in range(1, count + 1)]
+
+
+async def response_model(users):
+    content = await serialize_response(field=PAGE_FIELD, response_content={"items": users, "next_cursor": None},
+                                       is_coroutine=True)
+    return JSONResponse(content).body
+
+
+async def fast(users):
+    return ORJSONResponse({"items": user_serializer.dump_many(users), "next_cursor": None,
+                           "estimated_total": None}).body
+
+
+async def measure(fn, users, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn(users)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def main(sizes, repeat: int):
+    print(f"{'rows':>8} {'response_model rows/s':>22} {'orjson rows/s':>14} {'speedup':>8}")
+    for size in sizes:
+        users = make_users(size)
+        slow = await measure(response_model, users, repeat)
+        quick = await measure(fast, users, repeat)
+        print(f"{size:>8} {size / slow:>22,.0f} {size / quick:>14,.0f} {slow / quick:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.repeat))
@@ -0,0 +1,49 @@
+"""Worker boot time: importing the application and running its lifespan.
+
+Starts ``--runs`` fresh interpreters. Each one imports ``main``, enters and leaves the lifespan, and prints
+``app.state.import_seconds``, ``app.state.boot_seconds``, the resources created and the shutdown time.
+The medians are reported. No resource should be created during boot, and the engine, Redis and storage
+clients are only built by the first request that needs them.
+
+    python -m benchmarks.bench_startup --runs 10
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import asyncio, json, time
+from main import app, lifespan
+from src.services.resources import resources
+
+async def boot():
+    async with lifespan(app):
+        created = sorted(resources.instances)
+        started = time.perf_counter()
+    return created, time.perf_counter() - started
+
+created, shutdown = asyncio.run(boot())
+print(json.dumps({"import": app.state.import_seconds, "boot": app.state.boot_seconds,
+                  "shutdown": shutdown, "created": created}))
+"""
+
+
+def main(runs: int):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True)
+        samples.append(json.loads(result.stdout.splitlines()[-1]))
+    print(f"{'runs':>5} {'import ms':>10} {'boot ms':>8} {'shutdown ms':>12}  created at boot")
+    print(f"{runs:>5} {statistics.median(s['import'] for s in samples) * 1000:>10.1f} "
+          f"{statistics.median(s['boot'] for s in samples) * 1000:>8.1f} "
+          f"{statistics.median(s['shutdown'] for s in samples) * 1000:>12.2f}  "
+          f"{sorted({name for s in samples for name in s['created']}) or '-'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    main(args.runs)
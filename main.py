@@ -1,27 +1,53 @@
 import time
-import pathlib
 
-import redis.asyncio as redis
+BOOT_STARTED = time.perf_counter()
+
+import asyncio  # noqa: E402
+import pathlib  # noqa: E402
+from contextlib import asynccontextmanager  # noqa: E402
+
 from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import HTMLResponse, Response, JSONResponse, ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi_limiter import FastAPILimiter
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.database.db import get_db
-from src.routes import users, find, auth, guest
+from src.routes import users, find, auth, guest, internal, well_known, avatars
 from src.conf.config import settings
+from src.services.metrics import MetricsMiddleware, render_metrics, flush_metrics
+from src.services.resources import resources
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    The lifespan function runs the background tasks of a worker and releases its resources on shutdown.
+    The engine, the Redis pool and the storage clients are created on first use, so startup opens no connections;
+    on shutdown everything that was created is closed, so a reload does not leak connections.
+    The time from importing main to serving is kept in app.state.boot_seconds.
+
+    :param app: FastAPI: The application
+    :return: None
+    :doc-author: Trelent
+    """
+    metrics_flush = None
+    if settings.metrics_multiproc_dir:
+        metrics_flush = asyncio.create_task(
+            flush_metrics(settings.metrics_multiproc_dir, settings.metrics_flush_interval))
+    app.state.boot_seconds = time.perf_counter() - BOOT_STARTED
+    try:
+        yield
+    finally:
+        if metrics_flush is not None:
+            metrics_flush.cancel()
+            await asyncio.gather(metrics_flush, return_exceptions=True)
+        await resources.aclose()
 
 
-@app.on_event("startup")
-async def startup():
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port)
-    await FastAPILimiter.init(r)
+app = FastAPI(default_response_class=ORJSONResponse if settings.fast_json else JSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,15 +56,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-
-@app.middleware("http")
-async def custom_middleware(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    during = time.time() - start_time
-    response.headers["performance"] = str(during)
-    return response
+app.add_middleware(MetricsMiddleware)
 
 templates = Jinja2Templates(directory="templates")
 BASE_DIR = pathlib.Path(__file__).parent
@@ -50,11 +68,18 @@ async def root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "title": "Users list"})
 
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(internal.allowed_operation_internal)])
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: AsyncSession = Depends(get_db)):
     try:
         # Make request
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = await db.execute(text("SELECT 1"))
+        result = result.fetchone()
         if result is None:
             raise HTTPException(status_code=500, detail="Database is not configured correctly")
         return {"message": "Welcome to FastAPI!"}
@@ -67,3 +92,8 @@ app.include_router(users.router, prefix='/api')
 app.include_router(find.find, prefix='/api')
 app.include_router(auth.router, prefix='/api')
 app.include_router(guest.router, prefix='/api')
+app.include_router(internal.router, prefix='/api')
+app.include_router(avatars.router, prefix='/api')
+app.include_router(well_known.router)
+
+app.state.import_seconds = time.perf_counter() - BOOT_STARTED
@@ -0,0 +1,31 @@
+"""users phone and additional info
+
+Revision ID: 3b8f2c1d7a41
+Revises: e1282aa2fa12
+Create Date: 2026-10-18 10:12:41.118205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8f2c1d7a41'
+down_revision = 'e1282aa2fa12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column('users', 'tel_number', type_=sa.String(length=15), existing_nullable=True,
+                    postgresql_using='tel_number::varchar')
+    op.add_column('users', sa.Column('additional_info', sa.String(length=150), server_default='nothing yet',
+                                     nullable=True))
+    # UserResponse requires the field, so rows that predate the column must not read back as NULL
+    op.execute("UPDATE users SET additional_info = 'nothing yet' WHERE additional_info IS NULL")
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'additional_info')
+    op.alter_column('users', 'tel_number', type_=sa.Integer(), existing_nullable=True,
+                    postgresql_using='tel_number::integer')
@@ -0,0 +1,24 @@
+"""users keyset pagination index
+
+Revision ID: 8c4e1a9f2b60
+Revises: 3b8f2c1d7a41
+Create Date: 2026-10-18 11:03:27.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e1a9f2b60'
+down_revision = '3b8f2c1d7a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_last_name_id', 'users', [sa.text("coalesce(last_name, '')"), 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_last_name_id', table_name='users')
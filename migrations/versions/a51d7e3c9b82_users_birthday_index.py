@@ -0,0 +1,29 @@
+"""users birthday month/day index
+
+Revision ID: a51d7e3c9b82
+Revises: 8c4e1a9f2b60
+Create Date: 2026-10-18 11:47:09.306154
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a51d7e3c9b82'
+down_revision = '8c4e1a9f2b60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column('users', 'birthday', type_=sa.Date(), existing_nullable=True,
+                    postgresql_using='birthday::date')
+    op.create_index('ix_users_birthday_month_day', 'users',
+                    [sa.text('EXTRACT(month FROM birthday)'), sa.text('EXTRACT(day FROM birthday)'), 'id'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_birthday_month_day', table_name='users')
+    op.alter_column('users', 'birthday', type_=sa.String(), existing_nullable=True)
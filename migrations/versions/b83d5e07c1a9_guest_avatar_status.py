@@ -0,0 +1,29 @@
+"""guest avatar status
+
+Revision ID: b83d5e07c1a9
+Revises: f4b19c2e8d73
+Create Date: 2026-10-18 16:20:13.402917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83d5e07c1a9'
+down_revision = 'f4b19c2e8d73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    avatar_status = sa.Enum('ready', 'processing', 'failed', name='avatarstatus')
+    avatar_status.create(op.get_bind(), checkfirst=True)
+    op.add_column('guest', sa.Column('avatar_hash', sa.String(length=64), nullable=True))
+    op.add_column('guest', sa.Column('avatar_status', avatar_status, server_default='ready', nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('guest', 'avatar_status')
+    op.drop_column('guest', 'avatar_hash')
+    sa.Enum(name='avatarstatus').drop(op.get_bind(), checkfirst=True)
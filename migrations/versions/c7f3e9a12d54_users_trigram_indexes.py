@@ -0,0 +1,29 @@
+"""users trigram search indexes
+
+Revision ID: c7f3e9a12d54
+Revises: a51d7e3c9b82
+Create Date: 2026-10-18 12:36:52.871440
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f3e9a12d54'
+down_revision = 'a51d7e3c9b82'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('first_name', 'last_name', 'email', 'tel_number')
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in COLUMNS:
+        op.create_index(f'ix_users_{column}_trgm', 'users', [column], unique=False, postgresql_using='gin',
+                        postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    for column in COLUMNS:
+        op.drop_index(f'ix_users_{column}_trgm', table_name='users')
@@ -0,0 +1,23 @@
+"""users updated_at index
+
+Revision ID: d2a6b8f41e07
+Revises: c7f3e9a12d54
+Create Date: 2026-10-18 13:21:15.640285
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a6b8f41e07'
+down_revision = 'c7f3e9a12d54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_updated_at_id', 'users', ['updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_updated_at_id', table_name='users')
@@ -1,24 +1,108 @@
+import re
+
 from fastapi import HTTPException, status
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from sqlalchemy.exc import SQLAlchemyError
 
 from src.conf.config import settings
+from src.database.pool import InstrumentedPool, pool_metrics
+from src.services.resources import resources
 
 
 URI = settings.sqlalchemy_database_url
 
-engine = create_engine(URI, echo=True)
-DBSession = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+def engine_options(uri: str) -> dict:
+    options = {"echo": settings.db_echo}
+    if not uri.startswith('sqlite'):
+        options.update(poolclass=InstrumentedPool, pool_size=settings.db_pool_size,
+                       max_overflow=settings.db_max_overflow, pool_timeout=settings.db_pool_timeout,
+                       pool_recycle=settings.db_pool_recycle, pool_pre_ping=settings.db_pool_pre_ping)
+    return options
+
+
+def create_engine() -> AsyncEngine:
+    engine = create_async_engine(URI, **engine_options(URI))
+    pool_metrics.attach(engine.sync_engine)
+    return engine
+
+
+resources.register("engine", create_engine, close=lambda engine: engine.dispose())
+
+
+def get_engine() -> AsyncEngine:
+    """
+    The get_engine function returns the engine of this worker, creating it on first use.
+    The driver is imported and the pool is built only then, and the lifespan disposes of it on shutdown.
+
+    :return: The database engine
+    :doc-author: Trelent
+    """
+    return resources.get("engine")
+
+
+class LazySessionMaker:
+    """
+    An async_sessionmaker bound to whatever engine get_engine returns, so sessions can be opened
+    before the engine exists and after it was disposed and created again.
+    """
+
+    def __init__(self, **kw):
+        self.kw = kw
+        self._engine = None
+        self._maker = None
+
+    def __call__(self, **local_kw) -> AsyncSession:
+        engine = get_engine()
+        if engine is not self._engine:
+            self._maker = async_sessionmaker(bind=engine, **self.kw)
+            self._engine = engine
+        return self._maker(**local_kw)
+
+
+DBSession = LazySessionMaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+def _trigrams(value: str) -> set:
+    grams = set()
+    for word in re.findall(r'[^\W_]+', value.lower()):
+        word = f'  {word} '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def trigram_similarity(left, right):
+    """
+    The trigram_similarity function mirrors pg_trgm's similarity(): the share of distinct
+    three-letter groups two strings have in common. It is registered on SQLite connections
+    so the fuzzy search works on the test database too.
+
+    :param left: The first string
+    :param right: The second string
+    :return: A number between 0 and 1, or None if either value is NULL
+    :doc-author: Trelent
+    """
+    if left is None or right is None:
+        return None
+    left, right = _trigrams(str(left)), _trigrams(str(right))
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+@event.listens_for(Engine, "connect")
+def register_sqlite_functions(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__.startswith(('sqlite3', 'sqlalchemy.dialects.sqlite')):
+        dbapi_connection.create_function("similarity", 2, trigram_similarity, deterministic=True)
 
 
 # Dependency
-def get_db():
-    db = DBSession()
-    try:
-        yield db
-    except SQLAlchemyError as err:
-        db.rollback()
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
-    finally:
-        db.close()
+async def get_db():
+    async with DBSession() as db:
+        try:
+            yield db
+        except SQLAlchemyError as err:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
@@ -1,8 +1,8 @@
 import enum
 
-from sqlalchemy.types import Integer, String, DateTime, Date
-from sqlalchemy import Column, func, Enum, Boolean
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.types import Integer, String, DateTime, Date, JSON
+from sqlalchemy import Column, func, Enum, Boolean, Index, extract
+from sqlalchemy.orm import declarative_base, synonym
 
 
 Base = declarative_base()
@@ -14,26 +14,74 @@ class Role(enum.Enum):
     guest: str = 'guest'
 
 
+class MailStatus(enum.Enum):
+    pending: str = 'pending'
+    sent: str = 'sent'
+    failed: str = 'failed'
+
+
+class AvatarStatus(enum.Enum):
+    ready: str = 'ready'
+    processing: str = 'processing'
+    failed: str = 'failed'
+
+
 class User(Base):
     __tablename__ = "users" # noqa
     id = Column(Integer, primary_key=True, index=True)
-    first_name = Column(String(20), index=True)
-    last_name = Column(String(30), index=True)
+    firstname = Column('first_name', String(20), index=True)
+    lastname = Column('last_name', String(30), index=True)
     email = Column(String(150), unique=True, index=True)
-    tel_number = Column(Integer)
+    phone = Column('tel_number', String(15))
+    additional_info = Column(String(150), nullable=True, server_default='nothing yet')
     birthday = Column(Date, default=func.now())
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        Index('ix_users_updated_at_id', 'updated_at', 'id'),
+    )
+
+
+# last_name is nullable; keyset pagination sorts NULL as '' so the row comparison never meets a NULL
+last_name_key = func.coalesce(User.lastname, '')
+Index('ix_users_last_name_id', last_name_key, User.id)
+
+birthday_month = extract('month', User.birthday)
+birthday_day = extract('day', User.birthday)
+Index('ix_users_birthday_month_day', birthday_month, birthday_day, User.id)
+
+for _column in ('first_name', 'last_name', 'email', 'tel_number'):
+    Index(f'ix_users_{_column}_trgm', User.__table__.c[_column], postgresql_using='gin',
+          postgresql_ops={_column: 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+
 
 class Guest(Base):
     __tablename__ = "guest"
     id = Column(Integer, primary_key=True)
     guest_name = Column(String(50))
+    username = synonym('guest_name')
     email = Column(String(150), nullable=False, unique=True)
     password = Column(String(255), nullable=False)
     refresh_token = Column(String(255), nullable=True)
     avatar = Column(String(255), nullable=True)
+    avatar_hash = Column(String(64), nullable=True)
+    avatar_status = Column(Enum(AvatarStatus), default=AvatarStatus.ready)
     roles = Column('roles', Enum(Role), default=Role.guest)
     confirmed = Column(Boolean, default=False)
 
+
+class MailOutbox(Base):
+    __tablename__ = "mail_outbox"
+    id = Column(Integer, primary_key=True)
+    key = Column(String(255), nullable=False, unique=True)
+    kind = Column(String(50), nullable=False)
+    recipient = Column(String(150), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(Enum(MailStatus), nullable=False, default=MailStatus.pending)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(String(255))
+    created_at = Column(DateTime, default=func.now())
+    sent_at = Column(DateTime)
+    __table_args__ = (Index('ix_mail_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
@@ -0,0 +1,84 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+
+from src.services.metrics import Histogram
+
+CHECKOUT_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkout_wait = Histogram(CHECKOUT_WAIT_BUCKETS)
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+
+    def attach(self, target) -> None:
+        """
+        The attach function counts connection churn of an engine's pool: connections opened, closed and invalidated.
+        Listening on the engine keeps counting after the pool is recreated by dispose().
+
+        :param self: Represent the instance of the class
+        :param target: The sync Engine (or Pool) to listen to
+        :return: None
+        :doc-author: Trelent
+        """
+        event.listen(target, "connect", self._on_connect)
+        event.listen(target, "close", self._on_close)
+        event.listen(target, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.connects += 1
+
+    def _on_close(self, dbapi_connection, connection_record):
+        self.closes += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.invalidations += 1
+
+    def snapshot(self, pool: Pool) -> dict:
+        """
+        The snapshot function returns the current pool usage together with the counters collected so far.
+
+        :param self: Represent the instance of the class
+        :param pool: Pool: The pool whose usage is reported
+        :return: A dictionary of pool statistics
+        :doc-author: Trelent
+        """
+        usage = {}
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            usage = {"size": pool.size(), "checked_out": pool.checkedout(), "checked_in": pool.checkedin(),
+                     "overflow": pool.overflow(), "max_overflow": pool._max_overflow}
+        return {
+            **usage,
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.checkout_timeouts,
+            "connects": self.connects,
+            "closes": self.closes,
+            "invalidations": self.invalidations,
+            "checkout_wait_seconds": self.checkout_wait.snapshot(),
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """A queue pool that records how long every checkout waited for a connection in pool_metrics."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.checkout_timeouts += 1
+            raise
+        finally:
+            pool_metrics.checkout_wait.observe(time.perf_counter() - started)
+        pool_metrics.checkouts += 1
+        return connection
@@ -1,86 +1,177 @@
-from datetime import date, datetime
+import calendar
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
 
-from sqlalchemy.orm import Session
-from src.database.models import User
+from sqlalchemy import select, tuple_, or_, and_, case, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database.models import User, birthday_month, birthday_day
+from src.repository.users import encode_cursor, decode_cursor
 
+SIMILARITY_THRESHOLD = 0.3
+SEARCH_COLUMNS = (User.firstname, User.lastname, User.email, User.phone)
 
-async def get_user_by_firstname(firstname: str, db: Session):
+
+async def get_user_by_firstname(firstname: str, db: AsyncSession):
     """
     The get_user_by_firstname function returns a user by firstname.
         Args:
             firstname (str): The name of the user to find.
 
     :param firstname: str: Define the type of parameter that will be passed into the function
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The first contact in the database whose firstname matches the given name
     :doc-author: Trelent
     """
-    contact = db.query(User).filter_by(firstname=firstname).first()
+    contact = await db.execute(select(User).filter_by(firstname=firstname))
+    contact = contact.scalars().first()
     print(f"find : {contact}")
     return contact
 
 
-async def get_user_by_lastname(lastname: str, db: Session):
+async def get_user_by_lastname(lastname: str, db: AsyncSession):
     """
     The get_user_by_lastname function takes a lastname and returns the user with that lastname.
 
     :param lastname: str: Specify the lastname of the user we want to retrieve
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The first user with the given lastname
     :doc-author: Trelent
     """
-    contact = db.query(User).filter_by(lastname=lastname).first()
+    contact = await db.execute(select(User).filter_by(lastname=lastname))
+    contact = contact.scalars().first()
     return contact
 
 
-async def get_user_by_email(email: str, db: Session):
+async def get_user_by_email(email: str, db: AsyncSession):
     """
     The get_user_by_email function takes in an email address and a database session.
     It then queries the database for a user with that email address, returning the first result if it exists.
 
     :param email: str: Pass in the email of the user we want to get
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A user object from the database
     :doc-author: Trelent
     """
-    contact = db.query(User).filter_by(email=email).first()
+    contact = await db.execute(select(User).filter_by(email=email))
+    contact = contact.scalars().first()
     return contact
 
 
-async def get_user_by_phone(phone: str, db: Session):
+async def get_user_by_phone(phone: str, db: AsyncSession):
     """
     The get_user_by_phone function takes a phone number and returns the user associated with that phone number.
         Args:
             phone (str): The user's phone number.
-            db (Session): A database session object to query for the user.
+            db (AsyncSession): A database session object to query for the user.
 
     :param phone: str: Pass the phone number of the user to be retrieved
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A user object
     :doc-author: Trelent
     """
-    contact = db.query(User).filter_by(phone=phone).first()
+    contact = await db.execute(select(User).filter_by(phone=phone))
+    contact = contact.scalars().first()
     return contact
 
 
-async def get_birthday_list(shift: int, db: Session):
+def _like_pattern(value: str, mode: str) -> str:
+    value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{value}%' if mode == 'prefix' else f'%{value}%'
+
+
+async def search_users(query: str, db: AsyncSession, mode: str = 'fuzzy', limit: int = 20,
+                       after: Optional[str] = None) -> Tuple[List[User], Optional[str]]:
+    """
+    The search_users function finds contacts whose first name, last name, email or phone match the query.
+    The prefix and substring modes match case-insensitively with ILIKE; fuzzy mode also accepts values
+    that are trigram-similar to the query, so typos still match. On Postgres every mode is served by the
+    pg_trgm GIN indexes; SQLite falls back to a Python similarity() with the same definition.
+    Results are ranked by their best trigram similarity to the query, best first.
+
+    :param query: str: The text to search for
+    :param db: AsyncSession: Pass the database session to the function
+    :param mode: str: One of prefix, substring or fuzzy
+    :param limit: int: The maximum number of contacts on the page
+    :param after: Optional[str]: The cursor returned with the previous page
+    :return: A list of matching contacts and the cursor of the next page
+    :doc-author: Trelent
+    """
+    postgres = db.get_bind().dialect.name == 'postgresql'
+    similarities = [func.coalesce(func.similarity(column, query), 0.0) for column in SEARCH_COLUMNS]
+    score = (func.greatest if postgres else func.max)(*similarities)
+
+    pattern = _like_pattern(query, mode)
+    conditions = [column.ilike(pattern, escape='\\') for column in SEARCH_COLUMNS]
+    if mode == 'fuzzy':
+        if postgres:
+            conditions += [column.op('%')(query) for column in SEARCH_COLUMNS]
+        else:
+            conditions += [similarity >= SIMILARITY_THRESHOLD for similarity in similarities]
+
+    stmt = select(User, score.label('score')).where(or_(*conditions)).order_by(score.desc(), User.id)
+    if after:
+        last_score, user_id = decode_cursor(after, 2)
+        if not isinstance(last_score, (int, float)):
+            raise ValueError('Invalid cursor')
+        stmt = stmt.where(or_(score < last_score, and_(score == last_score, User.id > user_id)))
+
+    rows = await db.execute(stmt.limit(limit + 1))
+    rows = rows.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1].score, rows[-1].User.id])
+    return [row.User for row in rows], next_cursor
+
+
+def _month_day(day: date, leap_day_as_march_first: bool = False) -> Tuple[int, int]:
+    if leap_day_as_march_first and (day.month, day.day) == (3, 1) and not calendar.isleap(day.year):
+        return 2, 29
+    return day.month, day.day
+
+
+async def get_birthday_list(shift: int, db: AsyncSession, limit: int = 50,
+                            after: Optional[str] = None) -> Tuple[List[User], Optional[str]]:
     """
     The get_birthday_list function takes in a shift value and a database connection.
-    It then returns all contacts whose birthday is within the next 'shift' days.
+    It returns the contacts whose birthday is within the next 'shift' days, soonest first.
+    The window is matched on (month, day) in SQL, so it is served by the ix_users_birthday_month_day
+    index instead of loading the whole table. Windows that run past New Year are split in two ranges,
+    and Feb 29 birthdays fall on Mar 1 in non-leap years.
 
     :param shift: int: Set the range of days in which to look for birthdays
-    :param db: Session: Access the database
-    :return: A list of contacts whose birthday is within the next 7 days
+    :param db: AsyncSession: Access the database
+    :param limit: int: The maximum number of contacts on the page
+    :param after: Optional[str]: The cursor returned with the previous page
+    :return: A list of contacts whose birthday is within the window and the cursor of the next page
     :doc-author: Trelent
     """
-    contacts = []
-    all_contacts = db.query(User).all()
     today = date.today()
-    for contact in all_contacts:
-        birthday = contact.birthday
-        evaluated_date = (datetime(today.year, birthday.month, birthday.day).date() - today).days
-        if evaluated_date < 0:
-            evaluated_date = (datetime(today.year + 1, birthday.month, birthday.day).date() - today).days
-        if evaluated_date <= shift:
-            contacts.append(contact)
-    return contacts
+    month_day = tuple_(birthday_month, birthday_day)
+    start = _month_day(today, leap_day_as_march_first=True)
+    wrapped = case((month_day < tuple_(*start), 1), else_=0)
+
+    stmt = select(User).order_by(wrapped, birthday_month, birthday_day, User.id)
+    if shift < 365:
+        end_day = today + timedelta(days=shift)
+        end = _month_day(end_day)
+        if end_day.year == today.year:
+            stmt = stmt.where(month_day.between(tuple_(*start), tuple_(*end)))
+        else:
+            stmt = stmt.where(or_(month_day >= tuple_(*start), month_day <= tuple_(*end)))
+    if after:
+        month, day, user_id = decode_cursor(after, 3)
+        if not isinstance(month, int) or not isinstance(day, int):
+            raise ValueError('Invalid cursor')
+        after_wrapped = 1 if (month, day) < start else 0
+        stmt = stmt.where(tuple_(wrapped, birthday_month, birthday_day, User.id) >
+                          tuple_(after_wrapped, month, day, user_id))
+
+    contacts = await db.execute(stmt.limit(limit + 1))
+    contacts = contacts.scalars().all()
+    next_cursor = None
+    if len(contacts) > limit:
+        contacts = contacts[:limit]
+        last = contacts[-1]
+        next_cursor = encode_cursor([last.birthday.month, last.birthday.day, last.id])
+    return contacts, next_cursor
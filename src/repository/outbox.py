@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import MailOutbox, MailStatus
+
+
+async def enqueue(key: str, kind: str, recipient: str, payload: dict, db: AsyncSession,
+                  commit: bool = True) -> bool:
+    """
+    The enqueue function adds a message to the outbox and commits it.
+    With commit=False the message joins the caller's transaction, so it is stored only if the change
+    it announces is.
+    The key deduplicates messages: a second message with the same key is dropped by ON CONFLICT DO NOTHING.
+
+    :param key: str: The deduplication key of the message
+    :param kind: str: The kind of message, which selects how it is rendered
+    :param recipient: str: The email address to send the message to
+    :param payload: dict: The values the message is rendered with
+    :param db: AsyncSession: Access the database
+    :param commit: bool: Commit the transaction, or leave that to the caller
+    :return: True if the message was added, False if it was a duplicate
+    :doc-author: Trelent
+    """
+    dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(MailOutbox).values(key=key, kind=kind, recipient=recipient, payload=payload,
+                                             status=MailStatus.pending, attempts=0,
+                                             next_attempt_at=datetime.utcnow())
+    stmt = stmt.on_conflict_do_nothing(index_elements=[MailOutbox.key]).returning(MailOutbox.id)
+    inserted = await db.execute(stmt)
+    inserted = inserted.scalar()
+    if commit:
+        await db.commit()
+    return inserted is not None
+
+
+async def claim(batch_size: int, lease: timedelta, db: AsyncSession) -> List[MailOutbox]:
+    """
+    The claim function takes up to batch_size due messages for delivery and commits the claim.
+    Claiming counts an attempt and pushes next_attempt_at out by lease, so a worker that dies while sending
+    only delays the message. FOR UPDATE SKIP LOCKED lets several workers claim from Postgres concurrently.
+
+    :param batch_size: int: The maximum number of messages to claim
+    :param lease: timedelta: How long the messages are reserved for this worker
+    :param db: AsyncSession: Access the database
+    :return: The claimed messages, oldest first
+    :doc-author: Trelent
+    """
+    now = datetime.utcnow()
+    due = select(MailOutbox.id).where(MailOutbox.status == MailStatus.pending, MailOutbox.next_attempt_at <= now)
+    due = due.order_by(MailOutbox.id).limit(batch_size).with_for_update(skip_locked=True)
+    stmt = update(MailOutbox).where(MailOutbox.id.in_(due.scalar_subquery()))
+    stmt = stmt.values(attempts=MailOutbox.attempts + 1, next_attempt_at=now + lease).returning(MailOutbox)
+    messages = await db.scalars(stmt, execution_options={"synchronize_session": False})
+    messages = sorted(messages.all(), key=lambda message: message.id)
+    await db.commit()
+    return messages
+
+
+async def mark_sent(ids: List[int], db: AsyncSession) -> None:
+    """
+    The mark_sent function records the delivery of messages.
+
+    :param ids: List[int]: The ids of the delivered messages
+    :param db: AsyncSession: Access the database
+    :return: None
+    :doc-author: Trelent
+    """
+    if ids:
+        await db.execute(update(MailOutbox).where(MailOutbox.id.in_(ids))
+                         .values(status=MailStatus.sent, sent_at=datetime.utcnow(), last_error=None))
+        await db.commit()
+
+
+async def mark_failed(message: MailOutbox, error: str, retry_at: datetime, give_up: bool, db: AsyncSession) -> None:
+    """
+    The mark_failed function records a failed delivery: the message is retried at retry_at,
+    or marked failed for good when give_up is set.
+
+    :param message: MailOutbox: The message that could not be delivered
+    :param error: str: The delivery error
+    :param retry_at: datetime: When to try again
+    :param give_up: bool: Stop retrying the message
+    :param db: AsyncSession: Access the database
+    :return: None
+    :doc-author: Trelent
+    """
+    values = {"last_error": error[:255], "next_attempt_at": retry_at}
+    if give_up:
+        values["status"] = MailStatus.failed
+    await db.execute(update(MailOutbox).where(MailOutbox.id == message.id).values(**values))
+    await db.commit()
@@ -1,173 +1,435 @@
-from typing import Type
+import base64
+import json
+from datetime import datetime
+from typing import Type, List, Optional, Tuple, AsyncIterator
 
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select, text, tuple_, or_, update as sql_update, delete as sql_delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import User
+from src.database.models import User, Guest, AvatarStatus, Role, last_name_key
 from src.shemas import UserModel, GuestModel
+from src.services.cache import principal_cache, response_cache, token_cache
+from src.services.token_versions import token_versions
 
 
-async def get_users(db: Session):
+def encode_cursor(key: list) -> str:
     """
-    The get_users function returns a list of all users in the database.
+    The encode_cursor function packs the sort key of the last row on a page into an opaque string.
+    The client passes it back unchanged as the after parameter to fetch the next page.
 
+    :param key: list: The sort key of the last row of the current page
+    :return: A url-safe cursor string
+    :doc-author: Trelent
+    """
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """
+    The decode_cursor function unpacks a cursor made by encode_cursor back into the sort key.
+    It raises ValueError if the cursor was tampered with or was issued for another ordering.
+
+    :param cursor: str: The cursor received from the client
+    :param size: int: The number of columns in the sort key
+    :return: The sort key of the last row seen by the client
+    :doc-author: Trelent
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list) or len(key) != size or not isinstance(key[-1], int):
+        raise ValueError('Invalid cursor')
+    return key
+
+
+async def get_users(db: AsyncSession, limit: int = 20, after: Optional[str] = None,
+                    order_by: str = 'id') -> Tuple[List[User], Optional[str]]:
+    """
+    The get_users function returns one page of users using keyset pagination.
+    Instead of OFFSET it seeks past the sort key stored in the cursor, so a deep page
+    costs the same index range scan as the first one.
+    Users without a last name sort as an empty last name, first.
+
+    :param db: AsyncSession: Pass in the database session
+    :param limit: int: The maximum number of users on the page
+    :param after: Optional[str]: The cursor returned with the previous page
+    :param order_by: str: Sort by id or by (last_name, id)
+    :return: A list of users and the cursor of the next page, or None on the last page
+    :doc-author: Trelent
+    """
+    if order_by == 'last_name':
+        stmt = select(User).order_by(last_name_key, User.id)
+        if after:
+            lastname, user_id = decode_cursor(after, 2)
+            if not isinstance(lastname, str):
+                raise ValueError('Invalid cursor')
+            stmt = stmt.where(tuple_(last_name_key, User.id) > tuple_(lastname, user_id))
+    else:
+        stmt = select(User).order_by(User.id)
+        if after:
+            user_id, = decode_cursor(after, 1)
+            stmt = stmt.where(User.id > user_id)
+    users = await db.execute(stmt.limit(limit + 1))
+    users = users.scalars().all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        next_cursor = encode_cursor([last.lastname or '', last.id] if order_by == 'last_name' else [last.id])
+    return users, next_cursor
+
+
+async def stream_users(db: AsyncSession, since: Optional[datetime] = None,
+                       batch_size: int = 1000) -> AsyncIterator[User]:
+    """
+    The stream_users function yields every user, oldest change first, through a server-side cursor.
+    Rows are fetched batch_size at a time, so memory does not grow with the size of the table.
+    With since only users updated at or after that moment are returned; the (updated_at, id) index
+    serves both the filter and the order.
+
+    :param db: AsyncSession: Pass in the database session
+    :param since: Optional[datetime]: Only return users updated at or after this moment
+    :param batch_size: int: The number of rows fetched per round trip
+    :return: An async iterator of users
+    :doc-author: Trelent
+    """
+    stmt = select(User).order_by(User.updated_at, User.id).execution_options(yield_per=batch_size)
+    if since is not None:
+        stmt = stmt.where(User.updated_at >= since)
+    users = await db.stream_scalars(stmt)
+    async for user in users:
+        yield user
+
+
+async def get_users_estimated_total(db: AsyncSession) -> Optional[int]:
+    """
+    The get_users_estimated_total function reads the planner's row estimate for the users table.
+    It is refreshed by VACUUM/ANALYZE, so it is approximate but costs nothing compared to COUNT(*).
+    Databases without planner statistics return None.
 
-    :param db: Session: Pass in the database session
-    :return: A list of users
+    :param db: AsyncSession: Pass in the database session
+    :return: The estimated number of users or None
     :doc-author: Trelent
     """
-    users = db.query(User).all()
-    return users
+    if db.get_bind().dialect.name != 'postgresql':
+        return None
+    total = await db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass"))
+    total = total.scalar()
+    if total is None or total < 0:
+        return None
+    return total
 
 
-async def get_user_by_id(user_id: int, db: Session):
+async def get_user_by_id(user_id: int, db: AsyncSession):
     """
     The get_user_by_id function takes in a user_id and db Session object,
     and returns the User object with that id. If no such user exists, it returns None.
 
     :param user_id: int: Specify the type of data that is expected to be passed into the function
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A user object
     :doc-author: Trelent
     """
-    user = db.query(User).filter_by(id=user_id).first()
-    return user
+    user = await db.execute(select(User).filter_by(id=user_id))
+    return user.scalars().first()
+
 
+async def get_users_by_keys(ids: List[int], emails: List[str], db: AsyncSession) -> List[User]:
+    """
+    The get_users_by_keys function loads every user whose id is in ids or whose email is in emails
+    with a single query. Users come back in no particular order and at most once each.
 
-async def get_user_by_email(email: str, db: Session):
+    :param ids: List[int]: The ids to look up
+    :param emails: List[str]: The emails to look up
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The users that exist
+    :doc-author: Trelent
+    """
+    conditions = []
+    if ids:
+        conditions.append(User.id.in_(set(ids)))
+    if emails:
+        conditions.append(User.email.in_(set(emails)))
+    if not conditions:
+        return []
+    users = await db.scalars(select(User).where(or_(*conditions)))
+    return users.all()
+
+
+async def get_user_by_email(email: str, db: AsyncSession):
     """
     The get_user_by_email function takes in an email and a database session,
     and returns the user associated with that email. If no such user exists, it returns None.
 
     :param email: str: Pass in the email address of the user we want to retrieve
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A user object
     :doc-author: Trelent
     """
-    user = db.query(User).filter_by(email=email).first()
-    return user
+    user = await db.execute(select(User).filter_by(email=email))
+    return user.scalars().first()
+
+
+async def get_guest_by_email(email: str, db: AsyncSession):
+    """
+    The get_guest_by_email function takes in an email and a database session,
+    and returns the guest account registered with that email. If no such guest exists, it returns None.
+
+    :param email: str: Pass in the email address of the guest we want to retrieve
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A guest object
+    :doc-author: Trelent
+    """
+    guest = await db.execute(select(Guest).filter_by(email=email))
+    return guest.scalars().first()
 
 
-async def create(body: UserModel, db: Session):
+async def create(body: UserModel, db: AsyncSession):
     """
     The create function creates a new user in the database.
         Args:
             body (UserModel): The UserModel object to be created.
-            db (Session): The SQLAlchemy session object used for querying the database.
+            db (AsyncSession): The SQLAlchemy session object used for querying the database.
+
+    The row is inserted and read back by one INSERT ... ON CONFLICT DO NOTHING RETURNING statement.
 
     :param body: UserModel: Validate the body of the request
-    :param db: Session: Access the database
-    :return: A user object
+    :param db: AsyncSession: Access the database
+    :return: A user object, or None if the email already exists
     :doc-author: Trelent
     """
-    user = User(**body.dict())
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(User).values(**body.dict())
+    user = await db.scalar(stmt.on_conflict_do_nothing(index_elements=[User.email]).returning(User))
+    await db.commit()
+    if user:
+        await response_cache.invalidate("find")
     return user
 
 
-async def update(user_id: int, body: UserModel, db: Session):
+async def create_many(bodies: List[UserModel], db: AsyncSession) -> List[str]:
+    """
+    The create_many function inserts a batch of users with one multi-row INSERT and commits it.
+    Rows whose email already exists are skipped by ON CONFLICT DO NOTHING instead of failing the batch.
+
+    :param bodies: List[UserModel]: The validated users to insert
+    :param db: AsyncSession: Access the database
+    :return: The emails of the users that were inserted
+    :doc-author: Trelent
+    """
+    if not bodies:
+        return []
+    dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(User).values([body.dict() for body in bodies])
+    stmt = stmt.on_conflict_do_nothing(index_elements=[User.email]).returning(User.email)
+    emails = await db.execute(stmt)
+    emails = emails.scalars().all()
+    await db.commit()
+    if emails:
+        await response_cache.invalidate("find")
+    return emails
+
+
+async def update(user_id: int, body: UserModel, db: AsyncSession):
     """
     The update function updates a user in the database.
         Args:
             user_id (int): The id of the user to update.
             body (UserModel): The updated version of the UserModel object.
 
+    The row is changed and read back by one UPDATE ... RETURNING statement.
+
     :param user_id: int: Identify the user to be deleted
     :param body: UserModel: Get the user's email from the request body
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The updated user object
     :doc-author: Trelent
     """
-    user = await get_user_by_id(user_id, db)
+    stmt = sql_update(User).where(User.id == user_id).values(email=body.email).returning(User)
+    user = await db.scalar(stmt, execution_options={"populate_existing": True})
+    await db.commit()
     if user:
-        user.email = body.email
-        db.commit()
+        await response_cache.invalidate(f"user:{user_id}", "find")
     return user
 
 
-async def remove(user_id: int, db: Session):
+async def remove(user_id: int, db: AsyncSession):
     """
     The remove function removes a user from the database.
         Args:
             user_id (int): The id of the user to remove.
-            db (Session): A connection to the database.
+            db (AsyncSession): A connection to the database.
+
+    The row is deleted and returned by one DELETE ... RETURNING statement.
 
     :param user_id: int: Specify the user id of the user to be removed
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The user that was removed
     :doc-author: Trelent
     """
-    user = await get_user_by_id(user_id, db)
+    user = await db.scalar(sql_delete(User).where(User.id == user_id).returning(User))
+    await db.commit()
     if user:
-        db.delete(user)
-        db.commit()
+        await response_cache.invalidate(f"user:{user_id}", "find")
     return user
 
 
-async def create_guest(body: GuestModel, db: Session):
+async def _bulk(stmt, dry_run: bool, db: AsyncSession) -> List[int]:
+    ids = await db.execute(stmt.returning(User.id), execution_options={"synchronize_session": False})
+    ids = ids.scalars().all()
+    if dry_run:
+        await db.rollback()
+        return ids
+    await db.commit()
+    if ids:
+        await response_cache.invalidate(*[f"user:{user_id}" for user_id in ids], "find")
+    return ids
+
+
+async def bulk_update(conditions: list, values: dict, dry_run: bool, db: AsyncSession) -> List[int]:
+    """
+    The bulk_update function changes every user matching the conditions with one UPDATE ... WHERE ... RETURNING.
+    The statement runs in a single transaction; a dry run executes it the same way and rolls it back,
+    so the ids are exactly the users that would change and constraint violations show up just as they would.
+
+    :param conditions: list: The WHERE conditions, see compile_filter
+    :param values: dict: The SET clause, see compile_values
+    :param dry_run: bool: Roll back instead of committing
+    :param db: AsyncSession: Access the database
+    :return: The ids of the changed users
+    :doc-author: Trelent
+    """
+    return await _bulk(sql_update(User).where(*conditions).values(values), dry_run, db)
+
+
+async def bulk_delete(conditions: list, dry_run: bool, db: AsyncSession) -> List[int]:
+    """
+    The bulk_delete function removes every user matching the conditions with one DELETE ... WHERE ... RETURNING.
+    A dry run executes the statement and rolls it back.
+
+    :param conditions: list: The WHERE conditions, see compile_filter
+    :param dry_run: bool: Roll back instead of committing
+    :param db: AsyncSession: Access the database
+    :return: The ids of the removed users
+    :doc-author: Trelent
+    """
+    return await _bulk(sql_delete(User).where(*conditions), dry_run, db)
+
+
+async def create_guest(body: GuestModel, db: AsyncSession):
     """
     The create_guest function creates a new guest in the database.
 
+    The row is inserted and read back by one INSERT ... ON CONFLICT DO NOTHING RETURNING statement.
+    The transaction is left open: the caller commits it together with the confirmation email in the outbox.
+
     :param body: GuestModel: Pass the data from the request body into this function
-    :param db: Session: Create a connection to the database
-    :return: A tuple containing the new guest object
+    :param db: AsyncSession: Create a connection to the database
+    :return: The new guest object, or None if the email already exists
     :doc-author: Trelent
     """
     g = Gravatar(body.email)
 
-    new_guest = User(**body.dict(), avatar=g.get_image()),
-    db.add(new_guest)
-    db.commit()
-    db.refresh(new_guest)
+    dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(Guest).values(**body.dict(), avatar=g.get_image())
+    return await db.scalar(stmt.on_conflict_do_nothing(index_elements=[Guest.email]).returning(Guest))
 
 
-async def update_token(user: User, refresh_token, db: Session):
+async def update_roles(guest_id: int, role: Role, db: AsyncSession) -> Guest | None:
     """
-    The update_token function updates the refresh token for a user in the database.
-        Args:
-            user (User): The User object to update.
-            refresh_token (str): The new refresh token to store in the database.
-            db (Session): A connection to our Postgres database.
+    The update_roles function changes the role of a guest.
+    The token version of the guest is bumped, so access tokens that still carry the old role stop working.
 
-    :param user: User: Pass in the user object
-    :param refresh_token: Update the refresh_token in the database
-    :param db: Session: Access the database
-    :return: The user object
+    :param guest_id: int: The id of the guest
+    :param role: Role: The new role
+    :param db: AsyncSession: Access the database
+    :return: The guest or None if it does not exist
     :doc-author: Trelent
     """
-    user.refresh_token = refresh_token
-    db.commit()
+    stmt = sql_update(Guest).where(Guest.id == guest_id).values(roles=role).returning(Guest)
+    guest = await db.scalar(stmt, execution_options={"populate_existing": True})
+    await db.commit()
+    if guest:
+        await token_versions.bump(guest.id)
+        token_cache.evict_subject(guest.email)
+        await principal_cache.invalidate(guest.email)
+    return guest
 
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: AsyncSession) -> None:
     """
     The confirmed_email function takes in an email and a database session,
     and sets the confirmed field of the user with that email to True.
 
 
+    The caller has already loaded the user, so the flag is set by a single UPDATE without reading the row again.
+
     :param email: str: Specify the email address of the user to confirm
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: None
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.confirmed = True
-    db.commit()
+    await db.execute(sql_update(Guest).where(Guest.email == email).values(confirmed=True))
+    await db.commit()
+    await principal_cache.invalidate(email)
+
+
+async def start_avatar_update(email: str, digest: str, db: AsyncSession) -> Guest | None:
+    """
+    The start_avatar_update function records that a new avatar is being uploaded for a user.
+    The digest identifies the requested image, so an upload that finishes after a newer one was requested is ignored.
+
+    :param email: str: Find the user in the database
+    :param digest: str: The content hash of the new avatar
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The user object
+    :doc-author: Trelent
+    """
+    stmt = sql_update(Guest).where(Guest.email == email).values(
+        avatar_hash=digest, avatar_status=AvatarStatus.processing).returning(Guest)
+    user = await db.scalar(stmt, execution_options={"populate_existing": True})
+    await db.commit()
+    return user
 
 
-async def update_avatar(email, url: str, db: Session) -> Type[User] | None:
+async def update_avatar(email, url: str, db: AsyncSession, digest: Optional[str] = None) -> Type[Guest] | None:
     """
     The update_avatar function updates the avatar of a user.
+    With a digest, the avatar is only replaced while that image is still the one the user asked for last;
+    the check is part of the WHERE clause of the single UPDATE, so a newer request can not slip in between.
 
     :param email: Find the user in the database
     :param url: str: Specify the type of data that will be passed to the function
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
+    :param digest: Optional[str]: The content hash of the uploaded avatar
     :return: A user object if the update was successful
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.avatar = url
-    db.commit()
+    stmt = sql_update(Guest).where(Guest.email == email)
+    if digest is not None:
+        stmt = stmt.where(Guest.avatar_hash == digest)
+    stmt = stmt.values(avatar=url, avatar_status=AvatarStatus.ready).returning(Guest)
+    user = await db.scalar(stmt, execution_options={"populate_existing": True})
+    await db.commit()
+    if user:
+        await principal_cache.invalidate(email)
     return user
+
+
+async def fail_avatar_update(email: str, digest: str, db: AsyncSession) -> None:
+    """
+    The fail_avatar_update function marks the pending avatar upload of a user as failed.
+    The previous avatar stays in place, and the user can upload the same image again.
+
+    :param email: str: Find the user in the database
+    :param digest: str: The content hash of the avatar that could not be uploaded
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    :doc-author: Trelent
+    """
+    await db.execute(sql_update(Guest).where(Guest.email == email, Guest.avatar_hash == digest)
+                     .values(avatar_status=AvatarStatus.failed))
+    await db.commit()
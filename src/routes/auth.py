@@ -1,11 +1,15 @@
-from fastapi import Depends, HTTPException, status, APIRouter, Security, BackgroundTasks, Request
+from fastapi import Depends, HTTPException, status, APIRouter, Security, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.repository import users as repository_users
 from src.services.auth import auth_service
-from src.services.email import send_email
+from src.services.cache import token_cache
+from src.services.email import enqueue_confirmation
+from src.services.refresh_tokens import refresh_families
+from src.services.token_versions import token_versions
+from src.conf.config import settings
 from src.shemas import GuestModel, GuestResponse, TokenModel, RequestEmail
 
 router = APIRouter(prefix="/auth", tags=['auth'])
@@ -13,82 +17,101 @@ security = HTTPBearer()
 
 
 @router.post("/signup", response_model=GuestResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: GuestModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: GuestModel, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
         It takes in a GuestModel object, which is validated by pydantic.
         The password is hashed using the auth_service module and then stored as an encrypted string.
         A new guest is created with this information and returned to the client.
+        The confirmation email is put into the outbox in the same transaction and sent by the mail delivery workers.
 
     :param body: GuestModel: Get the data from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the application
-    :param db: Session: Connect to the database
+    :param db: AsyncSession: Connect to the database
     :return: A guestmodel, which is a usermodel with only the email and password fields
     :doc-author: Trelent
     """
-    exist_user = await repository_users.get_user_by_email(body.email, db)
-    if exist_user:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
     new_guest = await repository_users.create_guest(body, db)
-    background_tasks.add_task(send_email, new_guest.email, new_guest.username, request.base_url)
+    if new_guest is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
+    await enqueue_confirmation(new_guest.email, new_guest.username, request.base_url, db, commit=False)
+    await db.commit()
     return new_guest
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
         It takes the username and password from the request body,
         verifies that they are correct, and returns an access token.
 
     :param body: OAuth2PasswordRequestForm: Validate the request body
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A token
     :doc-author: Trelent
     """
-    user = await repository_users.get_user_by_email(body.username, db)
+    user = await repository_users.get_guest_by_email(body.username, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    if not await auth_service.verify_password(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
     # Generate JWT
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    claims = await auth_service.create_claims(user)
+    access_token = await auth_service.create_access_token(data=claims)
+    jti = refresh_families.new_id()
+    family = await refresh_families.start(jti, settings.refresh_token_ttl)
+    refresh_token = await auth_service.create_refresh_token(data={**claims, "jti": jti, "fam": family},
+                                                            expires_delta=settings.refresh_token_ttl)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security),
+                        db: AsyncSession = Depends(get_db)):
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns an access_token, a new refresh_token, and the type of token.
-        If the user's current refresh_token does not match what was passed into this function then it will return an error.
+        The new refresh token replaces the presented one in its family; presenting a replaced token again
+        revokes the family and bumps the token version of the user, so the access tokens already issued
+        are rejected too. The claims are carried over from the refresh token, so only Redis is used;
+        the database is read only when the roles of the user changed since the token was issued.
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the header
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Read the current roles after a role change
     :return: A json object with the following fields:
     :doc-author: Trelent
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    claims = await auth_service.decode_refresh_token(credentials.credentials)
+    email, family = claims["sub"], claims["fam"]
+    jti = refresh_families.new_id()
+    if not await refresh_families.rotate(family, claims["jti"], jti, settings.refresh_token_ttl):
+        user_id = claims.get("uid")
+        if user_id is None:
+            user = await repository_users.get_guest_by_email(email, db)
+            user_id = user.id if user else None
+        if user_id is not None:
+            await token_versions.bump(user_id)
+        token_cache.evict_subject(email)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    data = {claim: claims.get(claim) for claim in auth_service.ACCESS_CLAIMS}
+    if data["uid"] is None or data["ver"] != await token_versions.get(data["uid"]):
+        user = await repository_users.get_guest_by_email(email, db)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+        data = await auth_service.create_claims(user)
+    access_token = await auth_service.create_access_token(data=data)
+    refresh_token = await auth_service.create_refresh_token(data={**data, "jti": jti, "fam": family},
+                                                            expires_delta=settings.refresh_token_ttl)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
         It takes the token from the URL and uses it to get the user's email address.
@@ -98,12 +121,12 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
             confirmed_email function which sets the 'confirmed' field of that particular User object
 
     :param token: str: Get the token from the url
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A message indicating whether the email has been confirmed or not
     :doc-author: Trelent
     """
     email = auth_service.get_email_from_token(token)
-    user = await repository_users.get_user_by_email(email, db)
+    user = await repository_users.get_guest_by_email(email, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Verification error")
     if user.confirmed:
@@ -113,8 +136,7 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
 
 
 @router.post('/request_email')
-async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+async def request_email(body: RequestEmail, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The request_email function is used to send an email to the user with a link that they can click on
     to confirm their email address. The function takes in a RequestEmail object, which contains the
@@ -122,15 +144,14 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     with that email address and if so, it sends them an email with a confirmation link.
 
     :param body: RequestEmail: Get the email from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background
     :param request: Request: Get the base_url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A message to the user
     :doc-author: Trelent
     """
-    user = await repository_users.get_user_by_email(body.email, db)
+    user = await repository_users.get_guest_by_email(body.email, db)
     if user:
         if user.confirmed:
             return {"message": "Your email is already confirmed"}
-        background_tasks.add_task(send_email, user.email, user.username, request.base_url)
+        await enqueue_confirmation(user.email, user.username, request.base_url, db)
     return {"message": "Check your email for confirmation."}
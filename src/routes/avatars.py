@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+
+from src.services.storage import AvatarStorage, get_avatar_storage, LocalStorage, SendfileResponse, AVATAR_MEDIA_TYPE, IMMUTABLE
+
+router = APIRouter(prefix="/avatars", tags=['avatars'])
+
+
+@router.get("/{prefix}/{infix}/{name}.jpg")
+async def read_avatar(prefix: str, infix: str, name: str, request: Request,
+                      avatar_storage: AvatarStorage = Depends(get_avatar_storage)):
+    """
+    The read_avatar function serves an avatar from the local avatar storage.
+    The name is the content hash of the file, so it is sent with an immutable Cache-Control and the hash as ETag,
+    and a matching If-None-Match gets 304 without touching the disk.
+
+    :param prefix: str: The first shard directory
+    :param infix: str: The second shard directory
+    :param name: str: The content hash of the avatar
+    :param request: Request: Read If-None-Match
+    :param avatar_storage: AvatarStorage: The avatar storage of this worker
+    :return: The avatar image
+    :doc-author: Trelent
+    """
+    if not isinstance(avatar_storage, LocalStorage) or name[:2] != prefix or name[2:4] != infix:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    etag = f'"{name}"'
+    headers = {"Cache-Control": IMMUTABLE, "ETag": etag}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(',')]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    path = avatar_storage.path(name)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    return SendfileResponse(path, headers=headers, media_type=AVATAR_MEDIA_TYPE, stat_result=path.stat(),
+                            method=request.method)
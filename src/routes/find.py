@@ -1,18 +1,21 @@
 from typing import Optional
 
-from fastapi import Depends, HTTPException, status, APIRouter, Query
-from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException, status, APIRouter, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.database.models import User
 from src.services.auth import auth_service
-from src.shemas import UserResponse
+from src.services.cache import response_cache
+from src.services.serializers import user_serializer
+from src.conf.config import settings
+from src.shemas import UserResponse, UserPage
 from src.repository import find as repository_contacts
 
-find = APIRouter(prefix="/api/find", tags=['find'])
+find = APIRouter(prefix="/find", tags=['find'])
 
 
-async def get_user_by_search_parameter(search_param: str, value: str, db: Session, current_user: User) -> Optional[
+async def get_user_by_search_parameter(search_param: str, value: str, db: AsyncSession, current_user: User) -> Optional[
     UserResponse]:
     contact = None
     if search_param == "firstname":
@@ -29,40 +32,91 @@ async def get_user_by_search_parameter(search_param: str, value: str, db: Sessio
     return contact
 
 
-@find.get("/{search_param}")
-async def search_contact(search_param: str, value: str = Query(..., min_length=1), db: Session = Depends(get_db),
+def user_page(contacts, next_cursor: Optional[str]):
+    if settings.fast_json:
+        return {"items": user_serializer.dump_many(contacts), "next_cursor": next_cursor, "estimated_total": None}
+    return UserPage(items=contacts, next_cursor=next_cursor)
+
+
+@find.get("/", response_model=UserPage)
+async def search_contacts(request: Request, q: str = Query(..., min_length=1, max_length=100),
+                          mode: str = Query('fuzzy', regex='^(prefix|substring|fuzzy)$'),
+                          limit: int = Query(20, ge=1, le=100), after: Optional[str] = Query(None),
+                          db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The search_contacts function searches contacts by first name, last name, email and phone at once.
+    The prefix and substring modes match the start or any part of a field; fuzzy also tolerates typos.
+    Results are ranked best match first and paginated with next_cursor.
+
+    :param request: Request: Identify the cached response and read If-None-Match
+    :param q: str: The text to search for
+    :param mode: str: One of prefix, substring or fuzzy
+    :param limit: int: The maximum number of contacts on the page
+    :param after: Optional[str]: The cursor of the previous page
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the current user from the database
+    :return: A page of matching contacts
+    :doc-author: Trelent
+    """
+    async def load():
+        try:
+            contacts, next_cursor = await repository_contacts.search_users(q, db, mode, limit, after)
+        except ValueError as err:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+        return user_page(contacts, next_cursor)
+
+    return await response_cache.respond(request, "find", load)
+
+
+@find.get("/birthday_list", response_model=UserPage)
+async def get_birthday_list(request: Request, shift: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=100),
+                            after: Optional[str] = Query(None),
+                            db: AsyncSession = Depends(get_db),
+                            current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_birthday_list function returns a page of contacts with birthdays in the next shift days, soonest first.
+    For example, if shift is set to 1, then it will return all contacts with birthdays today or tomorrow.
+    Pass the next_cursor of a page as after to get the following one.
+
+    :param request: Request: Identify the cached response and read If-None-Match
+    :param shift: int: Determine the shift of birthdays to be returned
+    :param limit: int: The maximum number of contacts on the page
+    :param after: Optional[str]: The cursor of the previous page
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the current user from the database
+    :return: A page of contacts who have a birthday in the next shift days
+    :doc-author: Trelent
+    """
+    async def load():
+        try:
+            contacts, next_cursor = await repository_contacts.get_birthday_list(shift, db, limit, after)
+        except ValueError as err:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+        return user_page(contacts, next_cursor)
+
+    return await response_cache.respond(request, "find", load)
+
+
+@find.get("/{search_param}", response_model=UserResponse)
+async def search_contact(request: Request, search_param: str, value: str = Query(..., min_length=1), db: AsyncSession = Depends(get_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The search_contact function searches for a contact by either their username or email.
         The search_param parameter is the field to be searched, and value is the value of that field.
         If no user with that username or email exists, an HTTP 404 error will be returned.
 
+    :param request: Request: Identify the cached response and read If-None-Match
     :param search_param: str: Specify the search parameter (e
     :param value: str: Specify the value of the search parameter
     :param min_length: Specify the minimum length of the value parameter
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the user from the database
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = await get_user_by_search_parameter(search_param, value, db, current_user)
-    return contact
-
-
-@find.get("/birthday_list")
-async def get_birthday_list(shift: int = Query(0),
-                            db: Session = Depends(get_db),
-                            current_user: User = Depends(auth_service.get_current_user)):
-    """
-    The get_birthday_list function returns a list of contacts with birthdays in the next 7 days.
-    The shift parameter allows you to specify how many days ahead or behind you want to look for birthdays.
-    For example, if shift is set to 1, then it will return all contacts with birthdays tomorrow.
+    async def load():
+        contact = await get_user_by_search_parameter(search_param, value, db, current_user)
+        return user_serializer.dump(contact) if settings.fast_json else UserResponse.from_orm(contact)
 
-    :param shift: int: Determine the shift of birthdays to be returned
-    :param db: Session: Pass the database session to the function
-    :param current_user: User: Get the current user from the database
-    :return: A list of contacts who have a birthday in the next 30 days
-    :doc-author: Trelent
-    """
-    contacts = await repository_contacts.get_birthday_list(shift, db)
-    return contacts
+    return await response_cache.respond(request, "find", load)
@@ -1,16 +1,23 @@
-from fastapi import APIRouter, Depends, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, UploadFile, File, BackgroundTasks, HTTPException, Response, Path, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
-from src.database.models import User
+from src.database.models import User, AvatarStatus, Role
 from src.repository import users as repository_users
 from src.services.auth import auth_service
-from src.shemas import GuestResponse
-from src.services.cloudinary import CloudImage
+from src.shemas import GuestResponse, AvatarResponse, RoleModel
+from src.services.avatars import avatar_pipeline, InvalidAvatar
+from src.services.roles import RoleAccess
+from src.services.serializers import guest_serializer
+from src.services.workers import WorkerPoolBusy
+from src.conf.config import settings
 
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+allowed_operation_change_roles = RoleAccess([Role.admin])
+
 
 @router.get("/me/", response_model=GuestResponse)
 async def read_users_me(current_user: User = Depends(auth_service.get_current_user)):
@@ -22,24 +29,80 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
     :return: The current user object
     :doc-author: Trelent
     """
+    if settings.fast_json:
+        return ORJSONResponse(guest_serializer.dump(current_user))
     return current_user
 
 
-@router.patch('/avatar', response_model=GuestResponse)
-async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+@router.get("/me/avatar", response_model=AvatarResponse)
+async def read_avatar_status(current_user: User = Depends(auth_service.get_current_user),
+                             db: AsyncSession = Depends(get_db)):
+    """
+    The read_avatar_status function returns the current user with the status of the last avatar update,
+    so a client that got 202 from update_avatar_user can poll until it is ready or failed.
+
+    :param current_user: User: Get the current user from the database
+    :param db: AsyncSession: Get a database session
+    :return: The user with its avatar status
+    :doc-author: Trelent
+    """
+    return await repository_users.get_guest_by_email(current_user.email, db)
+
+
+@router.patch('/avatar', response_model=AvatarResponse, status_code=status.HTTP_202_ACCEPTED)
+async def update_avatar_user(background_tasks: BackgroundTasks, response: Response, file: UploadFile = File(),
+                             current_user: User = Depends(auth_service.get_current_user),
+                             db: AsyncSession = Depends(get_db)):
 
     """
     The update_avatar_user function updates the avatar of a user.
+        The image is resized to the 250x250 avatar off the event loop and uploaded to Cloudinary after the response
+        was sent, so the response is 202 with avatar_status processing. Uploading the image the user already has
+        returns 200 and uploads nothing.
 
+    :param background_tasks: BackgroundTasks: Upload the avatar after the response
+    :param response: Response: Set the status code of an unchanged avatar
     :param file: UploadFile: Get the file from the request
     :param current_user: User: Get the current user from the database
-    :param db: Session: Get a database session
-    :return: The updated user
+    :param db: AsyncSession: Get a database session
+    :return: The user with its avatar status
     :doc-author: Trelent
     """
-    public_id = CloudImage.generate_name_avatar(current_user.email)
-    r = CloudImage.upload(file.file, public_id)
-    src_url = CloudImage.get_url_for_avatar(public_id, r)
-    user = await repository_users.update_avatar(current_user.email, src_url, db)
+    data = await file.read(settings.avatar_max_bytes + 1)
+    if len(data) > settings.avatar_max_bytes:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Avatar is too large")
+    try:
+        content_hash = await avatar_pipeline.digest(data)
+        user = await repository_users.get_guest_by_email(current_user.email, db)
+        if user.avatar_hash == content_hash and user.avatar_status != AvatarStatus.failed:
+            response.status_code = status.HTTP_200_OK
+            return user
+        image = await avatar_pipeline.resize(data)
+    except InvalidAvatar:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File is not a supported image")
+    except WorkerPoolBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many avatar updates, try again later", headers={"Retry-After": "1"})
+    user = await repository_users.start_avatar_update(current_user.email, content_hash, db)
+    background_tasks.add_task(avatar_pipeline.upload, current_user.email, content_hash, image)
     return user
+
+
+@router.patch("/guests/{guest_id}/roles", response_model=GuestResponse,
+              dependencies=[Depends(allowed_operation_change_roles)])
+async def change_roles(body: RoleModel, guest_id: int = Path(ge=1), db: AsyncSession = Depends(get_db)):
+    """
+    The change_roles function changes the role of a guest; only admins may call it.
+    Access tokens issued to the guest before the change are rejected from then on, and the next refresh
+    issues tokens with the new role.
+
+    :param body: RoleModel: The new role
+    :param guest_id: int: The id of the guest
+    :param db: AsyncSession: Get a database session
+    :return: The updated guest
+    :doc-author: Trelent
+    """
+    guest = await repository_users.update_roles(guest_id, body.roles, db)
+    if guest is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return guest
@@ -0,0 +1,81 @@
+from fastapi import APIRouter, Depends, Request
+
+from src.database.db import get_engine
+from src.database.models import Role
+from src.database.pool import pool_metrics
+from src.services.cache import response_cache, token_cache
+from src.services.rate_limit import rate_limiter
+from src.services.resources import resources
+from src.services.roles import RoleAccess
+
+allowed_operation_internal = RoleAccess([Role.admin])
+
+router = APIRouter(prefix="/internal", tags=['internal'], include_in_schema=False,
+                   dependencies=[Depends(allowed_operation_internal)])
+
+
+@router.get("/db_pool")
+async def db_pool_stats():
+    """
+    The db_pool_stats function reports the usage of the database connection pool of this worker:
+    checked-out and overflow connections, connection churn and a histogram of checkout wait times.
+
+    :return: A dictionary of pool statistics
+    :doc-author: Trelent
+    """
+    return pool_metrics.snapshot(get_engine().sync_engine.pool)
+
+
+@router.get("/response_cache")
+async def response_cache_stats():
+    """
+    The response_cache_stats function reports the response cache of this worker:
+    hits, misses, the hit ratio, 304 answers, Redis errors and a histogram of lookup latencies.
+
+    :return: A dictionary of cache statistics
+    :doc-author: Trelent
+    """
+    return response_cache.snapshot()
+
+
+@router.get("/token_cache")
+async def token_cache_stats():
+    """
+    The token_cache_stats function reports the decoded-token cache of this worker:
+    its size, hits, misses, the hit ratio and the entries evicted by revocation.
+
+    :return: A dictionary of cache statistics
+    :doc-author: Trelent
+    """
+    return token_cache.snapshot()
+
+
+@router.get("/rate_limit")
+async def rate_limit_stats():
+    """
+    The rate_limit_stats function reports the rate limiter of this worker:
+    the quotas per role, the principals with an active window, allowed and rejected requests and Redis syncs.
+
+    :return: A dictionary of rate limiter statistics
+    :doc-author: Trelent
+    """
+    return rate_limiter.snapshot()
+
+
+@router.get("/resources")
+async def resources_stats(request: Request):
+    """
+    The resources_stats function reports how long this worker took to start: importing the application
+    (import_seconds) and everything up to serving the first request (boot_seconds, null until the lifespan ran),
+    and which lazily created resources exist so far with their creation time in milliseconds.
+
+    :param request: Request: Read the startup times from the application state
+    :return: A dictionary of startup and resource statistics
+    :doc-author: Trelent
+    """
+    state = request.app.state
+    return {
+        "import_seconds": getattr(state, "import_seconds", None),
+        "boot_seconds": getattr(state, "boot_seconds", None),
+        **resources.snapshot(),
+    }
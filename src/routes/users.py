@@ -1,15 +1,25 @@
-from typing import List
+from datetime import datetime
+from typing import Optional
 
-from fastapi import Depends, HTTPException, status, Path, APIRouter
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException, status, Path, APIRouter, Query, Request
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.database.models import User, Role
 from src.repository import users as repository_users
-from src.shemas import UserResponse, UserModel
+from src.shemas import UserResponse, UserModel, UserPage, ImportReport, UserBatchRequest, UserBatchResponse, \
+    UserBulkUpdate, UserBulkDelete, BulkResult
 from src.services.auth import auth_service
+from src.services.cache import response_cache
+from src.services.serializers import user_serializer
 from src.services.roles import RoleAccess
+from src.services.rate_limit import RateLimit, rate_limiter
+from src.services.imports import import_users
+from src.services.exports import encode_users
+from src.services.filters import compile_filter, compile_values
+from src.conf.config import settings
 
 router = APIRouter(prefix="/users", tags=['user'])
 
@@ -17,65 +27,215 @@ allowed_operation_get = RoleAccess([Role.guest, Role.admin, Role.moderator])
 allowed_operation_create = RoleAccess([Role.guest, Role.admin, Role.moderator])
 allowed_operation_update = RoleAccess([Role.admin, Role.moderator])
 allowed_operation_remove = RoleAccess([Role.admin])
+allowed_operation_bulk = RoleAccess([Role.admin, Role.moderator])
 
+rate_limit = RateLimit(rate_limiter, "users")
 
-@router.get("/", response_model=List[UserResponse], name="Users list",
-            dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def get_users(db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+
+@router.get("/", response_model=UserPage, name="Users list",
+            dependencies=[Depends(allowed_operation_get), Depends(rate_limit)])
+async def get_users(limit: int = Query(20, ge=1, le=100), after: Optional[str] = Query(None),
+                    order_by: str = Query('id', regex='^(id|last_name)$'), with_total: bool = Query(False),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_users function returns one page of users.
+    Pass the next_cursor of a page as after to get the following one; it is null on the last page.
+
+    :param limit: int: The maximum number of users on the page
+    :param after: Optional[str]: The cursor of the previous page
+    :param order_by: str: Sort by id or by last_name
+    :param with_total: bool: Add the planner's estimate of the total number of users
+    :param db: AsyncSession: Pass the database session to the repository
+    :param current_user: User: Get the current user
+    :return: A page of users
+    :doc-author: Trelent
+    """
+    try:
+        users, next_cursor = await repository_users.get_users(db, limit, after, order_by)
+    except ValueError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    estimated_total = await repository_users.get_users_estimated_total(db) if with_total else None
+    if settings.fast_json:
+        return ORJSONResponse({"items": user_serializer.dump_many(users), "next_cursor": next_cursor,
+                               "estimated_total": estimated_total})
+    return {"items": users, "next_cursor": next_cursor, "estimated_total": estimated_total}
+
+
+@router.get("/export", response_class=StreamingResponse,
+            dependencies=[Depends(allowed_operation_get), Depends(rate_limit)])
+async def export_users(format: str = Query('ndjson', regex='^(ndjson|csv)$'), since: Optional[datetime] = Query(None),
+                       db: AsyncSession = Depends(get_db),
+                       current_user: User = Depends(auth_service.get_current_user)):
     """
-    The get_users function returns a list of users.
+    The export_users function streams all users as NDJSON or CSV, oldest change first.
+    Rows are read through a server-side cursor and encoded as they arrive, so memory stays flat.
+    Pass since to only export users updated at or after that moment.
 
-    :param db: Session: Pass the database session to the repository
+    :param format: str: Either ndjson or csv
+    :param since: Optional[datetime]: Only export users updated at or after this moment
+    :param db: AsyncSession: Pass the database session to the repository
     :param current_user: User: Get the current user
-    :return: A list of users
+    :return: A streaming response with the users
     :doc-author: Trelent
     """
-    users = await repository_users.get_users(db)
-    return users
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    users = repository_users.stream_users(db, since)
+    return StreamingResponse(encode_users(users, format), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="users.{format}"'})
+
+
+@router.post("/batch", response_model=UserBatchResponse,
+             dependencies=[Depends(allowed_operation_get), Depends(rate_limit)])
+async def get_users_batch(body: UserBatchRequest, db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_users_batch function returns many users by id or email with one request and one query.
+    There is an item for every requested id, then for every requested email, in the order they were sent;
+    an item whose user does not exist has found set to false and no user.
+
+    :param body: UserBatchRequest: The ids and emails to look up
+    :param db: AsyncSession: Pass the database session to the repository
+    :param current_user: User: Get the current user
+    :return: The items in request order
+    :doc-author: Trelent
+    """
+    users = await repository_users.get_users_by_keys(body.ids, body.emails, db)
+    dump = user_serializer.dump if settings.fast_json else (lambda user: user)
+    by_id = {user.id: dump(user) for user in users}
+    by_email = {user.email: by_id[user.id] for user in users}
+    items = [{"id": user_id, "email": None, "found": user_id in by_id, "user": by_id.get(user_id)}
+             for user_id in body.ids]
+    items += [{"id": None, "email": email, "found": email in by_email, "user": by_email.get(email)}
+              for email in body.emails]
+    if settings.fast_json:
+        return ORJSONResponse({"items": items})
+    return {"items": items}
+
+
+@router.post("/bulk/update", response_model=BulkResult,
+             dependencies=[Depends(allowed_operation_bulk), Depends(rate_limit)])
+async def bulk_update_users(body: UserBulkUpdate, db: AsyncSession = Depends(get_db),
+                            current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The bulk_update_users function changes every user matching the filter with a single UPDATE statement.
+    set assigns fields, replace rewrites a substring of text fields (e.g. the domain of the emails).
+    With dry_run the update is rolled back and only the ids that would change are returned.
+
+    :param body: UserBulkUpdate: The filter, the changes and the dry_run flag
+    :param db: AsyncSession: Pass the database session to the repository
+    :param current_user: User: Get the current user
+    :return: The number and the ids of the matched users
+    :doc-author: Trelent
+    """
+    try:
+        conditions = compile_filter(body.where)
+        values = compile_values(body.set.dict(exclude_unset=True, exclude_none=True),
+                                {field: (item.old, item.new) for field, item in body.replace.items()})
+    except ValueError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    try:
+        ids = await repository_users.bulk_update(conditions, values, body.dry_run, db)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Email is exists!')
+    return {"matched": len(ids), "ids": ids, "dry_run": body.dry_run}
 
 
-@router.get("/{user_id}", response_model=UserResponse, dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def get_user(user_id: int = Path(ge=1), db: Session = Depends(get_db),
+@router.post("/bulk/delete", response_model=BulkResult,
+             dependencies=[Depends(allowed_operation_bulk), Depends(rate_limit)])
+async def bulk_delete_users(body: UserBulkDelete, db: AsyncSession = Depends(get_db),
+                            current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The bulk_delete_users function removes every user matching the filter with a single DELETE statement.
+    With dry_run the delete is rolled back and only the ids that would be removed are returned.
+
+    :param body: UserBulkDelete: The filter and the dry_run flag
+    :param db: AsyncSession: Pass the database session to the repository
+    :param current_user: User: Get the current user
+    :return: The number and the ids of the matched users
+    :doc-author: Trelent
+    """
+    try:
+        conditions = compile_filter(body.where)
+    except ValueError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    ids = await repository_users.bulk_delete(conditions, body.dry_run, db)
+    return {"matched": len(ids), "ids": ids, "dry_run": body.dry_run}
+
+
+@router.get("/{user_id}", response_model=UserResponse,
+            dependencies=[Depends(allowed_operation_get), Depends(rate_limit)])
+async def get_user(request: Request, user_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
                    current_user: User = Depends(auth_service.get_current_user)):
     """
     The get_user function is a GET request that returns the user with the given ID.
     If no such user exists, it raises an HTTP 404 error.
+    Responses are cached until the user is updated or removed; send If-None-Match with the ETag to get a 304.
 
+    :param request: Request: Identify the cached response and read If-None-Match
     :param user_id: int: Specify the type of parameter that is expected
-    :param db: Session: Pass the database session to the repository function
+    :param db: AsyncSession: Pass the database session to the repository function
     :param current_user: User: Get the current user
     :return: A user object
     :doc-author: Trelent
     """
-    user = await repository_users.get_user_by_id(user_id, db)
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
-    return user
+    async def load():
+        user = await repository_users.get_user_by_id(user_id, db)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+        return user_serializer.dump(user) if settings.fast_json else UserResponse.from_orm(user)
+
+    return await response_cache.respond(request, f"user:{user_id}", load)
 
 
 @router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED,
-             dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def create_user(body: UserModel, db: Session = Depends(get_db),
+             dependencies=[Depends(allowed_operation_create), Depends(rate_limit)])
+async def create_user(body: UserModel, db: AsyncSession = Depends(get_db),
                       current_user: User = Depends(auth_service.get_current_user)):
     """
     The create_user function creates a new user in the database.
 
     :param body: UserModel: Get the data from the request body
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user
     :return: A user object
     :doc-author: Trelent
     """
-    user = await repository_users.get_user_by_email(body.email, db)
-    if user:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Email is exists!')
-
     user = await repository_users.create(body, db)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Email is exists!')
     return user
 
 
-@router.put("/{user_id}", response_model=UserResponse, dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def update_user(body: UserModel, user_id: int = Path(ge=1), db: Session = Depends(get_db),
+@router.post("/import", response_model=ImportReport,
+             dependencies=[Depends(allowed_operation_create), Depends(rate_limit)])
+async def import_users_bulk(request: Request, db: AsyncSession = Depends(get_db),
+                            current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The import_users_bulk function creates users from a streamed NDJSON (application/x-ndjson) or CSV (text/csv) body.
+    Rows are validated as they arrive and inserted in batches; rows with an email that already exists are skipped.
+
+    :param request: Request: Read the body stream and its content type
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the current user
+    :return: A report with inserted, duplicate and failed counts and the errors per line
+    :doc-author: Trelent
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in ("application/x-ndjson", "application/jsonl"):
+        fmt = "ndjson"
+    elif content_type == "text/csv":
+        fmt = "csv"
+    else:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Expected application/x-ndjson or text/csv")
+    return await import_users(request.stream(), fmt, db, settings.import_batch_size, settings.import_max_errors,
+                              settings.import_max_record_size)
+
+
+@router.put("/{user_id}", response_model=UserResponse,
+            dependencies=[Depends(allowed_operation_update), Depends(rate_limit)])
+async def update_user(body: UserModel, user_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
                       current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_user function updates a user in the database.
@@ -84,7 +244,7 @@ async def update_user(body: UserModel, user_id: int = Path(ge=1), db: Session =
 
     :param body: UserModel: Get the data from the request body
     :param user_id: int: Get the user_id from the url
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user from the auth_service
     :return: A usermodel object
     :doc-author: Trelent
@@ -96,14 +256,14 @@ async def update_user(body: UserModel, user_id: int = Path(ge=1), db: Session =
 
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT,
-               dependencies=[Depends(RateLimiter(times=2, seconds=5))])
-async def remove_user(user_id: int = Path(ge=1), db: Session = Depends(get_db),
+               dependencies=[Depends(allowed_operation_remove), Depends(rate_limit)])
+async def remove_user(user_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
                       current_user: User = Depends(auth_service.get_current_user)):
     """
     The remove_user function removes a user from the database.
 
     :param user_id: int: Specify the path parameter in the url
-    :param db: Session: Pass the database session to the repository
+    :param db: AsyncSession: Pass the database session to the repository
     :param current_user: User: Get the current user from the database
     :return: The removed user
     :doc-author: Trelent
@@ -0,0 +1,29 @@
+import hashlib
+import json
+
+from fastapi import APIRouter, Request, Response
+
+from src.conf.config import settings
+from src.services.auth import auth_service
+
+router = APIRouter(prefix="/.well-known", tags=['auth'])
+
+
+@router.get("/jwks.json")
+async def jwks(request: Request):
+    """
+    The jwks function publishes the public keys that verify our tokens as a JWK Set, so other services can
+    verify tokens locally. Upcoming keys are listed before they sign anything, so caching the set for
+    jwks_max_age seconds never hides a key that is in use. With HS256 the set is empty.
+
+    :param request: Request: Read If-None-Match
+    :return: The JWK Set
+    :doc-author: Trelent
+    """
+    keys = auth_service.key_ring.jwks() if auth_service.key_ring is not None else {"keys": []}
+    body = json.dumps(keys, separators=(',', ':')).encode('utf-8')
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"Cache-Control": f"public, max-age={settings.jwks_max_age}", "ETag": etag}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/jwk-set+json", headers=headers)
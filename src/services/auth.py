@@ -1,19 +1,21 @@
-import pickle
-
 from datetime import datetime, timedelta
 from typing import Optional
 
-import redis as redis
 from fastapi import Depends, HTTPException, status
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer  # Bearer token
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 
 
 from src.database.db import get_db
+from src.database.models import Guest, Role
 from src.repository import users as repository_users
 from src.conf.config import settings
+from src.services.cache import principal_cache, principal_from_guest, Principal, token_cache
+from src.services.workers import WorkerPool, WorkerPoolBusy
+from src.services.keys import KeyRing, ASYMMETRIC_ALGORITHMS
+from src.services.token_versions import token_versions
 
 
 class Auth:
@@ -21,13 +23,59 @@ class Auth:
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+    ACCESS_CLAIMS = ("sub", "uid", "roles", "ver")
+    password_pool = WorkerPool(settings.password_hash_workers, settings.password_hash_queue,
+                               settings.password_hash_timeout, name='bcrypt')
+    key_ring = KeyRing.from_directory(settings.jwt_keys_dir, settings.algorithm,
+                                      timedelta(days=settings.jwt_key_grace_days)) \
+        if settings.algorithm in ASYMMETRIC_ALGORITHMS else None
+
+    def encode_token(self, claims: dict) -> str:
+        """
+        The encode_token function signs claims with the shared SECRET_KEY (HS256), or with the active key of
+        key_ring (RS256/ES256), whose kid is put in the token header.
 
-    def verify_password(self, plain_password, hashed_password):
+        :param self: Represent the instance of the class
+        :param claims: dict: The claims to sign
+        :return: The encoded token
+        :doc-author: Trelent
+        """
+        if self.key_ring is None:
+            return jwt.encode(claims, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        key = self.key_ring.signing_key()
+        return jwt.encode(claims, key.private_key, algorithm=self.ALGORITHM, headers={"kid": key.kid})
+
+    def decode_token(self, token: str) -> dict:
+        """
+        The decode_token function verifies a token signed by encode_token and returns its claims.
+        Asymmetric tokens are verified with the published key named by their kid.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: The verified claims
+        :doc-author: Trelent
+        """
+        if self.key_ring is None:
+            return jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+        key = self.key_ring.verification_key(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise JWTError("Unknown signing key")
+        return jwt.decode(token, key, algorithms=[self.ALGORITHM])
+
+    async def _run_password_pool(self, fn, *args):
+        try:
+            return await self.password_pool.run(fn, *args)
+        except WorkerPoolBusy:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many authentication requests, try again later",
+                                headers={"Retry-After": "1"})
+
+    async def verify_password(self, plain_password, hashed_password):
         """
         The verify_password function takes a plain-text password and hashed
         password as arguments. It then uses the pwd_context object to verify that the
         plain-text password matches the hashed one.
+        The bcrypt check runs on password_pool, so it never blocks the event loop.
 
         :param self: Make the method a bound method, which means that it can be called on an instance of the class
         :param plain_password: Pass in the password that the user entered into the form
@@ -35,19 +83,19 @@ class Auth:
         :return: A boolean value
         :doc-author: Trelent
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return await self._run_password_pool(self.pwd_context.verify, plain_password, hashed_password)
 
-    def get_password_hash(self, password: str):
+    async def get_password_hash(self, password: str):
         """
         The get_password_hash function takes a password as input and returns the hash of that password.
-        The hash is generated using the pwd_context object, which is an instance of Flask-Bcrypt's Bcrypt class.
+        The hash is generated using the pwd_context object on password_pool, off the event loop.
 
         :param self: Represent the instance of the class
         :param password: str: Pass in the password that is to be hashed
         :return: A string of characters that represents the hashed password
         :doc-author: Trelent
         """
-        return self.pwd_context.hash(password)
+        return await self._run_password_pool(self.pwd_context.hash, password)
 
 # define a function to generate a new access token
     async def create_access_token(self,data: dict, expires_delta: Optional[float] = None):
@@ -67,7 +115,7 @@ class Auth:
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
-        encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        encoded_access_token = self.encode_token(to_encode)
         return encoded_access_token
 
 # define a function to generate a new refresh token
@@ -90,19 +138,32 @@ class Auth:
         else:
             expire = datetime.utcnow() + timedelta(days=7)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
-        encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        encoded_refresh_token = self.encode_token(to_encode)
         return encoded_refresh_token
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def create_claims(self, guest: Guest) -> dict:
         """
-        The get_current_user function is a dependency that will be used in the
-            UserRouter class. It takes in a token and db session, and returns the user
-            object associated with that token. If no user is found, it raises an error.
+        The create_claims function returns the claims that identify a guest in its tokens:
+        the email (sub), the id (uid), the role (roles) and the current token version (ver).
 
-        :param self: Access the class attributes and methods
+        :param self: Represent the instance of the class
+        :param guest: Guest: The guest the tokens are issued to
+        :return: The claims
+        :doc-author: Trelent
+        """
+        return {"sub": guest.email, "uid": guest.id, "roles": (guest.roles or Role.guest).value,
+                "ver": await token_versions.get(guest.id)}
+
+    async def get_token_claims(self, token: str = Depends(oauth2_scheme)) -> dict:
+        """
+        The get_token_claims function is a dependency that returns the verified claims of an access token.
+        Verified tokens are kept in token_cache until they expire, so a reused token is not decoded again,
+        and the token version is compared with the cached current one, so neither step does I/O on most requests.
+        Tokens issued before the roles of the user changed are rejected.
+
+        :param self: Represent the instance of the class
         :param token: str: Get the token from the request header
-        :param db: Session: Pass the database session to the function
-        :return: The user object
+        :return: The claims of the token
         :doc-author: Trelent
         """
         credentials_exception = HTTPException(
@@ -111,49 +172,68 @@ class Auth:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload.get("scope") == "access_token":
-                email = payload.get("sub")
-                if email is None:
-                    raise credentials_exception
-            else:
+        payload = token_cache.get(token)
+        if payload is None:
+            try:
+                # Decode JWT
+                payload = self.decode_token(token)
+            except JWTError:
                 raise credentials_exception
-        except JWTError as e:
+            if payload.get("scope") != "access_token" or any(payload.get(claim) is None
+                                                             for claim in self.ACCESS_CLAIMS):
+                raise credentials_exception
+            token_cache.set(token, payload)
+        if payload["ver"] != await token_versions.get(payload["uid"]):
             raise credentials_exception
+        return payload
 
-        # user = await repository_users.get_user_by_email(email, db)
-        user = self.r.get(f"user:{email}")
-        if user is None:
-            user = await repository_users.get_user_by_email(email, db)
-            if user is None:
-                raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user.id))
-            self.r.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+    async def get_current_user(self, token: str = Depends(oauth2_scheme),
+                               db: AsyncSession = Depends(get_db)) -> Principal:
+        """
+        The get_current_user function is a dependency that will be used in the
+            UserRouter class. It takes in a token and db session, and returns the principal
+            associated with that token. If no user is found, it raises an error.
+            The token is checked by get_token_claims. The principal is served from principal_cache;
+            the database is only queried on a miss.
+
+        :param self: Access the class attributes and methods
+        :param token: str: Get the token from the request header
+        :param db: AsyncSession: Pass the database session to the function
+        :return: The principal of the user
+        :doc-author: Trelent
+        """
+        payload = await self.get_token_claims(token)
+        email = payload["sub"]
+
+        user = await principal_cache.get(email)
         if user is None:
-            raise credentials_exception
+            guest = await repository_users.get_guest_by_email(email, db)
+            if guest is None:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                    detail="Could not validate credentials",
+                                    headers={"WWW-Authenticate": "Bearer"})
+            user = principal_from_guest(guest)
+            await principal_cache.set(user)
         return user
 
     async def decode_refresh_token(self, refresh_token: str):
         """
         The decode_refresh_token function is used to decode the refresh token.
-        It takes a refresh_token as an argument and returns the email of the user if it's valid.
+        It takes a refresh_token as an argument and returns its claims if it's valid: sub, jti and fam.
         If not, it raises an HTTPException with status code 401 (UNAUTHORIZED) and detail 'Could not validate credentials'.
 
 
         :param self: Represent the instance of the class
         :param refresh_token: str: Pass in the refresh token that was sent by the client
-        :return: A string
+        :return: The claims of the refresh token
         :doc-author: Trelent
         """
         try:
-            payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.decode_token(refresh_token)
             if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
+                if not all(payload.get(claim) for claim in ('sub', 'jti', 'fam')):
+                    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid refresh token')
+                return payload
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
@@ -172,7 +252,7 @@ class Auth:
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(hours=2)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "email_token"})
-        token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        token = self.encode_token(to_encode)
         return token
 
     def get_email_from_token(self, token: str):
@@ -189,7 +269,7 @@ class Auth:
         :doc-author: Trelent
         """
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.decode_token(token)
             if payload['scope'] == 'email_token':
                 email = payload['sub']
                 return email
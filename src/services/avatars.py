@@ -0,0 +1,121 @@
+import hashlib
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.conf.config import settings
+from src.database.db import DBSession
+from src.repository import users as repository_users
+from src.services.storage import AvatarStorage, avatar_storage
+from src.services.workers import WorkerPool
+
+AVATAR_SIZE = (250, 250)
+AVATAR_FORMAT = 'JPEG'
+AVATAR_QUALITY = 85
+
+
+class InvalidAvatar(Exception):
+    pass
+
+
+def digest(data: bytes) -> str:
+    """
+    The digest function returns the SHA256 hex digest of an uploaded image.
+
+    :param data: bytes: The uploaded file
+    :return: The content hash
+    :doc-author: Trelent
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def resize(data: bytes) -> bytes:
+    """
+    The resize function crops and scales an uploaded image to the 250x250 avatar Cloudinary serves,
+    the way crop='fill' does, and encodes it as JPEG.
+    JPEG sources are decoded at a reduced scale with draft(), which makes large photos several times cheaper.
+
+    :param data: bytes: The uploaded file
+    :return: The avatar image
+    :doc-author: Trelent
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft('RGB', (AVATAR_SIZE[0] * 2, AVATAR_SIZE[1] * 2))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image = ImageOps.fit(image, AVATAR_SIZE, Image.LANCZOS)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as err:
+        raise InvalidAvatar(str(err))
+    out = io.BytesIO()
+    image.save(out, AVATAR_FORMAT, quality=AVATAR_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+class AvatarPipeline:
+    """
+    Avatar updates without blocking the event loop: hashing and resizing run on image_pool,
+    and storing the small resized image runs on upload_pool after the response was sent.
+    The guest's avatar_status tells the client whether the new avatar is ready.
+    """
+
+    def __init__(self, image_pool: WorkerPool, upload_pool: WorkerPool, storage: AvatarStorage,
+                 session_maker: async_sessionmaker = DBSession):
+        self.image_pool = image_pool
+        self.upload_pool = upload_pool
+        self.storage = storage
+        self.session_maker = session_maker
+        self.uploaded = 0
+        self.failed = 0
+
+    async def digest(self, data: bytes) -> str:
+        """
+        The digest function hashes an uploaded image on image_pool.
+
+        :param self: Represent the instance of the class
+        :param data: bytes: The uploaded file
+        :return: The content hash
+        :doc-author: Trelent
+        """
+        return await self.image_pool.run(digest, data)
+
+    async def resize(self, data: bytes) -> bytes:
+        """
+        The resize function turns an uploaded image into the avatar on image_pool.
+
+        :param self: Represent the instance of the class
+        :param data: bytes: The uploaded file
+        :return: The avatar image
+        :doc-author: Trelent
+        """
+        return await self.image_pool.run(resize, data)
+
+    async def upload(self, email: str, content_hash: str, image: bytes) -> None:
+        """
+        The upload function saves a resized avatar to the avatar storage and records its url,
+        or marks the update failed when saving does not succeed.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the guest
+        :param content_hash: str: The content hash of the uploaded file
+        :param image: bytes: The resized avatar
+        :return: None
+        :doc-author: Trelent
+        """
+        try:
+            src_url = await self.upload_pool.run(self.storage.save, email, image)
+        except Exception:
+            self.failed += 1
+            async with self.session_maker() as db:
+                await repository_users.fail_avatar_update(email, content_hash, db)
+            return
+        self.uploaded += 1
+        async with self.session_maker() as db:
+            await repository_users.update_avatar(email, src_url, db, content_hash)
+
+
+avatar_pipeline = AvatarPipeline(
+    WorkerPool(settings.avatar_workers, settings.avatar_queue, settings.avatar_timeout, name='avatar'),
+    WorkerPool(settings.avatar_upload_workers, settings.avatar_upload_queue, settings.avatar_upload_timeout,
+               name='avatar-upload'),
+    avatar_storage)
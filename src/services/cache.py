@@ -0,0 +1,445 @@
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Any, Callable, Awaitable, Dict, Set
+
+import redis.asyncio as redis
+from fastapi import Request, Response
+from redis.exceptions import RedisError
+
+from src.database.models import Role
+from src.conf.config import settings
+from src.services.metrics import Histogram
+from src.services.resources import resources
+from src.services.serializers import dumps
+
+
+class Principal(NamedTuple):
+    id: int
+    email: str
+    username: Optional[str]
+    roles: Role
+    confirmed: bool
+    avatar: Optional[str]
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key) -> Any:
+        """
+        The get function returns the value stored under key, or None if it is missing or expired.
+        A hit moves the key to the end, so the least recently used entries are evicted first.
+
+        :param self: Represent the instance of the class
+        :param key: The key to look up
+        :return: The cached value or None
+        :doc-author: Trelent
+        """
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        """
+        The set function stores value under key for ttl seconds, evicting the least recently used entry when full.
+
+        :param self: Represent the instance of the class
+        :param key: The key to store the value under
+        :param value: The value to store
+        :return: None
+        :doc-author: Trelent
+        """
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PrincipalCache:
+    VERSION = 1
+
+    def __init__(self, r: redis.Redis, maxsize: int, local_ttl: float, ttl: int):
+        self.r = r
+        self.local = TTLCache(maxsize, local_ttl)
+        self.ttl = ttl
+        self.errors = 0
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user:{email}"
+
+    def dumps(self, principal: Principal) -> bytes:
+        """
+        The dumps function serializes a principal into a compact JSON array prefixed with the format version.
+
+        :param self: Represent the instance of the class
+        :param principal: Principal: The principal to serialize
+        :return: The serialized principal
+        :doc-author: Trelent
+        """
+        return json.dumps([self.VERSION, principal.id, principal.email, principal.username, principal.roles.value,
+                           principal.confirmed, principal.avatar], separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data: bytes) -> Optional[Principal]:
+        """
+        The loads function restores a principal serialized by dumps.
+        Entries written in another format version are treated as a miss.
+
+        :param self: Represent the instance of the class
+        :param data: bytes: The serialized principal
+        :return: The principal or None
+        :doc-author: Trelent
+        """
+        try:
+            version, *fields = json.loads(data)
+        except (ValueError, TypeError):
+            return None
+        if version != self.VERSION:
+            return None
+        user_id, email, username, roles, confirmed, avatar = fields
+        return Principal(user_id, email, username, Role(roles), confirmed, avatar)
+
+    async def get(self, email: str) -> Optional[Principal]:
+        """
+        The get function looks the principal up in the in-process tier first and in Redis second.
+        A Redis hit is copied into the in-process tier, so repeated requests need no network round trip.
+        When Redis is unavailable the error is counted and the lookup is a miss, so the caller reads the database.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the principal
+        :return: The cached principal or None
+        :doc-author: Trelent
+        """
+        principal = self.local.get(email)
+        if principal is not None:
+            return principal
+        try:
+            data = await self.r.get(self.key(email))
+        except RedisError:
+            self.errors += 1
+            return None
+        if data is None:
+            return None
+        principal = self.loads(data)
+        if principal is not None:
+            self.local.set(email, principal)
+        return principal
+
+    async def set(self, principal: Principal) -> None:
+        """
+        The set function stores the principal in both tiers with a single Redis round trip.
+        A Redis error is counted and leaves the principal in the in-process tier only.
+
+        :param self: Represent the instance of the class
+        :param principal: Principal: The principal to cache
+        :return: None
+        :doc-author: Trelent
+        """
+        self.local.set(principal.email, principal)
+        try:
+            await self.r.set(self.key(principal.email), self.dumps(principal), ex=self.ttl)
+        except RedisError:
+            self.errors += 1
+
+    async def invalidate(self, email: str) -> None:
+        """
+        The invalidate function drops the principal from both tiers after the underlying guest changed.
+        Other workers keep their in-process copy for at most principal_cache_local_ttl seconds.
+        A Redis error is counted rather than raised, because the database change has already been committed;
+        role changes also bump the token version, so a stale Redis entry can not keep an old role in use.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the principal
+        :return: None
+        :doc-author: Trelent
+        """
+        self.local.pop(email)
+        try:
+            await self.r.delete(self.key(email))
+        except RedisError:
+            self.errors += 1
+
+
+def principal_from_guest(guest) -> Principal:
+    return Principal(guest.id, guest.email, guest.username, guest.roles or Role.guest, bool(guest.confirmed),
+                     guest.avatar)
+
+
+class TokenCache:
+    """
+    Verified JWT payloads keyed by the SHA-256 digest of the token, so the token itself is never kept.
+    Every entry expires at the token's exp; when full, the least recently used entry is dropped.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._subjects: Dict[str, Set[bytes]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def _remove(self, digest: bytes) -> None:
+        exp, payload = self._data.pop(digest)
+        digests = self._subjects.get(payload.get("sub"))
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._subjects[payload.get("sub")]
+
+    def get(self, token: str) -> Optional[dict]:
+        """
+        The get function returns the payload of a token verified before, or None if it is unknown or expired.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: The payload or None
+        :doc-author: Trelent
+        """
+        digest = self.digest(token)
+        item = self._data.get(digest)
+        if item is None:
+            self.misses += 1
+            return None
+        if item[0] <= time.time():
+            self._remove(digest)
+            self.misses += 1
+            return None
+        self._data.move_to_end(digest)
+        self.hits += 1
+        return item[1]
+
+    def set(self, token: str, payload: dict) -> None:
+        """
+        The set function stores the payload of a verified token until its exp.
+        Payloads without exp are not cached, because nothing would bound their lifetime.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :param payload: dict: The verified payload
+        :return: None
+        :doc-author: Trelent
+        """
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        digest = self.digest(token)
+        if digest in self._data:
+            self._remove(digest)
+        self._data[digest] = (exp, payload)
+        self._subjects.setdefault(payload.get("sub"), set()).add(digest)
+        while len(self._data) > self.maxsize:
+            self._remove(next(iter(self._data)))
+
+    def evict(self, token: str) -> None:
+        """
+        The evict function drops one token, so its next use is verified again.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: None
+        :doc-author: Trelent
+        """
+        digest = self.digest(token)
+        if digest in self._data:
+            self._remove(digest)
+            self.evictions += 1
+
+    def evict_subject(self, subject: str) -> None:
+        """
+        The evict_subject function drops every cached token issued to a subject; revocation paths call it.
+
+        :param self: Represent the instance of the class
+        :param subject: str: The sub claim of the tokens, i.e. the email
+        :return: None
+        :doc-author: Trelent
+        """
+        for digest in list(self._subjects.get(subject, ())):
+            self._remove(digest)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._subjects.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function returns the size of the cache with its hit, miss and eviction counters.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary of cache statistics
+        :doc-author: Trelent
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+LOOKUP_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+
+class ResponseCache:
+    """
+    Caches serialized JSON responses in Redis with a strong ETag derived from the body.
+    Every entry belongs to a scope (e.g. user:42 or find). A write replaces the generation token of the scopes it
+    touches, which retires all their entries at once; an entry is only served if it was stored under the current
+    generation. The generation and the entry are read with one MGET.
+    """
+
+    def __init__(self, r: redis.Redis, ttl: int):
+        self.r = r
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.lookup = Histogram(LOOKUP_BUCKETS)
+
+    @staticmethod
+    def generation_key(scope: str) -> str:
+        return f"resp:gen:{scope}"
+
+    @staticmethod
+    def key(scope: str, request: Request) -> str:
+        query = sorted(request.query_params.multi_items())
+        digest = hashlib.sha1(json.dumps([request.url.path, query]).encode('utf-8')).hexdigest()
+        return f"resp:{scope}:{digest}"
+
+    def _response(self, request: Request, body: bytes, etag: str, state: str) -> Response:
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "X-Cache": state}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            if '*' in tags or etag in tags or f'W/{etag}' in tags:
+                self.not_modified += 1
+                return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    async def respond(self, request: Request, scope: str, load: Callable[[], Awaitable[Any]]) -> Response:
+        """
+        The respond function answers a GET request from the cache, or calls load and caches its result.
+        A request whose If-None-Match holds the current ETag gets a 304 without a body; on a hit load is not
+        called, so the database is not touched. If Redis is unavailable the response is built without the cache.
+
+        :param self: Represent the instance of the class
+        :param request: Request: The request to answer; its path and query string identify the entry
+        :param scope: str: The scope whose writes invalidate the entry
+        :param load: Callable[[], Awaitable[Any]]: Build the response model (or its dict) on a miss
+        :return: The response, with ETag and X-Cache headers
+        :doc-author: Trelent
+        """
+        key = self.key(scope, request)
+        started = time.perf_counter()
+        try:
+            generation, entry = await self.r.mget(self.generation_key(scope), key)
+            available = True
+        except RedisError:
+            self.errors += 1
+            generation, entry, available = None, None, False
+        finally:
+            self.lookup.observe(time.perf_counter() - started)
+        generation = generation or b'0'
+        if entry is not None:
+            entry_generation, etag, body = entry.split(b'\n', 2)
+            if entry_generation == generation:
+                self.hits += 1
+                return self._response(request, body, etag.decode(), "HIT")
+
+        self.misses += 1
+        body = dumps(await load())
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if available:
+            try:
+                await self.r.set(key, b'\n'.join([generation, etag.encode(), body]), ex=self.ttl)
+            except RedisError:
+                self.errors += 1
+        return self._response(request, body, etag, "MISS")
+
+    async def invalidate(self, *scopes: str) -> None:
+        """
+        The invalidate function retires every cached response of the given scopes.
+        The new generation outlives the entries stored under the previous one, so they can never match again.
+        All scopes are written in one pipeline, so a bulk write costs one round trip however many users it touched.
+        It runs after the database commit, so a Redis error is counted rather than raised: the write has succeeded,
+        and the stale entries expire after ttl seconds.
+
+        :param self: Represent the instance of the class
+        :param scopes: str: The scopes to invalidate
+        :return: None
+        :doc-author: Trelent
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for scope in scopes:
+            pipe.set(self.generation_key(scope), uuid.uuid4().hex, ex=2 * self.ttl)
+        try:
+            await pipe.execute()
+        except RedisError:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function returns the hit ratio of this worker with the counters and lookup latencies.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary of cache statistics
+        :doc-author: Trelent
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "lookup_seconds": self.lookup.snapshot(),
+        }
+
+
+resources.register("redis", lambda: redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0),
+                   close=lambda client: client.close())
+redis_client = resources.lazy("redis")
+
+principal_cache = PrincipalCache(
+    redis_client,
+    maxsize=settings.principal_cache_size,
+    local_ttl=settings.principal_cache_local_ttl,
+    ttl=settings.principal_cache_ttl,
+)
+
+response_cache = ResponseCache(redis_client, ttl=settings.response_cache_ttl)
+
+token_cache = TokenCache(settings.token_cache_size)
@@ -1,18 +1,33 @@
 import hashlib
 
-import cloudinary
-import cloudinary.uploader
-
 from src.conf.config import settings
+from src.services.resources import resources
 
 
-class CloudImage:
+def configure_cloudinary():
+    """
+    The configure_cloudinary function imports and configures the Cloudinary SDK.
+    It runs on the first upload instead of at import, so workers that never store an avatar skip it.
+
+    :return: The configured cloudinary module
+    :doc-author: Trelent
+    """
+    import cloudinary
+    import cloudinary.uploader
+
     cloudinary.config(
         cloud_name=settings.cloudinary_name,
         api_key=settings.cloudinary_api_key,
         api_secret=settings.cloudinary_api_secret,
         secure=True
     )
+    return cloudinary
+
+
+resources.register("cloudinary", configure_cloudinary)
+
+
+class CloudImage:
 
     @staticmethod
     def generate_name_avatar(email: str):
@@ -40,7 +55,7 @@ class CloudImage:
         :return: A dictionary
         :doc-author: Trelent
         """
-        r = cloudinary.uploader.upload(file, public_id=public_id, overwrite=True)
+        r = resources.get("cloudinary").uploader.upload(file, public_id=public_id, overwrite=True)
         return r
 
     @staticmethod
@@ -54,6 +69,6 @@ class CloudImage:
         :return: The url of the avatar image
         :doc-author: Trelent
         """
-        src_url = cloudinary.CloudinaryImage(public_id) \
+        src_url = resources.get("cloudinary").CloudinaryImage(public_id) \
             .build_url(width=250, height=250, crop='fill', version=r.get('version'))
         return src_url
@@ -1,52 +1,118 @@
+import time
+from email.message import EmailMessage
+from email.utils import formataddr
 from pathlib import Path
+from typing import Optional
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
-from pydantic import EmailStr
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.services.auth import auth_service
 from src.conf.config import settings
+from src.repository import outbox as repository_outbox
 
+CONFIRM_EMAIL = 'confirm_email'
+MAIL_FROM_NAME = 'fastapi_hw'
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=EmailStr(settings.mail_from),
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="fastapi_hw",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
+templates = Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'), autoescape=select_autoescape())
 
 
-async def send_email(email: EmailStr, username: str, host: str):
+async def enqueue_confirmation(email: str, username: str, host: str, db: AsyncSession,
+                               commit: bool = True) -> bool:
     """
-    The send_email function sends an email to the user with a link to confirm their email address.
-        The function takes in three parameters:
-            -email: EmailStr, the user's email address.
-            -username: str, the username of the user who is registering for an account.  This will be used in a greeting message within the body of the email sent to them.
-            -host: str, this is where we are hosting our application (i.e., localhost).  This will be used as part of a URL that users can click on within their emails.
-
-    :param email: EmailStr: Specify the email address of the recipient
-    :param username: str: Pass the username of the user to be sent in the email
-    :param host: str: Pass the hostname of the server to the template
-    :return: A coroutine, which is a special type of object that can be used with async/await
+    The enqueue_confirmation function puts an email confirmation message for the user into the outbox.
+    Requests for the same address within mail_dedupe_window seconds share one message key, so a user who
+    signs up and asks for the email again right away gets a single email.
+
+    :param email: str: The user's email address
+    :param username: str: The username used in the greeting
+    :param host: str: The base url of the application, for the confirmation link
+    :param db: AsyncSession: Access the database
+    :param commit: bool: Commit the transaction, or leave that to the caller
+    :return: True if a message was added, False if it was a duplicate
+    :doc-author: Trelent
+    """
+    window = int(time.time() // settings.mail_dedupe_window)
+    return await repository_outbox.enqueue(f"{CONFIRM_EMAIL}:{email}:{window}", CONFIRM_EMAIL, email,
+                                           {"username": username, "host": str(host)}, db, commit)
+
+
+def build_message(kind: str, recipient: str, payload: dict) -> EmailMessage:
+    """
+    The build_message function renders an outbox message into an email.
+    The confirmation token is created here, at delivery time, so a retried message carries a fresh token.
+
+    :param kind: str: The kind of message
+    :param recipient: str: The email address to send the message to
+    :param payload: dict: The values stored with the message
+    :return: The email
     :doc-author: Trelent
     """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+    if kind != CONFIRM_EMAIL:
+        raise ValueError(f"Unknown message kind {kind}")
+    token = auth_service.create_email_token({"sub": recipient})
+    html = templates.get_template("email_template.html").render(host=payload["host"], username=payload["username"],
+                                                                token=token)
+    message = EmailMessage()
+    message["From"] = formataddr((MAIL_FROM_NAME, settings.mail_from))
+    message["To"] = recipient
+    message["Subject"] = "Confirm your email "
+    message.set_content(html, subtype="html")
+    return message
+
+
+class SMTPConnection:
+    """
+    One authenticated SMTP connection that is opened on first use and kept open between messages.
+    A connection the server closed in the meantime is reopened once before the send is reported as failed.
+    """
+
+    def __init__(self, hostname: str = settings.mail_server, port: int = settings.mail_port,
+                 username: Optional[str] = settings.mail_username, password: Optional[str] = settings.mail_password,
+                 use_tls: bool = settings.mail_ssl_tls, start_tls: bool = settings.mail_starttls,
+                 use_credentials: bool = settings.mail_use_credentials, timeout: float = 30):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.use_credentials = use_credentials
+        self.timeout = timeout
+        self.connects = 0
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, use_tls=self.use_tls,
+                               start_tls=self.start_tls, timeout=self.timeout)
+        await smtp.connect()
+        if self.use_credentials:
+            await smtp.login(self.username, self.password)
+        self.connects += 1
+        self._smtp = smtp
+        return smtp
+
+    async def send(self, message: EmailMessage) -> None:
+        """
+        The send function delivers one email over the kept-open connection.
+
+        :param self: Represent the instance of the class
+        :param message: EmailMessage: The email to send
+        :return: None
+        :doc-author: Trelent
+        """
+        smtp = self._smtp if self._smtp is not None and self._smtp.is_connected else await self._connect()
+        try:
+            await smtp.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            smtp = await self._connect()
+            await smtp.send_message(message)
+
+    async def close(self) -> None:
+        if self._smtp is not None and self._smtp.is_connected:
+            try:
+                await self._smtp.quit()
+            except aiosmtplib.SMTPException:
+                self._smtp.close()
+        self._smtp = None
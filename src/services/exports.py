@@ -0,0 +1,50 @@
+import csv
+import datetime
+import io
+import json
+from typing import AsyncIterator
+
+from src.database.models import User
+from src.shemas import UserResponse
+
+FIELDS = list(UserResponse.__fields__)
+
+
+def _row(user: User) -> dict:
+    row = {}
+    for field in FIELDS:
+        value = getattr(user, field)
+        row[field] = value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+    return row
+
+
+async def encode_users(users: AsyncIterator[User], fmt: str, rows_per_chunk: int = 500) -> AsyncIterator[bytes]:
+    """
+    The encode_users function encodes streamed users as NDJSON or CSV with the fields of UserResponse.
+    Rows are encoded as they arrive and sent in chunks of rows_per_chunk, so only one chunk is held in memory.
+
+    :param users: AsyncIterator[User]: The users to encode
+    :param fmt: str: Either ndjson or csv
+    :param rows_per_chunk: int: The number of rows per yielded chunk
+    :return: An async iterator of encoded chunks
+    :doc-author: Trelent
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS, lineterminator='\n')
+    if fmt == 'csv':
+        writer.writeheader()
+    rows = 0
+    async for user in users:
+        row = _row(user)
+        if fmt == 'csv':
+            writer.writerow({key: '' if value is None else value for key, value in row.items()})
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False))
+            buffer.write('\n')
+        rows += 1
+        if rows % rows_per_chunk == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
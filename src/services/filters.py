@@ -0,0 +1,103 @@
+import datetime
+from typing import Any, Dict, List
+
+from pydantic import parse_obj_as, ValidationError
+from sqlalchemy import func
+
+from src.database.models import User
+
+FIELDS = {
+    "id": int,
+    "firstname": str,
+    "lastname": str,
+    "email": str,
+    "phone": str,
+    "birthday": datetime.date,
+    "additional_info": str,
+    "created_at": datetime.datetime,
+    "updated_at": datetime.datetime,
+}
+TEXT_FIELDS = {name for name, kind in FIELDS.items() if kind is str}
+
+OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "ne": lambda column, value: column != value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "in": lambda column, value: column.in_(value),
+    "not_in": lambda column, value: column.not_in(value),
+    "contains": lambda column, value: column.contains(value, autoescape=True),
+    "startswith": lambda column, value: column.startswith(value, autoescape=True),
+    "endswith": lambda column, value: column.endswith(value, autoescape=True),
+    "is_null": lambda column, value: column.is_(None) if value else column.is_not(None),
+}
+TEXT_OPERATORS = {"contains", "startswith", "endswith"}
+
+
+def _coerce(field: str, op: str, value: Any) -> Any:
+    kind = FIELDS[field]
+    if op == "is_null":
+        kind = bool
+    elif op in ("in", "not_in"):
+        kind = List[kind]
+    try:
+        return parse_obj_as(kind, value)
+    except ValidationError:
+        raise ValueError(f"Invalid value for {field}.{op}")
+
+
+def compile_filter(where: Dict[str, Any]) -> list:
+    """
+    The compile_filter function turns the filter of a bulk request into SQL conditions over the users table.
+    The filter maps a field to {operator: value}; a bare value means eq. All conditions must hold.
+    An empty filter is refused, so a typo can not update or delete every user.
+
+        {"email": {"endswith": "@old.com"}, "birthday": {"lt": "1990-01-01"}, "id": {"not_in": [1, 2]}}
+
+    :param where: Dict[str, Any]: The filter of the request
+    :return: The conditions for the WHERE clause
+    :doc-author: Trelent
+    """
+    if not where:
+        raise ValueError("The filter must not be empty")
+    conditions = []
+    for field, spec in where.items():
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field {field}")
+        if not isinstance(spec, dict):
+            spec = {"eq": spec}
+        if not spec:
+            raise ValueError(f"No operator for {field}")
+        for op, value in spec.items():
+            if op not in OPERATORS:
+                raise ValueError(f"Unknown operator {op}")
+            if op in TEXT_OPERATORS and field not in TEXT_FIELDS:
+                raise ValueError(f"{op} only applies to text fields")
+            conditions.append(OPERATORS[op](getattr(User, field), _coerce(field, op, value)))
+    return conditions
+
+
+def compile_values(values: Dict[str, Any], replace: Dict[str, tuple]) -> dict:
+    """
+    The compile_values function builds the SET clause of a bulk update.
+    values are assigned as they are; replace rewrites a substring of a text field in place,
+    e.g. {"email": ("@old.com", "@new.com")} moves every matched user to the new domain.
+
+    :param values: Dict[str, Any]: The validated fields to assign
+    :param replace: Dict[str, tuple]: Map a text field to the (old, new) substrings
+    :return: The values for the UPDATE statement
+    :doc-author: Trelent
+    """
+    for field, (old, new) in replace.items():
+        if field not in TEXT_FIELDS:
+            raise ValueError(f"replace only applies to text fields, not {field}")
+        if field in values:
+            raise ValueError(f"{field} is both set and replaced")
+    compiled = {getattr(User, field): value for field, value in values.items()}
+    compiled.update({getattr(User, field): func.replace(getattr(User, field), old, new)
+                     for field, (old, new) in replace.items()})
+    if not compiled:
+        raise ValueError("Nothing to update")
+    return compiled
@@ -0,0 +1,198 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Tuple, List, Union
+
+from pydantic import ValidationError
+from sqlalchemy import String
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.models import User
+from src.repository import users as repository_users
+from src.shemas import UserModel, ImportReport, ImportRowError
+
+# UserModel allows longer names than the users table stores, so imported rows are also checked against the columns
+COLUMN_LENGTHS = {attr.key: attr.columns[0].type.length for attr in User.__mapper__.column_attrs
+                  if isinstance(attr.columns[0].type, String) and attr.columns[0].type.length}
+
+
+async def iter_lines(chunks: AsyncIterator[bytes],
+                     max_size: int = settings.import_max_record_size) -> AsyncIterator[Union[str, ValueError]]:
+    """
+    The iter_lines function turns a stream of byte chunks into text lines without reading the whole body.
+    A line split across chunks, or a UTF-8 character split across chunks, is held back until it is complete.
+    A line longer than max_size characters is not held: it is yielded as a ValueError once,
+    and the rest of it is dropped up to the next newline.
+
+    :param chunks: AsyncIterator[bytes]: The request body stream
+    :param max_size: int: The maximum length of a line
+    :return: The lines of the body, with line endings kept, or a ValueError for each line that is too long
+    :doc-author: Trelent
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    too_long = ValueError(f'Record longer than {max_size} characters')
+    tail = ''
+    skipping = False
+    async for chunk in chunks:
+        tail += decoder.decode(chunk)
+        *lines, tail = tail.split('\n')
+        for line in lines:
+            if skipping:
+                skipping = False
+            elif len(line) >= max_size:
+                yield too_long
+            else:
+                yield line + '\n'
+        if len(tail) >= max_size:
+            if not skipping:
+                yield too_long
+            skipping, tail = True, ''
+    tail += decoder.decode(b'', final=True)
+    if tail and not skipping:
+        yield tail if len(tail) <= max_size else too_long
+
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str, max_size: int = settings.import_max_record_size
+                       ) -> AsyncIterator[Tuple[int, Union[dict, ValueError]]]:
+    """
+    The iter_records function parses an NDJSON or CSV body one record at a time.
+    CSV bodies start with a header of UserModel field names; empty cells fall back to the field defaults.
+    A record that cannot be parsed is yielded as a ValueError so the caller can report its line.
+    A record longer than max_size characters, e.g. after a stray quote, is reported and parsing resumes
+    at the next line, so a malformed body never has to fit in memory.
+
+    :param chunks: AsyncIterator[bytes]: The request body stream
+    :param fmt: str: Either ndjson or csv
+    :param max_size: int: The maximum length of a record
+    :return: Pairs of the line number where a record starts and the record or the parse error
+    :doc-author: Trelent
+    """
+    header = None
+    record: List[str] = []
+    start, size, quotes = 0, 0, 0
+    line_no = 0
+    async for line in iter_lines(chunks, max_size):
+        line_no += 1
+        if fmt == 'ndjson':
+            if isinstance(line, ValueError):
+                yield line_no, line
+                continue
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise ValueError('Expected a JSON object')
+                yield line_no, data
+            except ValueError as err:
+                yield line_no, ValueError(str(err))
+            continue
+
+        # a quoted CSV cell may contain newlines, so a record ends on a line with balanced quotes
+        if not record:
+            start = line_no
+        if isinstance(line, ValueError) or size + len(line) > max_size:
+            yield start, ValueError(f'Record longer than {max_size} characters')
+            record, size, quotes = [], 0, 0
+            continue
+        record.append(line)
+        size += len(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        row = next(csv.reader([''.join(record)]))
+        record, size, quotes = [], 0, 0
+        if not any(cell.strip() for cell in row):
+            continue
+        if header is None:
+            header = [cell.strip() for cell in row]
+            continue
+        if len(row) != len(header):
+            yield start, ValueError(f'Expected {len(header)} columns, got {len(row)}')
+            continue
+        yield start, {key: value for key, value in zip(header, row) if value != ''}
+    if record:
+        yield start, ValueError('Unterminated quoted field')
+
+
+def column_errors(body: UserModel) -> List[str]:
+    """
+    The column_errors function checks the text fields of a validated row against the lengths of their columns,
+    so a row that does not fit is reported on its own instead of failing the INSERT of its whole batch.
+
+    :param body: UserModel: The validated row
+    :return: The errors, in the format of the validation errors; empty if the row fits
+    :doc-author: Trelent
+    """
+    return [f'{field}: ensure this value has at most {length} characters'
+            for field, length in COLUMN_LENGTHS.items()
+            if isinstance(getattr(body, field, None), str) and len(getattr(body, field)) > length]
+
+
+async def import_users(chunks: AsyncIterator[bytes], fmt: str, db: AsyncSession, batch_size: int,
+                       max_errors: int, max_record_size: int = settings.import_max_record_size) -> ImportReport:
+    """
+    The import_users function validates streamed records with UserModel and the column lengths,
+    and inserts them in batches.
+    Only one batch is held in memory at a time, and at most max_errors row errors are kept in the report.
+    Every batch is committed on its own, so rows inserted before a failure stay inserted.
+
+    :param chunks: AsyncIterator[bytes]: The request body stream
+    :param fmt: str: Either ndjson or csv
+    :param db: AsyncSession: Access the database
+    :param batch_size: int: The number of rows per INSERT
+    :param max_errors: int: The maximum number of row errors listed in the report
+    :param max_record_size: int: The maximum length of a record in characters
+    :return: The import report
+    :doc-author: Trelent
+    """
+    report = ImportReport()
+    batch: List[Tuple[int, UserModel]] = []
+
+    def add_error(line: int, detail: str):
+        if len(report.errors) < max_errors:
+            report.errors.append(ImportRowError(line=line, detail=detail))
+        else:
+            report.errors_truncated = True
+
+    async def flush():
+        unique = {}
+        for line, body in batch:
+            if body.email in unique:
+                report.duplicates += 1
+                add_error(line, f'Duplicate email {body.email}')
+            else:
+                unique[body.email] = (line, body)
+        inserted = set(await repository_users.create_many([body for _, body in unique.values()], db))
+        for email, (line, _) in unique.items():
+            if email in inserted:
+                report.inserted += 1
+            else:
+                report.duplicates += 1
+                add_error(line, f'Email {email} already exists')
+        batch.clear()
+
+    async for line, record in iter_records(chunks, fmt, max_record_size):
+        if isinstance(record, ValueError):
+            report.failed += 1
+            add_error(line, str(record))
+            continue
+        try:
+            body = UserModel.parse_obj(record)
+        except ValidationError as err:
+            report.failed += 1
+            add_error(line, '; '.join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                                      for error in err.errors()))
+            continue
+        errors = column_errors(body)
+        if errors:
+            report.failed += 1
+            add_error(line, '; '.join(errors))
+            continue
+        batch.append((line, body))
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return report
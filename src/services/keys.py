@@ -0,0 +1,190 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose import jwk
+from jose.backends.base import Key
+
+ASYMMETRIC_ALGORITHMS = ('RS256', 'ES256')
+KID_FORMAT = '%Y%m%dT%H%M%SZ'
+RELOAD_INTERVAL = 60
+
+
+class SigningKey(NamedTuple):
+    kid: str
+    activates_at: datetime
+    private_key: Key
+    public_key: Key
+    public_jwk: dict
+
+
+def generate_private_key(algorithm: str) -> bytes:
+    """
+    The generate_private_key function creates a new private key for the algorithm, PEM encoded.
+
+    :param algorithm: str: RS256 or ES256
+    :return: The private key in PKCS#8 PEM
+    :doc-author: Trelent
+    """
+    if algorithm == 'RS256':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == 'ES256':
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        raise ValueError(f'Unsupported algorithm {algorithm}')
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption())
+
+
+def load_key(kid: str, pem: bytes, algorithm: str) -> SigningKey:
+    """
+    The load_key function builds a SigningKey from a PEM private key and its kid.
+    The jose key objects are constructed once here, so signing and verifying do not parse PEM again.
+
+    :param kid: str: The key id, which is also its activation moment
+    :param pem: bytes: The private key in PEM
+    :param algorithm: str: RS256 or ES256
+    :return: The signing key
+    :doc-author: Trelent
+    """
+    private_key = jwk.construct(pem, algorithm)
+    public_key = private_key.public_key()
+    public_jwk = {**public_key.to_dict(), 'kid': kid, 'use': 'sig', 'alg': algorithm}
+    activates_at = datetime.strptime(kid, KID_FORMAT).replace(tzinfo=timezone.utc)
+    return SigningKey(kid, activates_at, private_key, public_key, public_jwk)
+
+
+class KeyRing:
+    """
+    The signing keys of asymmetric JWTs, stored in one directory as <kid>.pem.
+    The kid is the UTC moment the key starts signing (20230601T000000Z). A key is published in the JWKS as soon as
+    it exists, signs tokens from its kid on, and keeps verifying tokens for grace after the next key took over.
+    Rotate by adding a key ahead of time with python -m src.services.keys generate --dir keys --ahead-hours 48;
+    the first key is created with --ahead-hours 0.
+    """
+
+    def __init__(self, algorithm: str, keys: List[SigningKey], grace: timedelta, directory: Optional[str] = None):
+        self.algorithm = algorithm
+        self.grace = grace
+        self.directory = directory
+        self.keys = sorted(keys, key=lambda key: key.activates_at)
+        self._mtime = os.stat(directory).st_mtime if directory else None
+        self._checked = time.monotonic()
+
+    @classmethod
+    def from_directory(cls, directory: str, algorithm: str, grace: timedelta) -> 'KeyRing':
+        """
+        The from_directory function loads every <kid>.pem file of a directory.
+
+        :param cls: Represent the class
+        :param directory: str: The directory holding the private keys
+        :param algorithm: str: RS256 or ES256
+        :param grace: timedelta: How long a replaced key keeps verifying tokens
+        :return: The key ring
+        :doc-author: Trelent
+        """
+        return cls(algorithm, cls._load(directory, algorithm), grace, directory)
+
+    @staticmethod
+    def _load(directory: str, algorithm: str) -> List[SigningKey]:
+        keys = []
+        for name in os.listdir(directory):
+            if name.endswith('.pem'):
+                with open(os.path.join(directory, name), 'rb') as file:
+                    keys.append(load_key(name[:-4], file.read(), algorithm))
+        return keys
+
+    def _reload(self) -> None:
+        # keys added by a rotation are picked up without a restart
+        if self.directory is None or time.monotonic() - self._checked < RELOAD_INTERVAL:
+            return
+        self._checked = time.monotonic()
+        mtime = os.stat(self.directory).st_mtime
+        if mtime != self._mtime:
+            self.keys = sorted(self._load(self.directory, self.algorithm), key=lambda key: key.activates_at)
+            self._mtime = mtime
+
+    def signing_key(self, now: Optional[datetime] = None) -> SigningKey:
+        """
+        The signing_key function returns the newest key that is already active.
+
+        :param self: Represent the instance of the class
+        :param now: Optional[datetime]: The current moment, for tests
+        :return: The key to sign new tokens with
+        :doc-author: Trelent
+        """
+        self._reload()
+        now = now or datetime.now(timezone.utc)
+        active = [key for key in self.keys if key.activates_at <= now]
+        if not active:
+            raise RuntimeError('No active signing key')
+        return active[-1]
+
+    def published(self, now: Optional[datetime] = None) -> List[SigningKey]:
+        """
+        The published function returns the keys that verify tokens: upcoming keys, the active key,
+        and replaced keys whose grace period has not run out yet.
+
+        :param self: Represent the instance of the class
+        :param now: Optional[datetime]: The current moment, for tests
+        :return: The verification keys, oldest first
+        :doc-author: Trelent
+        """
+        self._reload()
+        now = now or datetime.now(timezone.utc)
+        keys = []
+        for key, successor in zip(self.keys, self.keys[1:] + [None]):
+            if successor is None or successor.activates_at + self.grace > now:
+                keys.append(key)
+        return keys
+
+    def verification_key(self, kid: Optional[str], now: Optional[datetime] = None) -> Optional[Key]:
+        """
+        The verification_key function returns the public key for a kid, or None if it is unknown or retired.
+
+        :param self: Represent the instance of the class
+        :param kid: Optional[str]: The kid from the token header
+        :param now: Optional[datetime]: The current moment, for tests
+        :return: The public key or None
+        :doc-author: Trelent
+        """
+        for key in self.published(now):
+            if key.kid == kid:
+                return key.public_key
+        return None
+
+    def jwks(self, now: Optional[datetime] = None) -> dict:
+        """
+        The jwks function returns the published public keys as a JWK Set.
+
+        :param self: Represent the instance of the class
+        :param now: Optional[datetime]: The current moment, for tests
+        :return: The JWK Set
+        :doc-author: Trelent
+        """
+        return {"keys": [key.public_jwk for key in self.published(now)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add a signing key that becomes active after --ahead-hours')
+    parser.add_argument('command', choices=['generate'])
+    parser.add_argument('--dir', required=True)
+    parser.add_argument('--algorithm', choices=ASYMMETRIC_ALGORITHMS, default='RS256')
+    parser.add_argument('--ahead-hours', type=float, default=48)
+    args = parser.parse_args()
+    activates_at = datetime.now(timezone.utc) + timedelta(hours=args.ahead_hours)
+    kid = activates_at.strftime(KID_FORMAT)
+    os.makedirs(args.dir, exist_ok=True)
+    path = os.path.join(args.dir, f'{kid}.pem')
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as file:
+        file.write(generate_private_key(args.algorithm))
+    print(path)
+
+
+if __name__ == '__main__':
+    main()
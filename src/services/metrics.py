@@ -0,0 +1,306 @@
+import asyncio
+import bisect
+import glob
+import json
+import os
+import time
+from typing import Iterable, Dict, Tuple, List
+
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from src.conf.config import settings
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        The observe function records one value in the first bucket whose upper bound is not below it.
+
+        :param self: Represent the instance of the class
+        :param value: float: The value to record
+        :return: None
+        :doc-author: Trelent
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function returns the cumulative bucket counts, keyed by upper bound, with the sum and count.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with buckets, sum and count
+        :doc-author: Trelent
+        """
+        buckets, total = {}, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            buckets['+Inf' if bound == float('inf') else str(bound)] = total
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+UNMATCHED_ROUTE = '<unmatched>'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HISTOGRAMS = (
+    ('http_request_duration_seconds', 'HTTP request latency by route template', LATENCY_BUCKETS),
+    ('http_request_size_bytes', 'HTTP request body size by route template', SIZE_BUCKETS),
+    ('http_response_size_bytes', 'HTTP response body size by route template', SIZE_BUCKETS),
+)
+
+
+class RequestMetrics:
+    """
+    Per-process HTTP metrics kept in plain dicts and ints, so recording a request takes no lock and no I/O.
+    The Prometheus text is only built when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.histograms: Dict[Tuple[str, str], Tuple[Histogram, ...]] = {}
+        self.in_progress: Dict[str, int] = {}
+
+    def observe(self, method: str, route: str, status: int, elapsed_ns: int, request_size: int,
+                response_size: int) -> None:
+        """
+        The observe function records one finished request under its method and route template.
+
+        :param self: Represent the instance of the class
+        :param method: str: The HTTP method
+        :param route: str: The route template, e.g. /api/users/{user_id}
+        :param status: int: The response status code
+        :param elapsed_ns: int: The time spent serving the request, in nanoseconds
+        :param request_size: int: The number of request body bytes read
+        :param response_size: int: The number of response body bytes sent
+        :return: None
+        :doc-author: Trelent
+        """
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        series = self.histograms.get((method, route))
+        if series is None:
+            series = self.histograms[(method, route)] = tuple(Histogram(buckets) for _, _, buckets in HISTOGRAMS)
+        series[0].observe(elapsed_ns / 1e9)
+        series[1].observe(request_size)
+        series[2].observe(response_size)
+
+    def state(self) -> dict:
+        """
+        The state function returns the collected values in a JSON-serializable form that merge_states understands.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary of counters, histogram snapshots and in-flight requests
+        :doc-author: Trelent
+        """
+        return {
+            "requests": [[method, route, status, count] for (method, route, status), count in self.requests.items()],
+            "histograms": [[method, route, [histogram.snapshot() for histogram in series]]
+                           for (method, route), series in self.histograms.items()],
+            "in_progress": dict(self.in_progress),
+        }
+
+    def dump(self, directory: str) -> None:
+        """
+        The dump function writes the state of this worker to directory/http_<pid>.json.
+        The file is replaced atomically, so a scrape running in another worker never reads a partial file.
+
+        :param self: Represent the instance of the class
+        :param directory: str: The directory shared by all workers
+        :return: None
+        :doc-author: Trelent
+        """
+        path = os.path.join(directory, f'http_{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.state(), file)
+        os.replace(path + '.tmp', path)
+
+
+request_metrics = RequestMetrics()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def load_states(directory: str) -> List[dict]:
+    """
+    The load_states function reads the states dumped by every worker into directory.
+    Counters and histograms of exited workers are kept, like Prometheus counters, but their in-flight
+    requests are dropped.
+
+    :param directory: str: The directory shared by all workers
+    :return: The states of all workers
+    :doc-author: Trelent
+    """
+    states = []
+    for path in glob.glob(os.path.join(directory, 'http_*.json')):
+        try:
+            with open(path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if not _alive(int(os.path.basename(path)[5:-5])):
+            state["in_progress"] = {}
+        states.append(state)
+    return states
+
+
+def merge_states(states: List[dict]) -> dict:
+    """
+    The merge_states function adds up the states of several workers, series by series and bucket by bucket.
+
+    :param states: List[dict]: The states to merge
+    :return: One state holding the sums
+    :doc-author: Trelent
+    """
+    requests, histograms, in_progress = {}, {}, {}
+    for state in states:
+        for method, route, status, count in state["requests"]:
+            requests[(method, route, status)] = requests.get((method, route, status), 0) + count
+        for method, route, snapshots in state["histograms"]:
+            merged = histograms.get((method, route))
+            if merged is None:
+                histograms[(method, route)] = [{"buckets": dict(snapshot["buckets"]), "sum": snapshot["sum"],
+                                                "count": snapshot["count"]} for snapshot in snapshots]
+                continue
+            for total, snapshot in zip(merged, snapshots):
+                for bound, count in snapshot["buckets"].items():
+                    total["buckets"][bound] = total["buckets"].get(bound, 0) + count
+                total["sum"] += snapshot["sum"]
+                total["count"] += snapshot["count"]
+        for method, count in state["in_progress"].items():
+            in_progress[method] = in_progress.get(method, 0) + count
+    return {
+        "requests": [[*key, count] for key, count in requests.items()],
+        "histograms": [[*key, snapshots] for key, snapshots in histograms.items()],
+        "in_progress": in_progress,
+    }
+
+
+def _labels(**labels) -> str:
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def exposition(state: dict) -> bytes:
+    """
+    The exposition function renders a state in the Prometheus text format.
+
+    :param state: dict: A state returned by RequestMetrics.state or merge_states
+    :return: The exposition body
+    :doc-author: Trelent
+    """
+    lines = ['# HELP http_requests_total HTTP requests by route template and status code',
+             '# TYPE http_requests_total counter']
+    for method, route, status, count in sorted(state["requests"]):
+        lines.append(f'http_requests_total{_labels(method=method, route=route, status=status)} {count}')
+    for index, (name, description, _) in enumerate(HISTOGRAMS):
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+        for method, route, snapshots in sorted(state["histograms"], key=lambda series: series[:2]):
+            snapshot = snapshots[index]
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f'{name}_bucket{_labels(method=method, route=route, le=bound)} {count}')
+            lines.append(f'{name}_sum{_labels(method=method, route=route)} {snapshot["sum"]}')
+            lines.append(f'{name}_count{_labels(method=method, route=route)} {snapshot["count"]}')
+    lines += ['# HELP http_requests_in_progress HTTP requests being served',
+              '# TYPE http_requests_in_progress gauge']
+    for method, count in sorted(state["in_progress"].items()):
+        lines.append(f'http_requests_in_progress{_labels(method=method)} {count}')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    The render_metrics function renders the HTTP metrics for a scrape.
+    With settings.metrics_multiproc_dir set, the states dumped by all workers are merged, so any worker can
+    answer the scrape; the directory should be emptied before the server starts.
+
+    :return: The exposition body and its content type
+    :doc-author: Trelent
+    """
+    directory = settings.metrics_multiproc_dir
+    if not directory:
+        return exposition(request_metrics.state()), CONTENT_TYPE
+    request_metrics.dump(directory)
+    return exposition(merge_states(load_states(directory))), CONTENT_TYPE
+
+
+async def flush_metrics(directory: str, interval: float) -> None:
+    """
+    The flush_metrics function dumps the state of this worker every interval seconds until it is cancelled,
+    so a scrape served by another worker is at most one interval behind.
+
+    :param directory: str: The directory shared by all workers
+    :param interval: float: The number of seconds between dumps
+    :return: None
+    :doc-author: Trelent
+    """
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            request_metrics.dump(directory)
+    finally:
+        request_metrics.dump(directory)
+
+
+class MetricsMiddleware:
+    """
+    An ASGI middleware that records latency, status codes, in-flight requests and body sizes per route template.
+    The route template is read from the scope after routing, so path parameters do not create new series;
+    requests that match no route are recorded under <unmatched>.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: RequestMetrics = request_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        in_progress = self.metrics.in_progress
+        request_size = response_size = 0
+        status = 500
+
+        async def receive_wrapper() -> Message:
+            nonlocal request_size
+            message = await receive()
+            if message['type'] == 'http.request':
+                request_size += len(message.get('body', b''))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, response_size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                response_size += len(message.get('body', b''))
+            await send(message)
+
+        in_progress[method] = in_progress.get(method, 0) + 1
+        started = time.perf_counter_ns()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            elapsed = time.perf_counter_ns() - started
+            in_progress[method] -= 1
+            route = getattr(scope.get('route'), 'path', UNMATCHED_ROUTE)
+            self.metrics.observe(method, route, status, elapsed, request_size, response_size)
@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.conf.config import settings
+from src.database.db import DBSession
+from src.repository import outbox as repository_outbox
+from src.services.email import SMTPConnection, build_message
+from src.services.resources import resources
+
+
+class MailWorker:
+    """
+    Delivers outbox messages in batches over one kept-open SMTP connection.
+    Failed messages are retried after retry_base * 2 ** (attempt - 1) seconds, and marked failed after
+    max_attempts. Delivery is at least once: a worker that dies after sending but before recording it
+    sends the message again when the lease runs out.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker, connection: SMTPConnection,
+                 batch_size: int = settings.mail_batch_size, max_attempts: int = settings.mail_max_attempts,
+                 retry_base: float = settings.mail_retry_base, lease: float = settings.mail_lease):
+        self.session_maker = session_maker
+        self.connection = connection
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease = timedelta(seconds=lease)
+        self.sent = 0
+        self.failed = 0
+        self.errors = 0
+        self.last_error = None
+
+    async def run_once(self) -> int:
+        """
+        The run_once function claims one batch of due messages and tries to deliver each of them.
+
+        :param self: Represent the instance of the class
+        :return: The number of messages claimed
+        :doc-author: Trelent
+        """
+        async with self.session_maker() as db:
+            messages = await repository_outbox.claim(self.batch_size, self.lease, db)
+            delivered = []
+            for message in messages:
+                try:
+                    await self.connection.send(build_message(message.kind, message.recipient, message.payload))
+                except Exception as err:
+                    self.failed += 1
+                    retry_at = datetime.utcnow() + timedelta(seconds=self.retry_base * 2 ** (message.attempts - 1))
+                    await repository_outbox.mark_failed(message, f"{type(err).__name__}: {err}", retry_at,
+                                                        message.attempts >= self.max_attempts, db)
+                else:
+                    delivered.append(message.id)
+            await repository_outbox.mark_sent(delivered, db)
+            self.sent += len(delivered)
+            return len(messages)
+
+    async def run(self, stop: asyncio.Event, poll_interval: float = settings.mail_poll_interval) -> None:
+        """
+        The run function delivers batches until stop is set, waiting poll_interval seconds whenever the outbox
+        has nothing due, and closes the SMTP connection at the end.
+        A batch that fails as a whole, e.g. because the database is down, is counted in errors and the worker
+        waits twice as long after each failure in a row, up to the lease, instead of stopping.
+
+        :param self: Represent the instance of the class
+        :param stop: asyncio.Event: Set to stop the worker
+        :param poll_interval: float: The number of seconds to wait when there is nothing to send
+        :return: None
+        :doc-author: Trelent
+        """
+        failures = 0
+        try:
+            while not stop.is_set():
+                try:
+                    claimed = await self.run_once()
+                except Exception as err:
+                    self.errors += 1
+                    self.last_error = f"{type(err).__name__}: {err}"
+                    failures += 1
+                    await self._wait(stop, min(poll_interval * 2 ** (failures - 1), self.lease.total_seconds()))
+                    continue
+                failures = 0
+                if claimed == 0:
+                    await self._wait(stop, poll_interval)
+        finally:
+            await self.connection.close()
+
+    @staticmethod
+    async def _wait(stop: asyncio.Event, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def serve(workers: int = settings.mail_workers, session_maker: async_sessionmaker = DBSession,
+                connection_factory: Callable[[], SMTPConnection] = SMTPConnection,
+                stop: asyncio.Event = None) -> None:
+    """
+    The serve function runs a pool of delivery workers, each with its own SMTP connection.
+
+    :param workers: int: The number of workers
+    :param session_maker: async_sessionmaker: Create database sessions
+    :param connection_factory: Callable[[], SMTPConnection]: Create the SMTP connection of a worker
+    :param stop: asyncio.Event: Set to stop all workers
+    :return: None
+    :doc-author: Trelent
+    """
+    stop = stop or asyncio.Event()
+    await asyncio.gather(*(MailWorker(session_maker, connection_factory()).run(stop) for _ in range(workers)))
+
+
+async def main() -> None:
+    try:
+        await serve()
+    finally:
+        await resources.aclose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
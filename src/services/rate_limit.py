@@ -0,0 +1,237 @@
+import math
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import redis.asyncio as redis
+from fastapi import Depends, HTTPException, status
+from redis.exceptions import NoScriptError, RedisError
+
+from src.conf.config import settings
+from src.database.models import Guest, Role
+from src.services.auth import auth_service
+from src.services.cache import redis_client
+
+# KEYS come in pairs: the counter of the current window and the one of the window before it.
+# ARGV holds, per pair, the local hits to add to each of the two counters and their ttl.
+# Returns the global count of both windows for every pair.
+SYNC_SCRIPT = """
+local function add(key, delta, ttl)
+  if delta > 0 then
+    local count = redis.call('INCRBY', key, delta)
+    redis.call('EXPIRE', key, ttl)
+    return count
+  end
+  return tonumber(redis.call('GET', key) or '0')
+end
+local counts = {}
+for i = 1, #KEYS, 2 do
+  local j = (i - 1) / 2 * 3 + 1
+  counts[i] = add(KEYS[i], tonumber(ARGV[j]), ARGV[j + 2])
+  counts[i + 1] = add(KEYS[i + 1], tonumber(ARGV[j + 1]), ARGV[j + 2])
+end
+return counts
+"""
+
+
+class Quota(NamedTuple):
+    times: int
+    seconds: int
+
+    @classmethod
+    def parse(cls, value: str) -> 'Quota':
+        """
+        The parse function reads a quota written as times/seconds, like 60/60.
+
+        :param cls: Represent the class
+        :param value: str: The quota
+        :return: The quota
+        :doc-author: Trelent
+        """
+        times, seconds = value.split('/')
+        return cls(int(times), int(seconds))
+
+
+class _Window:
+    __slots__ = ('index', 'seconds', 'previous', 'current', 'pending', 'pending_previous')
+
+    def __init__(self, index: int, seconds: int, previous: int = 0, pending_previous: int = 0):
+        self.index = index
+        self.seconds = seconds
+        self.previous = previous
+        self.current = 0
+        self.pending = 0
+        self.pending_previous = pending_previous
+
+
+class RateLimiter:
+    """
+    Sliding-window rate limits per principal that are decided in process.
+    Every worker counts hits locally and reconciles with Redis at most once per sync_interval: one EVALSHA pushes
+    the local hits of every active key and returns the global counts, which include the other workers' hits.
+    The limit is the sliding-window estimate previous * (1 - elapsed fraction) + current, so bursts at a window
+    edge are not let through twice. Between syncs each worker only sees its own new hits, so all workers together
+    can overshoot a quota by at most what they admit in one sync_interval.
+    When Redis is unavailable the limiter keeps working on local counts.
+    """
+
+    def __init__(self, r: redis.Redis, quotas: Dict[Role, Quota], sync_interval: float, prefix: str = 'rl'):
+        self.r = r
+        self.quotas = quotas
+        self.sync_interval = sync_interval
+        self.prefix = prefix
+        self.windows: Dict[str, _Window] = {}
+        self.allowed = 0
+        self.rejected = 0
+        self.syncs = 0
+        self.errors = 0
+        self._synced_at = 0.0
+        self._sha: Optional[str] = None
+
+    def hit(self, key: str, quota: Quota, now: Optional[float] = None) -> float:
+        """
+        The hit function counts one request of key against quota.
+
+        :param self: Represent the instance of the class
+        :param key: str: The principal the quota applies to
+        :param quota: Quota: The quota of the principal
+        :param now: Optional[float]: The current unix time, for tests
+        :return: 0 if the request is allowed, otherwise the number of seconds to wait
+        :doc-author: Trelent
+        """
+        now = time.time() if now is None else now
+        index = int(now // quota.seconds)
+        window = self.windows.get(key)
+        if window is None or window.index != index or window.seconds != quota.seconds:
+            if window is not None and window.index == index - 1 and window.seconds == quota.seconds:
+                # hits of the last window that were not pushed yet go out with the next sync
+                window = _Window(index, quota.seconds, window.current, window.pending)
+            else:
+                window = _Window(index, quota.seconds)
+            self.windows[key] = window
+        elapsed = (now - index * quota.seconds) / quota.seconds
+        if window.previous * (1 - elapsed) + window.current >= quota.times:
+            self.rejected += 1
+            if window.previous and window.current < quota.times:
+                # wait until enough of the previous window has slid out
+                return max((1 - (quota.times - window.current) / window.previous - elapsed) * quota.seconds, 0.001)
+            return (1 - elapsed) * quota.seconds
+        window.current += 1
+        window.pending += 1
+        self.allowed += 1
+        return 0
+
+    def _key(self, key: str, index: int, seconds: int) -> str:
+        return f"{self.prefix}:{seconds}:{index}:{key}"
+
+    async def _eval(self, keys: List[str], args: List[int]) -> List[int]:
+        if self._sha is None:
+            self._sha = await self.r.script_load(SYNC_SCRIPT)
+        try:
+            return await self.r.evalsha(self._sha, len(keys), *keys, *args)
+        except NoScriptError:
+            self._sha = await self.r.script_load(SYNC_SCRIPT)
+            return await self.r.evalsha(self._sha, len(keys), *keys, *args)
+
+    async def sync(self, now: Optional[float] = None) -> None:
+        """
+        The sync function pushes the local hits of every active key to Redis in one script call
+        and replaces the local counts with the global ones. Keys idle for a whole window are dropped.
+
+        :param self: Represent the instance of the class
+        :param now: Optional[float]: The current unix time, for tests
+        :return: None
+        :doc-author: Trelent
+        """
+        now = time.time() if now is None else now
+        self._synced_at = time.monotonic()
+        active: List[Tuple[str, _Window, int, int]] = []
+        keys, args = [], []
+        for key, window in list(self.windows.items()):
+            if window.index < int(now // window.seconds) - 1:
+                del self.windows[key]
+                continue
+            active.append((key, window, window.pending, window.pending_previous))
+            keys += [self._key(key, window.index, window.seconds), self._key(key, window.index - 1, window.seconds)]
+            args += [window.pending, window.pending_previous, window.seconds * 2]
+            window.pending = window.pending_previous = 0
+        if not active:
+            return
+        try:
+            counts = await self._eval(keys, args)
+        except RedisError:
+            self.errors += 1
+            for key, window, pushed, pushed_previous in active:
+                window.pending += pushed
+                window.pending_previous += pushed_previous
+            return
+        self.syncs += 1
+        for i, (key, window, pushed, pushed_previous) in enumerate(active):
+            if self.windows.get(key) is window:
+                window.current = int(counts[2 * i]) + window.pending
+                window.previous = int(counts[2 * i + 1]) + window.pending_previous
+
+    async def check(self, key: str, role: Role) -> float:
+        """
+        The check function counts a request of a principal against the quota of its role,
+        reconciling with Redis first when the last sync is older than sync_interval.
+
+        :param self: Represent the instance of the class
+        :param key: str: The principal the quota applies to
+        :param role: Role: The role of the principal
+        :return: 0 if the request is allowed, otherwise the number of seconds to wait
+        :doc-author: Trelent
+        """
+        if time.monotonic() - self._synced_at >= self.sync_interval:
+            await self.sync()
+        return self.hit(key, self.quotas.get(role, self.quotas[Role.guest]))
+
+    def reset(self) -> None:
+        self.windows.clear()
+        self._synced_at = 0.0
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function reports the decisions and Redis syncs of this worker.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary of statistics
+        :doc-author: Trelent
+        """
+        return {"active_keys": len(self.windows), "allowed": self.allowed, "rejected": self.rejected,
+                "syncs": self.syncs, "errors": self.errors,
+                "quotas": {role.value: list(quota) for role, quota in self.quotas.items()}}
+
+
+class RateLimit:
+    """
+    A dependency that applies the quota of the current user's role; scope names a separate quota.
+    """
+
+    def __init__(self, limiter: RateLimiter, scope: str):
+        self.limiter = limiter
+        self.scope = scope
+
+    async def __call__(self, current_user: Guest = Depends(auth_service.get_current_user)):
+        """
+        The __call__ function rejects the request with 429 and Retry-After when the user is over quota.
+
+        :param self: Represent the instance of the class
+        :param current_user: Guest: Get the current user
+        :return: None
+        :doc-author: Trelent
+        """
+        retry_after = await self.limiter.check(f"{self.scope}:{current_user.id}", current_user.roles)
+        if retry_after:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too Many Requests",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+rate_limiter = RateLimiter(
+    redis_client,
+    {
+        Role.admin: Quota.parse(settings.rate_limit_admin),
+        Role.moderator: Quota.parse(settings.rate_limit_moderator),
+        Role.guest: Quota.parse(settings.rate_limit_guest),
+    },
+    settings.rate_limit_sync_interval,
+)
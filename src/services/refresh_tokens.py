@@ -0,0 +1,95 @@
+import uuid
+
+import redis.asyncio as redis
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from src.services.cache import redis_client
+
+
+class RefreshTokenFamilies:
+    """
+    Refresh tokens are rotated: every refresh token carries a family id (fam) and a unique jti, and Redis keeps
+    only the jti of the newest token of each family, expiring with it. Presenting an older token of a family
+    means it was copied, so the whole family is revoked.
+    Without Redis no token can be issued or rotated safely, so a RedisError is counted and answered with 503.
+    """
+
+    def __init__(self, r: redis.Redis):
+        self.r = r
+        self.rotations = 0
+        self.reuses = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(family: str) -> str:
+        return f"refresh:{family}"
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    async def start(self, jti: str, ttl: int) -> str:
+        """
+        The start function opens a new family whose first token is jti, e.g. on login.
+
+        :param self: Represent the instance of the class
+        :param jti: str: The jti of the first refresh token
+        :param ttl: int: The lifetime of the refresh token in seconds
+        :return: The family id
+        :doc-author: Trelent
+        """
+        family = self.new_id()
+        try:
+            await self.r.set(self.key(family), jti, ex=ttl)
+        except RedisError:
+            self.errors += 1
+            raise self.unavailable()
+        return family
+
+    async def rotate(self, family: str, jti: str, new_jti: str, ttl: int) -> bool:
+        """
+        The rotate function replaces the current token of a family with new_jti if jti is the current one.
+        SET XX GET swaps the jti in one atomic command, so two refreshes with the same token cannot both win.
+        If jti is not the current token, the family is revoked.
+
+        :param self: Represent the instance of the class
+        :param family: str: The family id from the presented token
+        :param jti: str: The jti of the presented token
+        :param new_jti: str: The jti of the token that replaces it
+        :param ttl: int: The lifetime of the new refresh token in seconds
+        :return: True if the token was current, False if it was reused, revoked or expired
+        :doc-author: Trelent
+        """
+        try:
+            current = await self.r.set(self.key(family), new_jti, ex=ttl, xx=True, get=True)
+            if current is None:
+                return False
+            if current.decode() != jti:
+                self.reuses += 1
+                await self.revoke(family)
+                return False
+        except RedisError:
+            self.errors += 1
+            raise self.unavailable()
+        self.rotations += 1
+        return True
+
+    async def revoke(self, family: str) -> None:
+        """
+        The revoke function ends a family; none of its refresh tokens can be used afterwards.
+
+        :param self: Represent the instance of the class
+        :param family: str: The family id
+        :return: None
+        :doc-author: Trelent
+        """
+        await self.r.delete(self.key(family))
+
+    @staticmethod
+    def unavailable() -> HTTPException:
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                             detail="Refresh tokens are unavailable, try again later", headers={"Retry-After": "1"})
+
+
+refresh_families = RefreshTokenFamilies(redis_client)
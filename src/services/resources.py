@@ -0,0 +1,114 @@
+import inspect
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+Close = Callable[[Any], Union[Awaitable[None], None]]
+
+
+class Resources:
+    """
+    The clients a worker holds for its lifetime: the database engine, the Redis pool, the avatar storage.
+    Each one is registered with a factory and created on first use, so importing the application connects to
+    nothing and configures nothing it does not need. The application lifespan calls aclose on shutdown, which
+    closes what was created, newest first; the next use after that creates a fresh one.
+    """
+
+    def __init__(self):
+        self.factories: Dict[str, Tuple[Callable[[], Any], Optional[Close]]] = {}
+        self.instances: Dict[str, Any] = {}
+        self.init_seconds: Dict[str, float] = {}
+        self.close_errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Close] = None) -> None:
+        """
+        The register function declares a resource; nothing is created until it is first used.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the resource
+        :param factory: Callable[[], Any]: Create the resource
+        :param close: Optional[Close]: Release the resource on shutdown; may be a coroutine function
+        :return: None
+        :doc-author: Trelent
+        """
+        self.factories[name] = (factory, close)
+
+    def get(self, name: str) -> Any:
+        """
+        The get function returns the resource, creating it on the first call and timing its creation.
+        Creation is guarded by a lock, because the avatar upload pool may ask for a resource from its threads.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the resource
+        :return: The resource
+        :doc-author: Trelent
+        """
+        try:
+            return self.instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self.instances:
+                factory, _ = self.factories[name]
+                started = time.perf_counter()
+                self.instances[name] = factory()
+                self.init_seconds[name] = time.perf_counter() - started
+            return self.instances[name]
+
+    def lazy(self, name: str) -> "LazyResource":
+        return LazyResource(self, name)
+
+    async def aclose(self) -> None:
+        """
+        The aclose function closes every created resource, newest first.
+        A resource that fails to close is recorded in close_errors and does not keep the others open.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        for name in reversed(list(self.instances)):
+            instance = self.instances.pop(name)
+            _, close = self.factories[name]
+            if close is None:
+                continue
+            try:
+                result = close(instance)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as err:
+                self.close_errors[name] = f"{type(err).__name__}: {err}"
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function reports which resources this worker has created and how long each took.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary of resource statistics
+        :doc-author: Trelent
+        """
+        return {
+            "registered": sorted(self.factories),
+            "created": {name: round(self.init_seconds[name] * 1000, 3) for name in self.instances},
+            "close_errors": dict(self.close_errors),
+        }
+
+
+class LazyResource:
+    """
+    Stands in for a registered resource and forwards every attribute to it, creating it on first access.
+    Services keep taking their client as a constructor argument, so they can still be given another one in tests.
+    """
+
+    __slots__ = ("_resources", "_name")
+
+    def __init__(self, resources: Resources, name: str):
+        self._resources = resources
+        self._name = name
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._resources.get(self._name), item)
+
+
+resources = Resources()
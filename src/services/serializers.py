@@ -0,0 +1,63 @@
+from operator import attrgetter
+from typing import Any, Iterable, List, Type
+
+import orjson
+from pydantic import BaseModel
+
+from src.shemas import UserResponse, GuestResponse
+
+
+class Serializer:
+    """
+    Copies the fields of a response model straight from ORM objects into plain dicts.
+    The objects come from our own database, so the pydantic validation of response_model is skipped;
+    orjson encodes the date, datetime and enum values of the dicts natively.
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.fields = tuple(model.__fields__)
+        self._values = attrgetter(*self.fields)
+
+    def dump(self, obj: Any) -> dict:
+        """
+        The dump function returns the response model fields of one object as a dict.
+
+        :param self: Represent the instance of the class
+        :param obj: Any: An ORM object (or any object with the model's attributes)
+        :return: A dict ready to be encoded
+        :doc-author: Trelent
+        """
+        return dict(zip(self.fields, self._values(obj)))
+
+    def dump_many(self, objs: Iterable[Any]) -> List[dict]:
+        """
+        The dump_many function returns the response model fields of every object, in order.
+
+        :param self: Represent the instance of the class
+        :param objs: Iterable[Any]: The ORM objects
+        :return: A list of dicts ready to be encoded
+        :doc-author: Trelent
+        """
+        fields, values = self.fields, self._values
+        return [dict(zip(fields, values(obj))) for obj in objs]
+
+
+user_serializer = Serializer(UserResponse)
+guest_serializer = Serializer(GuestResponse)
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(content: Any) -> bytes:
+    """
+    The dumps function encodes response content with orjson; pydantic models are encoded through their dict().
+
+    :param content: Any: The content to encode
+    :return: The JSON body
+    :doc-author: Trelent
+    """
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
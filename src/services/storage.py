@@ -0,0 +1,147 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+from src.conf.config import settings
+from src.services.cloudinary import CloudImage
+from src.services.resources import resources
+
+AVATAR_EXTENSION = '.jpg'
+AVATAR_MEDIA_TYPE = 'image/jpeg'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+NAME_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+class AvatarStorage(ABC):
+    """
+    Where resized avatars are kept. save is blocking and runs on the avatar upload pool.
+    """
+
+    @abstractmethod
+    def save(self, email: str, image: bytes) -> str:
+        """
+        The save function stores the avatar of a user.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :param image: bytes: The resized avatar
+        :return: The url of the stored avatar
+        :doc-author: Trelent
+        """
+
+
+class CloudinaryStorage(AvatarStorage):
+    """
+    Avatars on Cloudinary, one public_id per user that every upload overwrites.
+    """
+
+    def save(self, email: str, image: bytes) -> str:
+        public_id = CloudImage.generate_name_avatar(email)
+        r = CloudImage.upload(io.BytesIO(image), public_id)
+        return CloudImage.get_url_for_avatar(public_id, r)
+
+
+class LocalStorage(AvatarStorage):
+    """
+    Avatars on the local disk, content-addressed: a file is named by the SHA256 of its bytes and sharded into
+    two levels of directories by the first four hex digits (ab/cd/abcd...jpg), so a name never changes content
+    and can be cached forever. Identical images are stored once.
+    """
+
+    def __init__(self, directory: str, url_prefix: str):
+        self.directory = Path(directory)
+        self.url_prefix = url_prefix.rstrip('/')
+
+    @staticmethod
+    def relative_path(name: str) -> str:
+        return f'{name[:2]}/{name[2:4]}/{name}{AVATAR_EXTENSION}'
+
+    def save(self, email: str, image: bytes) -> str:
+        name = hashlib.sha256(image).hexdigest()
+        path = self.directory / self.relative_path(name)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(image)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        return f'{self.url_prefix}/{self.relative_path(name)}'
+
+    def path(self, name: str) -> Optional[Path]:
+        """
+        The path function returns the file of a stored avatar, or None if the name is not a stored avatar.
+
+        :param self: Represent the instance of the class
+        :param name: str: The content hash of the avatar
+        :return: The path of the file or None
+        :doc-author: Trelent
+        """
+        if not NAME_PATTERN.fullmatch(name):
+            return None
+        path = self.directory / self.relative_path(name)
+        return path if path.is_file() else None
+
+
+class SendfileResponse(FileResponse):
+    """
+    A FileResponse that lets the server send the file itself when it supports the ASGI pathsend extension,
+    so the body goes from the page cache to the socket with sendfile and never passes through Python.
+    Other servers get the regular chunked FileResponse.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if "http.response.pathsend" not in scope.get("extensions", {}):
+            await super().__call__(scope, receive, send)
+            return
+        if self.stat_result is None:
+            self.set_stat_headers(os.stat(self.path))
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+        if self.background is not None:
+            await self.background()
+
+
+def create_storage(kind: str = settings.avatar_storage) -> AvatarStorage:
+    """
+    The create_storage function builds the avatar storage selected by the avatar_storage setting.
+
+    :param kind: str: cloudinary or local
+    :return: The avatar storage
+    :doc-author: Trelent
+    """
+    if kind == 'cloudinary':
+        return CloudinaryStorage()
+    if kind == 'local':
+        return LocalStorage(settings.avatar_dir, settings.avatar_url_prefix)
+    raise ValueError(f'Unknown avatar storage {kind}')
+
+
+resources.register("avatar_storage", create_storage)
+
+
+def get_avatar_storage() -> AvatarStorage:
+    """
+    The get_avatar_storage function returns the avatar storage of this worker, creating it on first use.
+
+    :return: The avatar storage
+    :doc-author: Trelent
+    """
+    return resources.get("avatar_storage")
+
+
+avatar_storage = resources.lazy("avatar_storage")
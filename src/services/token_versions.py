@@ -0,0 +1,86 @@
+import redis.asyncio as redis
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.cache import TTLCache, redis_client
+
+
+class TokenVersions:
+    """
+    A counter per user in Redis that is put into access tokens as the ver claim.
+    Bumping it when the roles of a user change makes every token issued before stale.
+    Versions are kept in process for local_ttl seconds, so checking a token needs no round trip on most requests;
+    a bump reaches the other workers within local_ttl.
+
+    The counters are stored without a TTL and Redis must not evict them (maxmemory-policy noeviction or volatile-*):
+    a lost counter would read as 0 again and bring back the tokens it revoked. A worker that still knows a higher
+    version writes it back. While Redis is unreachable the last version seen within stale_ttl is used;
+    a user whose version this worker has not seen gets 503, never a token that may have been revoked.
+    """
+
+    def __init__(self, r: redis.Redis, maxsize: int, local_ttl: float, stale_ttl: float):
+        self.r = r
+        self.local = TTLCache(maxsize, local_ttl)
+        self.known = TTLCache(maxsize, stale_ttl)
+        self.errors = 0
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"tokver:{user_id}"
+
+    async def get(self, user_id: int) -> int:
+        """
+        The get function returns the current token version of a user; users never bumped are at 0.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The id of the user
+        :return: The token version
+        :doc-author: Trelent
+        """
+        version = self.local.get(user_id)
+        if version is not None:
+            return version
+        known = self.known.get(user_id)
+        try:
+            version = await self.r.get(self.key(user_id))
+            if version is None and known:
+                await self.r.set(self.key(user_id), known, nx=True)
+                version = await self.r.get(self.key(user_id))
+        except RedisError:
+            self.errors += 1
+            if known is None:
+                raise self.unavailable()
+            return known
+        return self._remember(user_id, int(version or 0))
+
+    async def bump(self, user_id: int) -> int:
+        """
+        The bump function increments the token version of a user, which rejects the tokens issued before.
+        If Redis is unreachable nothing was revoked, so the caller gets 503 rather than a silent success.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The id of the user
+        :return: The new token version
+        :doc-author: Trelent
+        """
+        try:
+            version = await self.r.incr(self.key(user_id))
+        except RedisError:
+            self.errors += 1
+            raise self.unavailable()
+        return self._remember(user_id, version)
+
+    def _remember(self, user_id: int, version: int) -> int:
+        self.local.set(user_id, version)
+        self.known.set(user_id, version)
+        return version
+
+    @staticmethod
+    def unavailable() -> HTTPException:
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                             detail="Token revocation is unavailable, try again later", headers={"Retry-After": "1"})
+
+
+token_versions = TokenVersions(redis_client, settings.token_version_cache_size, settings.token_version_local_ttl,
+                               settings.token_version_stale_ttl)
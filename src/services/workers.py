@@ -0,0 +1,55 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any
+
+
+class WorkerPoolBusy(Exception):
+    pass
+
+
+class WorkerPool:
+    def __init__(self, max_workers: int, max_queue: int, timeout: float, name: str = 'worker'):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """
+        The run function executes fn(*args) on one of the pool threads and awaits the result,
+        so CPU-heavy calls that release the GIL (bcrypt, image codecs) do not block the event loop.
+        At most max_workers calls run while max_queue more wait; further calls and calls that do not
+        finish within timeout seconds raise WorkerPoolBusy instead of piling up.
+        A call that timed out keeps its slot until its thread is done, because the thread can not be stopped.
+
+        :param self: Represent the instance of the class
+        :param fn: Callable: The blocking function to run
+        :param args: The arguments of the function
+        :return: The return value of fn
+        :doc-author: Trelent
+        """
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                raise WorkerPoolBusy()
+            self.pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise WorkerPoolBusy()
+
+    def _release(self, future=None) -> None:
+        # done callbacks run on the pool thread that finished the call
+        with self._lock:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
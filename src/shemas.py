@@ -1,7 +1,9 @@
 import datetime
-from pydantic import BaseModel, Field, EmailStr
+from typing import Any, Dict, List, Optional
 
-from src.database.models import Role
+from pydantic import BaseModel, Field, EmailStr, root_validator
+
+from src.database.models import Role, AvatarStatus
 
 
 class UserModel(BaseModel):
@@ -9,14 +11,14 @@ class UserModel(BaseModel):
     lastname: str = Field(default='Unknown', min_length=2, max_length=50)
     email: EmailStr
     phone: str = Field(default='+380001234567', min_length=10, max_length=15)
-    birthday: datetime.date = Field(default='2022-04-15')
+    birthday: datetime.date = Field(default=datetime.date(2022, 4, 15))
     additional_info: str = Field(default='nothing yet', min_length=1, max_length=150)
 
 
 class UserResponse(BaseModel):
     id: int
     firstname: str
-    lastname: str
+    lastname: Optional[str]
     email: EmailStr
     phone: str
     birthday: datetime.date
@@ -28,6 +30,81 @@ class UserResponse(BaseModel):
         orm_mode = True
 
 
+class UserPage(BaseModel):
+    items: List[UserResponse]
+    next_cursor: Optional[str] = None
+    estimated_total: Optional[int] = None
+
+
+BATCH_GET_MAX = 100
+
+
+class UserBatchRequest(BaseModel):
+    ids: List[int] = Field(default=[], max_items=BATCH_GET_MAX)
+    emails: List[str] = Field(default=[], max_items=BATCH_GET_MAX)
+
+    @root_validator(skip_on_failure=True)
+    def check_size(cls, values):
+        size = len(values["ids"]) + len(values["emails"])
+        if not 0 < size <= BATCH_GET_MAX:
+            raise ValueError(f"Pass between 1 and {BATCH_GET_MAX} ids and emails")
+        return values
+
+
+class UserBatchItem(BaseModel):
+    id: Optional[int] = None
+    email: Optional[str] = None
+    found: bool
+    user: Optional[UserResponse] = None
+
+
+class UserBatchResponse(BaseModel):
+    items: List[UserBatchItem]
+
+
+class UserPatch(BaseModel):
+    firstname: Optional[str] = Field(default=None, min_length=1, max_length=50)
+    lastname: Optional[str] = Field(default=None, min_length=2, max_length=50)
+    email: Optional[EmailStr] = None
+    phone: Optional[str] = Field(default=None, min_length=10, max_length=15)
+    birthday: Optional[datetime.date] = None
+    additional_info: Optional[str] = Field(default=None, min_length=1, max_length=150)
+
+
+class TextReplace(BaseModel):
+    old: str = Field(min_length=1)
+    new: str
+
+
+class UserBulkDelete(BaseModel):
+    where: Dict[str, Any]
+    dry_run: bool = False
+
+
+class UserBulkUpdate(UserBulkDelete):
+    set: UserPatch = UserPatch()
+    replace: Dict[str, TextReplace] = {}
+
+
+class BulkResult(BaseModel):
+    matched: int
+    ids: List[int]
+    dry_run: bool
+
+
+class ImportRowError(BaseModel):
+    line: int
+    detail: str
+
+
+class ImportReport(BaseModel):
+    inserted: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+    errors_truncated: bool = False
+
+
 class GuestModel(BaseModel):
     guest_name: str = Field()
     email: EmailStr
@@ -45,6 +122,14 @@ class GuestResponse(BaseModel):
         orm_mode = True
 
 
+class AvatarResponse(GuestResponse):
+    avatar_status: AvatarStatus
+
+
+class RoleModel(BaseModel):
+    roles: Role
+
+
 class TokenModel(BaseModel):
     access_token: str
     refresh_token: str
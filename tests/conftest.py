@@ -1,19 +1,33 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 from main import app
-from src.database.models import Base
+from src.database.models import Base, Guest, Role
 from src.database.db import get_db
+from src.services.cache import principal_cache, response_cache
+from src.services.refresh_tokens import refresh_families
+from src.services.rate_limit import rate_limiter
+from src.services.token_versions import token_versions
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# TestClient runs every request on its own event loop, so connections must not be pooled across them
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False,
+                                              expire_on_commit=False)
+
 
 @pytest.fixture(scope="module")
 def session():
@@ -33,20 +47,151 @@ def session():
 def client(session):
     # Dependency override
 
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async def override_get_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
 
     yield TestClient(app)
 
 
-@pytest.fixture(scope="module")
-def user():
-    return {"name": "deadpool", "email": "deadpool@example.com", "password": "123456789"}
+@pytest.fixture()
+def queries():
+    """The SQL statements the app sends to the test database; clear it before the request under test."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
+@pytest.fixture()
+def commits():
+    """The transactions the app commits on the test database, counted like the queries fixture."""
+    committed = []
+
+    def record(conn):
+        committed.append(conn)
+
+    event.listen(async_engine.sync_engine, "commit", record)
+    yield committed
+    event.remove(async_engine.sync_engine, "commit", record)
+
+
+@pytest.fixture(autouse=True)
+def principal_cache_redis():
+    principal_cache.local.clear()
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.get.return_value = None
+        yield redis_mock
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    async def incr(self, key):
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value).encode()
+        return value
+
+    async def set(self, key, value, ex=None, xx=False, nx=False, get=False):
+        current = self.data.get(key)
+        if (not xx or current is not None) and (not nx or current is None):
+            self.data[key] = value.encode() if isinstance(value, str) else value
+        return current if get else True
 
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
 
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
 
+
+class FakePipeline:
+    def __init__(self, r):
+        self.r = r
+        self.calls = []
+
+    def set(self, *args, **kwargs):
+        self.calls.append(self.r.set(*args, **kwargs))
+        return self
+
+    async def execute(self):
+        return [await call for call in self.calls]
+
+
+@pytest.fixture()
+def fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture(autouse=True)
+def response_cache_redis():
+    with patch.object(response_cache, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.mget.return_value = [None, None]
+        redis_mock.pipeline = MagicMock()
+        redis_mock.pipeline.return_value.execute = AsyncMock()
+        yield redis_mock
+
+
+@pytest.fixture(autouse=True)
+def refresh_families_redis():
+    with patch.object(refresh_families, "r", FakeRedis()) as fake:
+        yield fake
+
+
+@pytest.fixture(autouse=True)
+def token_versions_redis():
+    token_versions.local.clear()
+    token_versions.known.clear()
+    with patch.object(token_versions, "r", FakeRedis()) as fake:
+        yield fake
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter_redis():
+    rate_limiter.reset()
+    with patch.object(rate_limiter, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.evalsha.side_effect = lambda sha, numkeys, *args: [0] * numkeys
+        yield redis_mock
+
+
+@pytest.fixture(scope="module")
+def user():
+    return {"guest_name": "deadpool", "email": "deadpool@example.com", "password": "123456789"}
+
+
+@pytest.fixture()
+def token(client, user, session):
+    client.post("/api/auth/signup", json=user)
+
+    current_user: Guest = session.query(Guest).filter(Guest.email == user.get("email")).first()
+    current_user.confirmed = True
+    session.commit()
+    response = client.post("/api/auth/login", data={"username": user.get("email"), "password": user.get("password")})
+    data = response.json()
+    return data["access_token"]
+
+
+@pytest.fixture()
+def admin_token(client, user, session):
+    client.post("/api/auth/signup", json=user)
+    current_user: Guest = session.query(Guest).filter(Guest.email == user.get("email")).first()
+    current_user.confirmed = True
+    current_user.roles = Role.admin
+    session.commit()
+    response = client.post("/api/auth/login", data={"username": user.get("email"), "password": user.get("password")})
+    yield response.json()["access_token"]
+    current_user.roles = Role.guest
+    session.commit()
@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from redis.exceptions import ConnectionError
+
+from src.database.models import Role
+from src.services.cache import TTLCache, PrincipalCache, Principal
+
+
+PRINCIPAL = Principal(1, 'test@mail.com', 'test', Role.guest, True, 'www.test/name.jpg')
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_expires_entries(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        with patch('src.services.cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with patch('src.services.cache.time.monotonic', return_value=161):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class TestPrincipalCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.r = AsyncMock()
+        self.cache = PrincipalCache(self.r, maxsize=8, local_ttl=30, ttl=900)
+
+    def test_dumps_loads(self):
+        self.assertEqual(self.cache.loads(self.cache.dumps(PRINCIPAL)), PRINCIPAL)
+
+    def test_loads_other_version(self):
+        data = self.cache.dumps(PRINCIPAL).replace(b'[1,', b'[0,', 1)
+        self.assertIsNone(self.cache.loads(data))
+
+    async def test_set_single_round_trip(self):
+        await self.cache.set(PRINCIPAL)
+        self.r.set.assert_awaited_once_with('user:test@mail.com', self.cache.dumps(PRINCIPAL), ex=900)
+
+    async def test_get_local_hit(self):
+        await self.cache.set(PRINCIPAL)
+        result = await self.cache.get(PRINCIPAL.email)
+        self.assertEqual(result, PRINCIPAL)
+        self.r.get.assert_not_awaited()
+
+    async def test_get_redis_hit_fills_local(self):
+        self.r.get.return_value = self.cache.dumps(PRINCIPAL)
+        self.assertEqual(await self.cache.get(PRINCIPAL.email), PRINCIPAL)
+        self.assertEqual(await self.cache.get(PRINCIPAL.email), PRINCIPAL)
+        self.r.get.assert_awaited_once()
+
+    async def test_invalidate(self):
+        await self.cache.set(PRINCIPAL)
+        self.r.get.return_value = None
+        await self.cache.invalidate(PRINCIPAL.email)
+        self.assertIsNone(await self.cache.get(PRINCIPAL.email))
+        self.r.delete.assert_awaited_once_with('user:test@mail.com')
+
+    async def test_redis_failure_is_a_miss(self):
+        self.r.get.side_effect = ConnectionError()
+        self.r.set.side_effect = ConnectionError()
+        self.r.delete.side_effect = ConnectionError()
+        self.assertIsNone(await self.cache.get(PRINCIPAL.email))
+        await self.cache.set(PRINCIPAL)
+        self.assertEqual(await self.cache.get(PRINCIPAL.email), PRINCIPAL)
+        await self.cache.invalidate(PRINCIPAL.email)
+        self.assertIsNone(await self.cache.get(PRINCIPAL.email))
+        self.assertEqual(self.cache.errors, 4)
@@ -0,0 +1,61 @@
+import unittest
+
+from src.services.imports import iter_lines, iter_records
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+class TestImports(unittest.IsolatedAsyncioTestCase):
+
+    async def test_iter_lines_joins_split_chunks(self):
+        body = 'first\nсекунда\nlast'.encode('utf-8')
+        chunks = [body[i:i + 3] for i in range(0, len(body), 3)]
+        lines = await collect(iter_lines(stream(*chunks)))
+        self.assertEqual(lines, ['first\n', 'секунда\n', 'last'])
+
+    async def test_iter_records_ndjson(self):
+        records = await collect(iter_records(stream(b'{"email": "a@b.c"}\n\n[1]\n'), 'ndjson'))
+        self.assertEqual(records[0], (1, {'email': 'a@b.c'}))
+        self.assertEqual(records[1][0], 3)
+        self.assertIsInstance(records[1][1], ValueError)
+
+    async def test_iter_records_csv_quoted_newline(self):
+        body = b'\xef\xbb\xbfemail,additional_info\na@b.c,"two\nlines"\nd@e.f,\n'
+        records = await collect(iter_records(stream(body), 'csv'))
+        self.assertEqual(records, [(2, {'email': 'a@b.c', 'additional_info': 'two\nlines'}),
+                                   (4, {'email': 'd@e.f'})])
+
+    async def test_iter_records_csv_unterminated(self):
+        records = await collect(iter_records(stream(b'email\n"a@b.c\n'), 'csv'))
+        self.assertEqual(records[0][0], 2)
+        self.assertIsInstance(records[0][1], ValueError)
+
+    async def test_iter_lines_caps_long_lines(self):
+        body = b'short\n' + b'x' * 25 + b'\nafter\n' + b'y' * 30
+        chunks = [body[i:i + 4] for i in range(0, len(body), 4)]
+        lines = await collect(iter_lines(stream(*chunks), max_size=10))
+        self.assertEqual(lines[0], 'short\n')
+        self.assertIsInstance(lines[1], ValueError)
+        self.assertEqual(lines[2], 'after\n')
+        self.assertIsInstance(lines[3], ValueError)
+        self.assertEqual(len(lines), 4)
+
+    async def test_iter_records_csv_stray_quote_resyncs(self):
+        body = b'email,additional_info\n"a@b.c,one\n' + b'd@e.f,two\n' * 5 + b'g@h.i,three\n'
+        records = await collect(iter_records(stream(body), 'csv', max_size=40))
+        self.assertEqual(records[0][0], 2)
+        self.assertIsInstance(records[0][1], ValueError)
+        self.assertEqual(records[-1], (8, {'email': 'g@h.i', 'additional_info': 'three'}))
+
+    async def test_iter_records_ndjson_long_line(self):
+        body = b'{"email": "' + b'a' * 50 + b'"}\n{"email": "a@b.c"}\n'
+        records = await collect(iter_records(stream(body), 'ndjson', max_size=30))
+        self.assertIsInstance(records[0][1], ValueError)
+        self.assertEqual(records[1], (2, {'email': 'a@b.c'}))
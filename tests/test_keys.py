@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from jose import jwt, JWTError
+
+from src.services.auth import Auth, auth_service
+from src.services.keys import KeyRing, generate_private_key, load_key, KID_FORMAT
+
+NOW = datetime(2023, 6, 10, tzinfo=timezone.utc)
+
+
+def make_key(activates_at, algorithm="RS256"):
+    return load_key(activates_at.strftime(KID_FORMAT), generate_private_key(algorithm), algorithm)
+
+
+@pytest.fixture(scope="module")
+def ring():
+    keys = [make_key(NOW - timedelta(days=30)), make_key(NOW - timedelta(days=3)), make_key(NOW + timedelta(days=1))]
+    return KeyRing("RS256", keys, grace=timedelta(days=7))
+
+
+def test_signing_key_is_newest_active_key(ring):
+    assert ring.signing_key(NOW).kid == ring.keys[1].kid
+    assert ring.signing_key(NOW + timedelta(days=2)).kid == ring.keys[2].kid
+
+
+def test_published_keys_follow_the_rotation_schedule(ring):
+    assert [key.kid for key in ring.published(NOW)] == [key.kid for key in ring.keys]
+    later = NOW + timedelta(days=5)
+    assert [key.kid for key in ring.published(later)] == [ring.keys[1].kid, ring.keys[2].kid]
+    assert ring.verification_key(ring.keys[0].kid, later) is None
+    jwks = ring.jwks(later)["keys"]
+    assert {key["kid"] for key in jwks} == {ring.keys[1].kid, ring.keys[2].kid}
+    assert all(key["kty"] == "RSA" and "d" not in key for key in jwks)
+
+
+def test_load_directory_and_es256(tmp_path):
+    kid = (NOW - timedelta(days=1)).strftime(KID_FORMAT)
+    (tmp_path / f"{kid}.pem").write_bytes(generate_private_key("ES256"))
+    ring = KeyRing.from_directory(str(tmp_path), "ES256", timedelta(days=7))
+    assert ring.signing_key(NOW).kid == kid
+    assert ring.jwks(NOW)["keys"][0]["crv"] == "P-256"
+
+
+def test_tokens_are_signed_with_kid_and_verified_with_jwks(ring):
+    with patch.object(Auth, "ALGORITHM", "RS256"), patch.object(Auth, "key_ring", ring):
+        token = asyncio.run(auth_service.create_access_token(data={"sub": "deadpool@example.com"}))
+        kid = jwt.get_unverified_header(token)["kid"]
+        assert kid == ring.signing_key().kid
+        # a downstream service only needs the published JWK Set
+        claims = jwt.decode(token, ring.jwks(), algorithms=["RS256"])
+        assert claims["sub"] == "deadpool@example.com"
+        assert auth_service.decode_token(token)["scope"] == "access_token"
+
+        forged = jwt.encode({"sub": "deadpool@example.com"}, "secret_key", algorithm="HS256", headers={"kid": kid})
+        with pytest.raises(JWTError):
+            auth_service.decode_token(forged)
+
+
+def test_jwks_endpoint(client, ring):
+    with patch.object(Auth, "key_ring", ring):
+        response = client.get("/.well-known/jwks.json")
+        assert response.status_code == 200
+        assert response.headers["cache-control"].startswith("public, max-age=")
+        assert [key["kid"] for key in response.json()["keys"]] == [key.kid for key in ring.published()]
+        cached = client.get("/.well-known/jwks.json", headers={"If-None-Match": response.headers["etag"]})
+        assert cached.status_code == 304
+    assert client.get("/.well-known/jwks.json").json() == {"keys": []}
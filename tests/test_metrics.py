@@ -0,0 +1,74 @@
+import pathlib
+import subprocess
+import sys
+from unittest.mock import patch
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from src.conf.config import settings
+from src.services.metrics import MetricsMiddleware, RequestMetrics, UNMATCHED_ROUTE, exposition
+
+metrics = RequestMetrics()
+app = FastAPI()
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+
+@app.post("/items/{item_id}")
+async def echo(item_id: int, body: dict):
+    if item_id == 0:
+        raise HTTPException(status_code=404, detail="Not found")
+    return body
+
+
+def test_records_route_template_status_and_sizes():
+    client = TestClient(app)
+    payload = b'{"name": "spider"}'
+    for item_id in (1, 2):
+        response = client.post(f"/items/{item_id}", content=payload, headers={"Content-Type": "application/json"})
+        assert response.status_code == 200
+    assert client.post("/items/0", content=b"{}", headers={"Content-Type": "application/json"}).status_code == 404
+    assert client.get("/missing/1").status_code == 404
+    assert client.get("/missing/2").status_code == 404
+
+    assert metrics.requests[("POST", "/items/{item_id}", 200)] == 2
+    assert metrics.requests[("POST", "/items/{item_id}", 404)] == 1
+    assert metrics.requests[("GET", UNMATCHED_ROUTE, 404)] == 2
+    latency, request_size, response_size = metrics.histograms[("POST", "/items/{item_id}")]
+    assert latency.count == 3
+    assert request_size.sum == 2 * len(payload) + 2
+    assert response_size.sum > 2 * len(payload)
+    assert metrics.in_progress == {"POST": 0, "GET": 0}
+
+    text = exposition(metrics.state()).decode()
+    assert 'http_requests_total{method="POST",route="/items/{item_id}",status="404"} 1' in text
+    assert 'http_request_duration_seconds_count{method="POST",route="/items/{item_id}"} 3' in text
+    assert 'http_request_size_bytes_bucket{method="POST",route="/items/{item_id}",le="64"} 3' in text
+
+
+def test_metrics_endpoint(admin_token):
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    assert client.get("/metrics").status_code == 401
+    client.get("/metrics", headers=headers)
+    response = client.get("/metrics", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/metrics",le="+Inf"}' in response.text
+    assert "performance" not in response.headers
+
+
+def test_multiprocess_mode_aggregates_workers(tmp_path, admin_token):
+    worker = ("import sys; from src.services.metrics import request_metrics as m; "
+              "m.observe('GET', '/api/users/', 200, 2000000, 0, 100); m.in_progress['GET'] = 1; m.dump(sys.argv[1])")
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", worker, str(tmp_path)], cwd=pathlib.Path(__file__).parent.parent,
+                       check=True)
+    with patch.object(settings, "metrics_multiproc_dir", str(tmp_path)):
+        response = TestClient(main.app).get("/metrics", headers={"Authorization": f"Bearer {admin_token}"})
+    assert 'http_requests_total{method="GET",route="/api/users/",status="200"} 2' in response.text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/users/",le="0.0025"} 2' in response.text
+    # only the scrape itself is in flight: the requests of exited workers are dropped
+    assert 'http_requests_in_progress{method="GET"} 1' in response.text
+    assert len(list(tmp_path.glob("http_*.json"))) == 3
@@ -0,0 +1,150 @@
+import asyncio
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, MailOutbox, MailStatus
+from src.repository import outbox as repository_outbox
+from src.services.email import SMTPConnection, enqueue_confirmation
+from src.services.outbox import MailWorker
+
+
+class CapturingHandler:
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture()
+def smtp_server():
+    handler = CapturingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def connection(port):
+    return SMTPConnection("127.0.0.1", port, None, None, use_tls=False, start_tls=False, use_credentials=False,
+                          timeout=5)
+
+
+async def session_maker():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def messages(maker):
+    async with maker() as db:
+        return (await db.scalars(select(MailOutbox).order_by(MailOutbox.id))).all()
+
+
+def test_enqueue_drops_duplicates():
+    async def main():
+        maker = await session_maker()
+        async with maker() as db:
+            assert await enqueue_confirmation("a@example.com", "a", "http://test/", db) is True
+            assert await enqueue_confirmation("a@example.com", "a", "http://test/", db) is False
+            assert await enqueue_confirmation("b@example.com", "b", "http://test/", db) is True
+        return await messages(maker)
+
+    rows = asyncio.run(main())
+    assert [row.recipient for row in rows] == ["a@example.com", "b@example.com"]
+    assert all(row.status == MailStatus.pending and row.attempts == 0 for row in rows)
+
+
+def test_worker_delivers_batches_over_one_connection(smtp_server):
+    controller, handler = smtp_server
+
+    async def main():
+        maker = await session_maker()
+        async with maker() as db:
+            for i in range(5):
+                await repository_outbox.enqueue(f"key{i}", "confirm_email", f"user{i}@example.com",
+                                                {"username": f"user{i}", "host": "http://test/"}, db)
+        worker = MailWorker(maker, connection(controller.port), batch_size=2)
+        claimed = [await worker.run_once() for _ in range(4)]
+        await worker.connection.close()
+        return claimed, worker, await messages(maker)
+
+    claimed, worker, rows = asyncio.run(main())
+    assert claimed == [2, 2, 1, 0]
+    assert worker.sent == 5
+    assert worker.connection.connects == 1
+    assert sorted(envelope.rcpt_tos[0] for envelope in handler.envelopes) == [f"user{i}@example.com" for i in range(5)]
+    assert b"http://test/api/auth/confirmed_email/" in handler.envelopes[0].content
+    assert all(row.status == MailStatus.sent and row.sent_at is not None for row in rows)
+
+
+def test_worker_retries_with_backoff_then_gives_up():
+    async def main():
+        maker = await session_maker()
+        async with maker() as db:
+            await enqueue_confirmation("a@example.com", "a", "http://test/", db)
+        worker = MailWorker(maker, connection(free_port()), max_attempts=3, retry_base=60)
+        delays = []
+        for _ in range(3):
+            started = datetime.utcnow()
+            assert await worker.run_once() == 1
+            row = (await messages(maker))[0]
+            delays.append(row.next_attempt_at - started)
+            async with maker() as db:
+                await db.execute(update(MailOutbox).values(next_attempt_at=datetime.utcnow()))
+                await db.commit()
+        assert await worker.run_once() == 0
+        return worker, delays, (await messages(maker))[0]
+
+    worker, delays, row = asyncio.run(main())
+    assert worker.failed == 3 and worker.sent == 0
+    assert timedelta(seconds=60) <= delays[0] < timedelta(seconds=61)
+    assert timedelta(seconds=120) <= delays[1] < timedelta(seconds=121)
+    assert row.status == MailStatus.failed
+    assert row.attempts == 3
+    assert row.last_error.startswith("SMTPConnectError")
+
+
+def test_worker_survives_failing_batches(smtp_server):
+    controller, handler = smtp_server
+
+    async def main():
+        maker = await session_maker()
+        async with maker() as db:
+            await enqueue_confirmation("a@example.com", "a", "http://test/", db)
+        calls = []
+
+        def flaky_maker():
+            calls.append(None)
+            if len(calls) <= 2:
+                raise ConnectionRefusedError("database is down")
+            return maker()
+
+        worker = MailWorker(flaky_maker, connection(controller.port))
+        stop = asyncio.Event()
+        task = asyncio.create_task(worker.run(stop, poll_interval=0.01))
+        while worker.sent == 0 and not task.done():
+            await asyncio.sleep(0.01)
+        stop.set()
+        await task
+        return worker
+
+    worker = asyncio.run(main())
+    assert worker.errors == 2
+    assert worker.last_error == "ConnectionRefusedError: database is down"
+    assert worker.sent == 1
+    assert len(handler.envelopes) == 1
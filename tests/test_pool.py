@@ -0,0 +1,56 @@
+import unittest
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import main
+from src.database.pool import InstrumentedPool, PoolMetrics, pool_metrics
+
+
+class TestPoolMetrics(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=InstrumentedPool,
+                                          pool_size=1, max_overflow=0, pool_timeout=0.05)
+        self.metrics = PoolMetrics()
+        self.metrics.attach(self.engine.sync_engine)
+        self.checkouts = pool_metrics.checkouts
+        self.timeouts = pool_metrics.checkout_timeouts
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def test_checkout_and_churn(self):
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            stats = self.metrics.snapshot(self.engine.sync_engine.pool)
+            self.assertEqual(stats["checked_out"], 1)
+            self.assertEqual(stats["size"], 1)
+        stats = self.metrics.snapshot(self.engine.sync_engine.pool)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["connects"], 1)
+        self.assertEqual(pool_metrics.checkouts, self.checkouts + 1)
+
+    async def test_checkout_timeout(self):
+        async with self.engine.connect():
+            with self.assertRaises(PoolTimeoutError):
+                async with self.engine.connect():
+                    pass
+        self.assertEqual(pool_metrics.checkout_timeouts, self.timeouts + 1)
+        self.assertGreaterEqual(pool_metrics.checkout_wait.snapshot()["buckets"]["+Inf"], 2)
+
+
+def test_db_pool_endpoint(admin_token):
+    response = TestClient(main.app).get("/api/internal/db_pool", headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.status_code == 200
+    data = response.json()
+    assert {"checked_out", "overflow", "connects", "checkout_wait_seconds"} <= set(data)
+
+
+def test_internal_endpoints_need_admin(token):
+    client = TestClient(main.app)
+    assert client.get("/api/internal/db_pool").status_code == 401
+    response = client.get("/api/internal/db_pool", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403
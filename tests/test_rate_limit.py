@@ -0,0 +1,111 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from src.database.models import Role
+from src.services.rate_limit import RateLimiter, Quota, rate_limiter
+
+QUOTA = Quota(3, 10)
+QUOTAS = {Role.admin: Quota(100, 10), Role.moderator: Quota(10, 10), Role.guest: QUOTA}
+
+
+def limiter(counts=None):
+    r = AsyncMock()
+    r.script_load.return_value = "sha"
+    r.evalsha.side_effect = counts or (lambda sha, numkeys, *args: [0] * numkeys)
+    return RateLimiter(r, QUOTAS, sync_interval=1)
+
+
+def test_quota_parse():
+    assert Quota.parse("60/60") == Quota(60, 60)
+
+
+def test_fixed_limit_within_window():
+    rl = limiter()
+    assert [rl.hit("a", QUOTA, now=100.0) for _ in range(3)] == [0, 0, 0]
+    assert rl.hit("a", QUOTA, now=101.0) == pytest.approx(9.0)
+    assert rl.hit("b", QUOTA, now=101.0) == 0
+    assert rl.allowed == 4 and rl.rejected == 1
+
+
+def test_sliding_window_counts_previous_window():
+    rl = limiter()
+    for _ in range(3):
+        rl.hit("a", QUOTA, now=105.0)
+    # 20% into the next window, 80% of the previous 3 hits still count
+    assert rl.hit("a", QUOTA, now=112.0) == 0
+    assert rl.hit("a", QUOTA, now=112.0) > 0
+    assert rl.hit("a", QUOTA, now=118.0) == 0
+
+
+def test_sync_pushes_local_hits_and_reads_global_counts():
+    pushed = []
+
+    def evalsha(sha, numkeys, *args):
+        keys, values = args[:numkeys], args[numkeys:]
+        pushed.append((keys, values))
+        return [5, 1] * (numkeys // 2)
+
+    rl = limiter(evalsha)
+    rl.hit("a", QUOTA, now=100.0)
+    rl.hit("a", QUOTA, now=100.0)
+    asyncio.run(rl.sync(now=100.0))
+    assert pushed == [(("rl:10:10:a", "rl:10:9:a"), (2, 0, 20))]
+    assert rl.windows["a"].current == 5 and rl.windows["a"].previous == 1
+    assert rl.hit("a", QUOTA, now=109.9) > 0
+    assert rl.syncs == 1
+
+
+def test_sync_pushes_hits_of_the_previous_window():
+    pushed = []
+
+    def evalsha(sha, numkeys, *args):
+        pushed.append(args[numkeys:])
+        return [0] * numkeys
+
+    rl = limiter(evalsha)
+    rl.hit("a", QUOTA, now=109.0)
+    rl.hit("a", QUOTA, now=111.0)
+    asyncio.run(rl.sync(now=111.0))
+    assert pushed == [(1, 1, 20)]
+
+
+def test_sync_drops_idle_keys():
+    rl = limiter()
+    rl.hit("a", QUOTA, now=100.0)
+    asyncio.run(rl.sync(now=125.0))
+    assert rl.windows == {}
+    rl.r.evalsha.assert_not_called()
+
+
+def test_redis_errors_keep_local_counts():
+    rl = limiter()
+    rl.r.evalsha.side_effect = ConnectionError()
+    rl.hit("a", QUOTA, now=100.0)
+    asyncio.run(rl.sync(now=100.0))
+    assert rl.errors == 1
+    assert rl.windows["a"].pending == 1 and rl.windows["a"].current == 1
+
+
+def test_check_uses_role_quota():
+    rl = limiter()
+
+    async def burst(role):
+        return [await rl.check(f"{role.value}", role) for _ in range(11)]
+
+    assert sum(bool(wait) for wait in asyncio.run(burst(Role.moderator))) == 1
+    assert sum(bool(wait) for wait in asyncio.run(burst(Role.admin))) == 0
+    # nothing was active at the first check, and the next sync is not due yet
+    rl.r.evalsha.assert_not_called()
+
+
+def test_route_is_rate_limited_per_user(client, token, monkeypatch):
+    monkeypatch.setitem(rate_limiter.quotas, Role.guest, Quota(2, 60))
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/api/users", headers=headers).status_code == 200
+    assert client.get("/api/users", headers=headers).status_code == 200
+    response = client.get("/api/users", headers=headers)
+    assert response.status_code == 429, response.text
+    assert 1 <= int(response.headers["Retry-After"]) <= 60
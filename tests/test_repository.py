@@ -2,15 +2,14 @@ import unittest
 
 from unittest.mock import MagicMock
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Guest, User
+from src.database.models import Guest
 from src.shemas import GuestModel
 from src.repository.users import (
     get_user_by_email,
     create_guest,
     confirmed_email,
-    update_token,
     update_avatar,
 )
 
@@ -18,38 +17,51 @@ from src.repository.users import (
 class TestUsers(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = MagicMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock()
+        self.session.get_bind.return_value.dialect.name = 'sqlite'
 
     async def test_get_user_by_email_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.execute.return_value.scalars.return_value.first.return_value = None
         result = await get_user_by_email(email='test@mail.com', db=self.session)
         self.assertIsNone(result)
 
     async def test_get_user_by_email_found(self):
         user = Guest()
-        self.session.query().filter().first.return_value = user
+        self.session.execute.return_value.scalars.return_value.first.return_value = user
         result = await get_user_by_email(email='test@mail.com', db=self.session)
         self.assertEqual(result, user)
 
     async def test_create_guest(self):
-        body = GuestModel(name='test', email='test@mail.com', password='12345678')
+        body = GuestModel(guest_name='test', email='test@mail.com', password='12345678')
+        guest = Guest(id=1)
+        self.session.scalar.return_value = guest
         result = await create_guest(body=body, db=self.session)
-        self.assertEqual(result.name, body.guest_name)
-        self.assertEqual(result.email, body.email)
-        self.assertEqual(result.password, body.password)
-        self.assertTrue(hasattr(result, "id"))
+        self.assertEqual(result, guest)
+        params = self.session.scalar.call_args.args[0].compile().params
+        self.assertEqual(params['guest_name'], body.guest_name)
+        self.assertEqual(params['email'], body.email)
+        self.assertEqual(params['password'], body.password)
+        self.session.commit.assert_not_awaited()
 
     async def test_confirmed_email_found(self):
         result = await confirmed_email(email='test@mail.com', db=self.session)
         self.assertIsNone(result)
-
-    async def test_update_token_found(self):
-        result = await update_token(user=User(), refresh_token='123', db=self.session)
-        self.assertIsNone(result)
+        self.session.execute.assert_awaited_once()
+        self.assertTrue(str(self.session.execute.call_args.args[0]).startswith('UPDATE guest SET confirmed'))
 
     async def test_update_avatar_found(self):
         user = Guest()
-        self.session.query().filter().first.return_value = user
+        self.session.scalar.return_value = user
         result = await update_avatar(email='test@mail.com', url='www.test/name.jpg', db=self.session)
         self.assertEqual(result, user)
+        self.session.execute.assert_not_called()
 
+    async def test_update_avatar_stale_digest(self):
+        # the digest is checked by the UPDATE itself; a newer upload leaves no row to match
+        self.session.scalar.return_value = None
+        result = await update_avatar(email='test@mail.com', url='www.test/name.jpg', db=self.session, digest='old')
+        self.assertIsNone(result)
+        stmt = self.session.scalar.call_args.args[0]
+        self.assertIn('guest.avatar_hash = :avatar_hash_1', str(stmt))
+        self.assertEqual(stmt.compile().params['avatar_hash_1'], 'old')
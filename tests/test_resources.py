@@ -0,0 +1,62 @@
+import asyncio
+import subprocess
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from src.services.resources import Resources, resources
+
+
+def test_resources_are_created_on_first_use():
+    registry = Resources()
+    factory = MagicMock(side_effect=lambda: SimpleNamespace(host="localhost"))
+    registry.register("client", factory)
+    lazy = registry.lazy("client")
+    assert registry.instances == {}
+    assert lazy.host == "localhost"
+    assert registry.get("client") is registry.get("client")
+    factory.assert_called_once()
+    assert list(registry.snapshot()["created"]) == ["client"]
+
+
+def test_aclose_closes_newest_first_and_recreates():
+    registry = Resources()
+    closed = []
+    registry.register("engine", lambda: "engine", close=AsyncMock(side_effect=closed.append))
+    registry.register("redis", lambda: "redis", close=closed.append)
+    registry.register("broken", lambda: "broken", close=MagicMock(side_effect=OSError("gone")))
+    registry.get("engine"), registry.get("redis"), registry.get("broken")
+    asyncio.run(registry.aclose())
+    assert closed == ["redis", "engine"]
+    assert registry.instances == {}
+    assert registry.snapshot()["close_errors"] == {"broken": "OSError: gone"}
+    assert registry.get("engine") == "engine"
+
+
+def test_import_creates_no_resources():
+    code = ("import sys, main; from src.services.resources import resources; "
+            "print(sorted(resources.instances), 'asyncpg' in sys.modules, 'cloudinary' in sys.modules)")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["[]", "False", "False"]
+
+
+@pytest.fixture()
+def probe():
+    close = AsyncMock()
+    resources.register("probe", lambda: "probe", close=close)
+    yield close
+    resources.factories.pop("probe")
+
+
+def test_lifespan_closes_resources(probe, admin_token):
+    with TestClient(app) as client:
+        resources.get("probe")
+        stats = client.get("/api/internal/resources", headers={"Authorization": f"Bearer {admin_token}"}).json()
+        assert stats["created"]["probe"] >= 0
+        assert stats["boot_seconds"] >= stats["import_seconds"] > 0
+    probe.assert_awaited_once_with("probe")
+    assert "probe" not in resources.instances
@@ -0,0 +1,89 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.testclient import TestClient
+from redis.exceptions import ConnectionError
+
+from src.services.cache import ResponseCache
+from src.shemas import UserPage
+
+
+@pytest.fixture()
+def cache(fake_redis):
+    return ResponseCache(fake_redis, ttl=60)
+
+
+@pytest.fixture()
+def app(cache):
+    app = FastAPI()
+    app.state.loads = 0
+
+    @app.get("/pages/{page_id}")
+    async def page(request: Request, page_id: int):
+        async def load():
+            if page_id == 0:
+                raise HTTPException(status_code=404, detail="Not Found")
+            app.state.loads += 1
+            return UserPage(items=[], next_cursor=str(page_id))
+
+        return await cache.respond(request, f"page:{page_id}", load)
+
+    return app
+
+
+def test_hit_skips_load_and_serves_same_body(app, cache):
+    client = TestClient(app)
+    first = client.get("/pages/1", params={"b": 2, "a": 1})
+    second = client.get("/pages/1", params={"a": 1, "b": 2})
+    assert (first.headers["X-Cache"], second.headers["X-Cache"]) == ("MISS", "HIT")
+    assert first.content == second.content
+    assert first.json()["next_cursor"] == "1"
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert app.state.loads == 1
+    assert cache.snapshot()["hit_ratio"] == 0.5
+
+
+def test_if_none_match_returns_304(app, cache):
+    client = TestClient(app)
+    etag = client.get("/pages/1").headers["ETag"]
+    response = client.get("/pages/1", headers={"If-None-Match": f'"other", {etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    assert client.get("/pages/1", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert cache.not_modified == 1
+
+
+def test_invalidate_retires_only_its_scope(app, cache):
+    client = TestClient(app)
+    client.get("/pages/1")
+    client.get("/pages/2")
+    asyncio.run(cache.invalidate("page:1"))
+    assert client.get("/pages/1").headers["X-Cache"] == "MISS"
+    assert client.get("/pages/2").headers["X-Cache"] == "HIT"
+    assert app.state.loads == 3
+
+
+def test_errors_are_not_cached(app, cache):
+    client = TestClient(app)
+    assert client.get("/pages/0").status_code == 404
+    assert cache.r.data == {}
+
+
+def test_redis_failure_falls_back_to_load(app, cache):
+    cache.r.mget = AsyncMock(side_effect=ConnectionError())
+    response = TestClient(app).get("/pages/1")
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "MISS"
+    assert cache.errors == 1
+    assert cache.r.data == {}
+
+
+def test_invalidate_redis_failure_is_counted(app, cache):
+    client = TestClient(app)
+    client.get("/pages/1")
+    cache.r.set = AsyncMock(side_effect=ConnectionError())
+    asyncio.run(cache.invalidate("page:1"))
+    assert cache.errors == 1
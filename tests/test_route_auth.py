@@ -1,21 +1,31 @@
-from unittest.mock import MagicMock
+import asyncio
+from unittest.mock import AsyncMock, patch
 
-from src.database.models import Guest
+import pytest
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
 
+from src.database.models import Guest, MailOutbox, MailStatus, Role
+from src.services.auth import auth_service
+from src.services.refresh_tokens import refresh_families
+from src.services.roles import RoleAccess
 
-def test_create_guest(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+
+def test_create_guest(client, user, session, queries, commits):
     response = client.post("/api/auth/signup", json=user)
     assert response.status_code == 201, response.text
+    # the guest and its confirmation email, one INSERT each, committed together
+    assert len(queries) == 2, queries
+    assert len(commits) == 1, commits
     payload = response.json()
     assert payload["email"] == user.get("email")
-    assert payload["user"]["email"] == user.get("email")
+    assert payload["username"] == user.get("guest_name")
+    message = session.query(MailOutbox).filter(MailOutbox.recipient == user.get("email")).one()
+    assert message.status == MailStatus.pending
+    assert message.payload["username"] == user.get("guest_name")
 
 
-def test_repeat_create_guest(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+def test_repeat_create_guest(client, user):
     response = client.post("/api/auth/signup", json=user)
     assert response.status_code == 409, response.text
     payload = response.json()
@@ -57,3 +67,111 @@ def test_login_user_wrong_email(client, user, session):
     assert response.status_code == 401, response.text
     payload = response.json()
     assert payload["detail"] == "Invalid email"
+
+
+def login(client, user):
+    response = client.post("/api/auth/login", data={"username": user.get("email"), "password": user.get("password")})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def refresh(client, refresh_token):
+    return client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {refresh_token}"})
+
+
+def test_refresh_token_rotates_without_database(client, user, token):
+    tokens = login(client, user)
+    with patch("src.repository.users.get_guest_by_email", side_effect=AssertionError("database touched")):
+        first = refresh(client, tokens["refresh_token"])
+        assert first.status_code == 200, first.text
+        second = refresh(client, first.json()["refresh_token"])
+        assert second.status_code == 200, second.text
+    assert refresh_families.rotations >= 2
+
+
+def test_refresh_token_reuse_revokes_family(client, user, token):
+    tokens = login(client, user)
+    rotated = refresh(client, tokens["refresh_token"]).json()
+    reused = refresh(client, tokens["refresh_token"])
+    assert reused.status_code == 401
+    # the thief's replay also locks out the legitimate holder of the newest token
+    assert refresh(client, rotated["refresh_token"]).status_code == 401
+    # and the access tokens issued before are rejected
+    for access_token in (tokens["access_token"], rotated["access_token"]):
+        stale = client.get("/api/users/me/", headers={"Authorization": f"Bearer {access_token}"})
+        assert stale.status_code == 401
+    # other sessions of the same user are separate families and keep working
+    assert refresh(client, login(client, user)["refresh_token"]).status_code == 200
+
+
+def test_refresh_families_unavailable_is_503(client, user, token, refresh_families_redis):
+    tokens = login(client, user)
+    refresh_families_redis.set = AsyncMock(side_effect=ConnectionError())
+    response = client.post("/api/auth/login", data={"username": user.get("email"), "password": user.get("password")})
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "1"
+    assert refresh(client, tokens["refresh_token"]).status_code == 503
+    assert refresh_families.errors >= 2
+
+
+def test_refresh_token_without_family_is_rejected(client, user):
+    legacy = asyncio.run(auth_service.create_refresh_token(data={"sub": user.get("email")}))
+    assert refresh(client, legacy).status_code == 401
+
+
+def test_access_token_carries_role_and_version(client, user, token):
+    claims = auth_service.decode_token(login(client, user)["access_token"])
+    assert claims["roles"] == "guest"
+    assert claims["ver"] == 0
+    assert claims["uid"] > 0
+
+
+def test_role_access_decides_from_claims():
+    asyncio.run(RoleAccess([Role.admin])({"roles": "admin"}))
+    with pytest.raises(HTTPException) as err:
+        asyncio.run(RoleAccess([Role.admin])({"roles": "guest"}))
+    assert err.value.status_code == 403
+
+
+def test_guest_is_forbidden_to_remove_users(client, token):
+    response = client.delete("/api/users/1", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403, response.text
+
+
+def test_role_change_rejects_old_tokens(client, user, session, admin_token, queries):
+    guest = session.query(Guest).filter(Guest.email == user.get("email")).first()
+    tokens = login(client, user)
+    queries.clear()
+    response = client.patch(f"/api/users/guests/{guest.id}/roles", json={"roles": "moderator"},
+                            headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["roles"] == "moderator"
+    assert len(queries) == 1, queries
+
+    stale = client.get("/api/users/me/", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+    assert stale.status_code == 401
+    refreshed = refresh(client, tokens["refresh_token"])
+    assert refreshed.status_code == 200, refreshed.text
+    claims = auth_service.decode_token(refreshed.json()["access_token"])
+    assert claims["roles"] == "moderator" and claims["ver"] == 1
+    fresh = client.get("/api/users/me/", headers={"Authorization": f"Bearer {refreshed.json()['access_token']}"})
+    assert fresh.status_code == 200, fresh.text
+    assert fresh.json()["roles"] == "moderator"
+
+
+def test_only_admins_change_roles(client, user, session, token):
+    guest = session.query(Guest).filter(Guest.email == user.get("email")).first()
+    response = client.patch(f"/api/users/guests/{guest.id}/roles", json={"roles": "admin"},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403, response.text
+
+
+def test_confirmed_email(client, session, queries):
+    client.post("/api/auth/signup", json={"guest_name": "confirm", "email": "confirm@example.com", "password": "123"})
+    token = auth_service.create_email_token({"sub": "confirm@example.com"})
+    queries.clear()
+    response = client.get(f"/api/auth/confirmed_email/{token}")
+    assert response.json() == {"message": "Email confirmed"}
+    assert len(queries) == 2, queries
+    assert session.query(Guest).filter(Guest.email == "confirm@example.com").one().confirmed
+    assert client.get(f"/api/auth/confirmed_email/{token}").json() == {"message": "Your email is already confirmed"}
@@ -0,0 +1,131 @@
+from datetime import date
+from unittest.mock import patch, AsyncMock
+
+import pytest
+
+from src.database.models import User
+from src.services.cache import principal_cache
+
+
+class FrozenDate(date):
+    today_value = date(2023, 12, 30)
+
+    @classmethod
+    def today(cls):
+        return cls.today_value
+
+
+@pytest.fixture(scope="module")
+def contacts(session):
+    birthdays = {
+        "winter": date(1990, 12, 31),
+        "newyear": date(1985, 1, 1),
+        "january": date(1992, 1, 5),
+        "leap": date(1996, 2, 29),
+        "march": date(1991, 3, 1),
+        "summer": date(1993, 7, 15),
+    }
+    for name, birthday in birthdays.items():
+        session.add(User(firstname=name, lastname="Birthday", email=f"{name}@example.com",
+                         phone="+380001234567", birthday=birthday, additional_info="birthday"))
+    session.commit()
+    return birthdays
+
+
+def birthday_names(client, token, today, **params):
+    FrozenDate.today_value = today
+    names, after = [], None
+    with patch("src.repository.find.date", FrozenDate), patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.get.return_value = None
+        while True:
+            if after:
+                params["after"] = after
+            response = client.get("/api/find/birthday_list", params=params,
+                                  headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200, response.text
+            data = response.json()
+            names.extend(item["firstname"] for item in data["items"])
+            after = data["next_cursor"]
+            if after is None:
+                return names
+
+
+def test_birthday_list_wraps_year(client, token, contacts):
+    names = birthday_names(client, token, date(2023, 12, 30), shift=7)
+    assert names == ["winter", "newyear", "january"]
+
+
+def test_birthday_list_pages(client, token, contacts):
+    names = birthday_names(client, token, date(2023, 12, 30), shift=7, limit=1)
+    assert names == ["winter", "newyear", "january"]
+
+
+def test_birthday_list_leap_day_in_common_year(client, token, contacts):
+    assert birthday_names(client, token, date(2023, 2, 20), shift=8) == []
+    assert birthday_names(client, token, date(2023, 2, 20), shift=9) == ["leap", "march"]
+    assert birthday_names(client, token, date(2023, 3, 1), shift=0) == ["leap", "march"]
+
+
+def test_birthday_list_leap_day_in_leap_year(client, token, contacts):
+    assert birthday_names(client, token, date(2024, 2, 29), shift=0) == ["leap"]
+    assert birthday_names(client, token, date(2024, 3, 1), shift=0) == ["march"]
+
+
+def test_birthday_list_whole_year(client, token, contacts):
+    names = birthday_names(client, token, date(2023, 7, 15), shift=365)
+    assert names[0] == "summer"
+    assert set(contacts) <= set(names)
+
+
+@pytest.fixture(scope="module")
+def people(session):
+    for firstname, lastname, email in (("Deadpool", "Wilson", "wade@example.com"),
+                                       ("Wanda", "Maximoff", "wanda@example.com"),
+                                       ("Peter", "Parker", "spider_man@example.com")):
+        session.add(User(firstname=firstname, lastname=lastname, email=email, phone="+380001234567",
+                         birthday=date(1990, 6, 1), additional_info="search"))
+    session.commit()
+
+
+def search(client, token, **params):
+    response = client.get("/api/find/", params=params, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_search_prefix(client, token, people):
+    data = search(client, token, q="wa", mode="prefix")
+    assert [item["firstname"] for item in data["items"]] == ["Wanda", "Deadpool"]
+
+
+def test_search_substring_escapes_wildcards(client, token, people):
+    data = search(client, token, q="e_e", mode="substring")
+    assert data["items"] == []
+    data = search(client, token, q="er_m", mode="substring")
+    assert [item["firstname"] for item in data["items"]] == ["Peter"]
+
+
+def test_search_fuzzy_tolerates_typos(client, token, people):
+    data = search(client, token, q="Dedpool", mode="fuzzy")
+    assert data["items"][0]["firstname"] == "Deadpool"
+
+
+def test_search_pages(client, token, people):
+    seen, after = [], None
+    while True:
+        params = {"q": "example", "mode": "substring", "limit": 1}
+        if after:
+            params["after"] = after
+        data = search(client, token, **params)
+        seen.extend(item["id"] for item in data["items"])
+        after = data["next_cursor"]
+        if after is None:
+            break
+    assert len(seen) == len(set(seen))
+    assert len(seen) >= 3
+
+
+def test_search_fast_json_matches(client, token, people, monkeypatch):
+    slow = search(client, token, q="wa", mode="prefix")
+    monkeypatch.setattr("src.routes.find.settings.fast_json", True)
+    assert search(client, token, q="wa", mode="prefix") == slow
@@ -0,0 +1,83 @@
+import io
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+from src.database.models import Guest, AvatarStatus
+from src.services.avatars import avatar_pipeline, resize, AVATAR_SIZE
+from tests.conftest import AsyncTestingSessionLocal
+
+
+def image_bytes(size=(1200, 800), color="red", fmt="JPEG"):
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, fmt)
+    return out.getvalue()
+
+
+@pytest.fixture()
+def cloudinary_upload():
+    with patch.object(avatar_pipeline, "session_maker", AsyncTestingSessionLocal), \
+            patch("src.services.cloudinary.CloudImage.upload", return_value={"version": 42}) as upload:
+        yield upload
+
+
+def test_resize_fills_avatar_size():
+    with Image.open(io.BytesIO(resize(image_bytes(fmt="PNG")))) as avatar:
+        assert avatar.size == AVATAR_SIZE
+        assert avatar.format == "JPEG"
+
+
+def test_update_avatar(client, token, session, cloudinary_upload, queries):
+    client.get("/api/users/me/", headers={"Authorization": f"Bearer {token}"})
+    queries.clear()
+    response = client.patch("/api/users/avatar", files={"file": ("a.jpg", image_bytes(), "image/jpeg")},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 202, response.text
+    assert response.json()["avatar_status"] == "processing"
+    # read the current hash, then mark the update processing
+    assert len(queries) == 2, queries
+    uploaded, public_id = cloudinary_upload.call_args.args
+    with Image.open(uploaded) as avatar:
+        assert avatar.size == AVATAR_SIZE
+
+    response = client.get("/api/users/me/avatar", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar_status"] == "ready"
+    assert public_id in response.json()["avatar"]
+    assert "v42" in response.json()["avatar"]
+
+
+def test_update_avatar_same_content_skips_upload(client, token, cloudinary_upload):
+    response = client.patch("/api/users/avatar", files={"file": ("a.jpg", image_bytes(), "image/jpeg")},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar_status"] == "ready"
+    cloudinary_upload.assert_not_called()
+
+
+def test_update_avatar_upload_failure(client, token, session, cloudinary_upload):
+    cloudinary_upload.side_effect = RuntimeError("cloudinary down")
+    data = image_bytes(color="blue")
+    response = client.patch("/api/users/avatar", files={"file": ("a.jpg", data, "image/jpeg")},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 202, response.text
+    response = client.get("/api/users/me/avatar", headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["avatar_status"] == "failed"
+    assert "v42" in response.json()["avatar"]
+
+    cloudinary_upload.side_effect = None
+    response = client.patch("/api/users/avatar", files={"file": ("a.jpg", data, "image/jpeg")},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 202, response.text
+    assert cloudinary_upload.call_count == 2
+    session.expire_all()
+    guest = session.query(Guest).filter(Guest.avatar_status == AvatarStatus.ready).one()
+    assert guest.avatar_hash is not None
+
+
+def test_update_avatar_invalid_image(client, token, cloudinary_upload):
+    response = client.patch("/api/users/avatar", files={"file": ("a.jpg", b"not an image", "image/jpeg")},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 400, response.text
+    cloudinary_upload.assert_not_called()
@@ -1,10 +1,12 @@
-from unittest.mock import MagicMock, patch, AsyncMock
+import csv
+import io
+import json
+from datetime import date, timedelta
+from unittest.mock import patch, AsyncMock
 from fastapi import status
 
-import pytest
-
-from src.database.models import Guest
-from src.services.auth import auth_service
+from src.database.models import User
+from src.services.cache import principal_cache, response_cache
 
 USER = {
     "firstname": "Unknown",
@@ -16,22 +18,8 @@ USER = {
 }
 
 
-@pytest.fixture()
-def token(client, user, session, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
-    client.post("/api/auth/signup", json=user)
-
-    current_user: Guest = session.query(Guest).filter(Guest.email == user.get("email")).first()
-    current_user.confirmed = True
-    session.commit()
-    response = client.post("/api/auth/login", data={"username": user.get("email"), "password": user.get("password")})
-    data = response.json()
-    return data["access_token"]
-
-
 def test_create_user(client, token):
-    with patch.object(auth_service, "r") as redis_mock:
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
         response = client.post("/api/users", json=USER, headers={"Authorization": f"Bearer {token}"})
         assert response.status_code == 201, response.text
@@ -39,31 +27,108 @@ def test_create_user(client, token):
         assert "firstname" in data
 
 
-def test_get_user(client, token, monkeypatch):
-    with patch.object(auth_service, "r") as redis_mock:
+def test_get_user(client, token):
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
         response = client.get("/api/users", headers={"Authorization": f"Bearer {token}"})
         assert response.status_code == 200, response.text
         data = response.json()
-        assert type(data) == list
-        assert data[0]["firstname"] == USER["firstname"]
+        assert type(data["items"]) == list
+        assert data["items"][0]["firstname"] == USER["firstname"]
+
+
+def test_get_users_pages(client, token, session):
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.get.return_value = None
+        for lastname in ("Zeta", "Alpha", "Mu"):
+            session.add(User(firstname="Page", lastname=lastname, email=f"{lastname.lower()}@example.com",
+                             phone="+380001234567", birthday=date(1990, 1, 1), additional_info="page"))
+        session.commit()
+        total = session.query(User).count()
+
+        seen, after = [], None
+        while True:
+            params = {"limit": 2, "order_by": "last_name"}
+            if after:
+                params["after"] = after
+            response = client.get("/api/users", params=params, headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200, response.text
+            data = response.json()
+            assert len(data["items"]) <= 2
+            seen.extend((item["lastname"], item["id"]) for item in data["items"])
+            after = data["next_cursor"]
+            if after is None:
+                break
+        assert len(seen) == total
+        assert seen == sorted(seen)
+
+
+def test_get_users_pages_include_null_last_names(client, token, session):
+    for email in ("nameless1@example.com", "nameless2@example.com"):
+        session.add(User(firstname="Nameless", lastname=None, email=email, phone="+380001234567",
+                         birthday=date(1990, 1, 1), additional_info="page"))
+    session.commit()
+    total = session.query(User).count()
+
+    seen, after = [], None
+    while True:
+        params = {"limit": 1, "order_by": "last_name"}
+        if after:
+            params["after"] = after
+        response = client.get("/api/users", params=params, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        data = response.json()
+        seen.extend((item["lastname"] or "", item["id"]) for item in data["items"])
+        after = data["next_cursor"]
+        if after is None:
+            break
+    assert len(seen) == total
+    assert seen == sorted(seen)
+    assert seen[0][0] == ""
+
+
+def test_get_users_invalid_cursor(client, token):
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
+        redis_mock.get.return_value = None
+        response = client.get("/api/users", params={"after": "not-a-cursor"},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_get_user_is_cached_until_updated(client, admin_token, session, fake_redis):
+    user = User(firstname="Cached", lastname="Cached", email="cached@example.com", phone="+380001234567",
+                birthday=date(1990, 1, 1), additional_info="cache")
+    session.add(user)
+    session.commit()
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    with patch.object(response_cache, "r", fake_redis):
+        first = client.get(f"/api/users/{user.id}", headers=headers)
+        assert first.status_code == 200, first.text
+        assert first.headers["X-Cache"] == "MISS"
+        etag = first.headers["ETag"]
+        second = client.get(f"/api/users/{user.id}", headers={**headers, "If-None-Match": etag})
+        assert second.status_code == 304
+        assert second.headers["X-Cache"] == "HIT"
+
+        response = client.put(f"/api/users/{user.id}", json={**USER, "email": "recached@example.com"},
+                              headers=headers)
+        assert response.status_code == 200, response.text
+        third = client.get(f"/api/users/{user.id}", headers={**headers, "If-None-Match": etag})
+        assert third.status_code == 200
+        assert third.headers["X-Cache"] == "MISS"
+        assert third.json()["email"] == "recached@example.com"
 
 
 def test_get_user_without_token(client):
-    with patch.object(auth_service, 'r') as redis_mock:
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        response = client.post(
-            "/api/users",
-            headers={"Authorization": f"Bearer {token}"},
-        )
+        response = client.get("/api/users/")
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
 
 def test_get_users_with_token(client, token):
-    with patch.object(auth_service, 'r') as redis_mock:
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
         response = client.get(
             "/api/users",
@@ -73,47 +138,266 @@ def test_get_users_with_token(client, token):
 
 
 def test_get_user_error(client, token):
-    with patch.object(auth_service, 'r') as redis_mock:
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        response = client.get("/api/users", headers={"Authorization": f"Bearer {token}"},)
+        response = client.get("/api/users/999999", headers={"Authorization": f"Bearer {token}"},)
         assert response.status_code == status.HTTP_404_NOT_FOUND
         data = response.json()
-        assert data["detail"] == "Not found"
+        assert data["detail"] == "Not Found"
 
 
-def test_update(client, token):
-    with patch.object(auth_service, 'r') as redis_mock:
+def test_update(client, admin_token, session):
+    user = User(firstname="Old", lastname="Update", email="update@example.com", phone="+380001234567",
+                birthday=date(1990, 1, 1), additional_info="update")
+    session.add(user)
+    session.commit()
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        response = client.put("/api/user",
-                              json=USER,
-                              headers={"Authorization": f"Bearer {token}"},)
-        assert response.status_code == status.HTTP_200_OK
-        data = response.json()
-        assert data["first_name"] == USER["firstname"]
+        response = client.put(f"/api/users/{user.id}",
+                              json={**USER, "email": "updated@example.com"},
+                              headers={"Authorization": f"Bearer {admin_token}"},)
+        assert response.status_code == status.HTTP_200_OK, response.text
+        assert response.json()["email"] == "updated@example.com"
 
 
-def test_update_error(client, token):
-    with patch.object(auth_service, 'r') as redis_mock:
+def test_update_error(client, admin_token):
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        response = client.put("/api/users",
+        response = client.put("/api/users/999999",
                               json=USER,
-                              headers={"Authorization": f"Bearer {token}"},)
+                              headers={"Authorization": f"Bearer {admin_token}"},)
         assert response.status_code == status.HTTP_404_NOT_FOUND
         data = response.json()
-        assert data["detail"] == "Not found"
+        assert data["detail"] == "Not Found"
 
 
-def test_delete(client, token):
-    with patch.object(auth_service, 'r') as redis_mock:
+def test_delete(client, admin_token, session):
+    user = User(firstname="Gone", lastname="Delete", email="delete@example.com", phone="+380001234567",
+                birthday=date(1990, 1, 1), additional_info="delete")
+    session.add(user)
+    session.commit()
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        response = client.delete("/api/user", headers={"Authorization": f"Bearer {token}"},)
+        response = client.delete(f"/api/users/{user.id}", headers={"Authorization": f"Bearer {admin_token}"},)
         assert response.status_code == status.HTTP_204_NO_CONTENT
+        response = client.get(f"/api/users/{user.id}", headers={"Authorization": f"Bearer {admin_token}"},)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
 
 
-def test_delete_error(client, token):
-    with patch.object(auth_service, 'r') as redis_mock:
+def test_delete_error(client, admin_token):
+    with patch.object(principal_cache, "r", new_callable=AsyncMock) as redis_mock:
         redis_mock.get.return_value = None
-        response = client.delete("/api/users", headers={"Authorization": f"Bearer {token}"},)
+        response = client.delete("/api/users/999999", headers={"Authorization": f"Bearer {admin_token}"},)
         assert response.status_code == status.HTTP_404_NOT_FOUND
         data = response.json()
-        assert data["detail"] == "Not found"
+        assert data["detail"] == "Not Found"
+
+
+def test_import_users_ndjson(client, token, monkeypatch):
+    monkeypatch.setattr("src.routes.users.settings.import_batch_size", 2)
+    lines = [
+        '{"firstname": "Bulk", "lastname": "One", "email": "bulk1@example.com"}',
+        '{"firstname": "Bulk", "lastname": "Two", "email": "bulk2@example.com"}',
+        '',
+        '{"firstname": "Bulk", "lastname": "Bad", "email": "not-an-email"}',
+        '{"firstname": "Bulk", "lastname": "Again", "email": "bulk1@example.com"}',
+        'not json',
+        '{"firstname": "Bulk", "lastname": "Three", "email": "bulk3@example.com"}',
+    ]
+    response = client.post("/api/users/import", content="\n".join(lines).encode(),
+                           headers={"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert (data["inserted"], data["duplicates"], data["failed"]) == (3, 1, 2)
+    assert sorted(error["line"] for error in data["errors"]) == [4, 5, 6]
+
+
+def test_import_users_csv(client, token):
+    body = ('firstname,lastname,email,additional_info\n'
+            'Csv,One,csv1@example.com,"multi\nline"\n'
+            'Csv,Two,csv2@example.com,\n'
+            'Csv,Short\n')
+    response = client.post("/api/users/import", content=body.encode(),
+                           headers={"Authorization": f"Bearer {token}", "Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert (data["inserted"], data["duplicates"], data["failed"]) == (2, 0, 1)
+    assert data["errors"][0]["line"] == 5
+
+
+def test_import_users_longer_than_columns(client, token):
+    lines = [
+        '{"firstname": "%s", "lastname": "Long", "email": "long1@example.com"}' % ("F" * 21),
+        '{"firstname": "Fits", "lastname": "%s", "email": "long2@example.com"}' % ("L" * 30),
+    ]
+    response = client.post("/api/users/import", content="\n".join(lines).encode(),
+                           headers={"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert (data["inserted"], data["duplicates"], data["failed"]) == (1, 0, 1)
+    assert data["errors"] == [{"line": 1, "detail": "firstname: ensure this value has at most 20 characters"}]
+
+
+def test_import_users_unsupported_type(client, token):
+    response = client.post("/api/users/import", json=[USER], headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+def test_export_users(client, token, session):
+    headers = {"Authorization": f"Bearer {token}"}
+    total = session.query(User).count()
+    assert total
+
+    response = client.get("/api/users/export", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == total
+    assert set(rows[0]) == set(USER) | {"id", "created_at", "updated_at"}
+
+    response = client.get("/api/users/export", params={"format": "csv"}, headers=headers)
+    assert response.status_code == 200, response.text
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == total
+
+    latest = session.query(User).order_by(User.updated_at.desc()).first()
+    since = latest.updated_at - timedelta(seconds=1)
+    response = client.get("/api/users/export", params={"since": since.isoformat()}, headers=headers)
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert latest.id in [row["id"] for row in rows]
+    assert len(rows) <= total
+
+    response = client.get("/api/users/export", params={"since": "2999-01-01T00:00:00"}, headers=headers)
+    assert response.text == ""
+
+
+def test_get_users_batch(client, token, session, monkeypatch):
+    users = [User(firstname="Batch", lastname=f"Batch{i}", email=f"batch{i}@example.com", phone="+380001234567",
+                  birthday=date(1990, 1, 1), additional_info="batch") for i in range(3)]
+    session.add_all(users)
+    session.commit()
+    headers = {"Authorization": f"Bearer {token}"}
+    body = {"ids": [users[2].id, 999999, users[0].id, users[2].id], "emails": ["missing@example.com", users[1].email]}
+
+    response = client.post("/api/users/batch", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    items = response.json()["items"]
+    assert [(item["id"], item["email"], item["found"]) for item in items] == [
+        (users[2].id, None, True), (999999, None, False), (users[0].id, None, True), (users[2].id, None, True),
+        (None, "missing@example.com", False), (None, users[1].email, True)]
+    assert [item["user"] and item["user"]["lastname"] for item in items] == [
+        "Batch2", None, "Batch0", "Batch2", None, "Batch1"]
+
+    monkeypatch.setattr("src.routes.users.settings.fast_json", True)
+    assert client.post("/api/users/batch", json=body, headers=headers).json() == response.json()
+
+
+def test_get_users_batch_size(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.post("/api/users/batch", json={}, headers=headers).status_code == 422
+    assert client.post("/api/users/batch", json={"ids": list(range(1, 60)), "emails": ["a@b.c"] * 60},
+                       headers=headers).status_code == 422
+
+
+def test_bulk_update_and_delete(client, admin_token, session, response_cache_redis):
+    users = [User(firstname="Bulk", lastname=f"Bulk{i}", email=f"bulk{i}@old.example", phone="+380001234567",
+                  birthday=date(1980 + i, 1, 1), additional_info="bulk") for i in range(4)]
+    session.add_all(users)
+    session.commit()
+    ids = [user.id for user in users]
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    body = {"where": {"email": {"endswith": "@old.example"}, "birthday": {"lt": "1982-06-01"}},
+            "set": {"additional_info": "moved"}, "replace": {"email": {"old": "@old.example", "new": "@new.example"}},
+            "dry_run": True}
+
+    response = client.post("/api/users/bulk/update", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"matched": 3, "ids": ids[:3], "dry_run": True}
+    session.expire_all()
+    assert session.get(User, ids[0]).email == "bulk0@old.example"
+    response_cache_redis.pipeline.assert_not_called()
+
+    body["dry_run"] = False
+    response = client.post("/api/users/bulk/update", json=body, headers=headers)
+    assert response.json() == {"matched": 3, "ids": ids[:3], "dry_run": False}
+    session.expire_all()
+    assert [(user.email, user.additional_info) for user in map(lambda i: session.get(User, i), ids)] == [
+        ("bulk0@new.example", "moved"), ("bulk1@new.example", "moved"), ("bulk2@new.example", "moved"),
+        ("bulk3@old.example", "bulk")]
+    assert response_cache_redis.pipeline.return_value.set.call_count == 4
+
+    body = {"where": {"id": {"in": ids}, "lastname": {"startswith": "Bulk"}}}
+    response = client.post("/api/users/bulk/delete", json={**body, "dry_run": True}, headers=headers)
+    assert response.json() == {"matched": 4, "ids": ids, "dry_run": True}
+    response = client.post("/api/users/bulk/delete", json=body, headers=headers)
+    assert response.json() == {"matched": 4, "ids": ids, "dry_run": False}
+    assert session.query(User).filter(User.id.in_(ids)).count() == 0
+
+
+def test_bulk_update_conflict(client, admin_token, session):
+    users = [User(firstname="Bulk", lastname="Conflict", email=f"conflict{i}@example.com", phone="+380001234567",
+                  birthday=date(1990, 1, 1), additional_info="bulk") for i in range(2)]
+    session.add_all(users)
+    session.commit()
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    body = {"where": {"lastname": "Conflict"}, "set": {"email": "same@example.com"}}
+    response = client.post("/api/users/bulk/update", json=body, headers=headers)
+    assert response.status_code == status.HTTP_409_CONFLICT, response.text
+    assert session.query(User).filter(User.email == "same@example.com").count() == 0
+
+
+def test_bulk_invalid_filter(client, admin_token):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    for where in ({}, {"password": "x"}, {"id": {"like": 1}}, {"id": {"endswith": "1"}}, {"birthday": "soon"}):
+        response = client.post("/api/users/bulk/delete", json={"where": where}, headers=headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST, where
+    response = client.post("/api/users/bulk/update", json={"where": {"id": 1}}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = client.post("/api/users/bulk/update", json={"where": {"id": 1}, "replace": {"birthday": {
+        "old": "1", "new": "2"}}}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_bulk_needs_moderator(client, token):
+    response = client.post("/api/users/bulk/delete", json={"where": {"id": 1}},
+                           headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_write_endpoints_query_budget(client, admin_token, queries):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    body = {**USER, "email": "budget@example.com"}
+    # loads the principal, so the requests below are only charged for their own statements
+    assert client.get("/api/users", params={"limit": 1}, headers=headers).status_code == 200
+
+    queries.clear()
+    response = client.post("/api/users", json=body, headers=headers)
+    assert response.status_code == 201, response.text
+    assert response.json()["created_at"] is not None
+    assert len(queries) == 1, queries
+    user_id = response.json()["id"]
+
+    queries.clear()
+    assert client.post("/api/users", json=body, headers=headers).status_code == 409
+    assert len(queries) == 1, queries
+
+    queries.clear()
+    response = client.put(f"/api/users/{user_id}", json={**body, "email": "budget2@example.com"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == "budget2@example.com"
+    assert len(queries) == 1, queries
+
+    queries.clear()
+    response = client.post("/api/users/bulk/update", json={"where": {"id": user_id}, "set": {"phone": "+380007654321"}},
+                           headers=headers)
+    assert response.json()["matched"] == 1
+    assert len(queries) == 1, queries
+
+    queries.clear()
+    assert client.delete(f"/api/users/{user_id}", headers=headers).status_code == 204
+    assert len(queries) == 1, queries
+
+    queries.clear()
+    assert client.delete(f"/api/users/{user_id}", headers=headers).status_code == 404
+    assert client.put(f"/api/users/{user_id}", json=body, headers=headers).status_code == 404
+    assert len(queries) == 2, queries
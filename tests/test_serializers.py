@@ -0,0 +1,42 @@
+import json
+from datetime import date, datetime
+
+from fastapi.encoders import jsonable_encoder
+
+from src.conf.config import settings
+from src.database.models import User, Guest, Role
+from src.services.serializers import user_serializer, guest_serializer, dumps
+from src.shemas import UserResponse, GuestResponse, UserPage
+
+
+def make_user(user_id=1):
+    return User(id=user_id, firstname="Peter", lastname="Parker", email="spider_man@example.com",
+                phone="+380001234567", birthday=date(1990, 6, 1), additional_info="Ünïcode",
+                created_at=datetime(2023, 5, 1, 12, 30, 15, 123456), updated_at=datetime(2023, 5, 2, 8, 0))
+
+
+def test_user_serializer_matches_response_model():
+    user = make_user()
+    assert json.loads(dumps(user_serializer.dump(user))) == jsonable_encoder(UserResponse.from_orm(user))
+
+
+def test_guest_serializer_matches_response_model():
+    guest = Guest(id=3, guest_name="deadpool", email="deadpool@example.com", avatar="https://avatar", roles=Role.admin)
+    dumped = guest_serializer.dump(guest)
+    assert dumped["username"] == "deadpool"
+    assert json.loads(dumps(dumped)) == jsonable_encoder(GuestResponse.from_orm(guest))
+
+
+def test_dumps_encodes_models_and_dump_many():
+    users = [make_user(user_id) for user_id in range(1, 4)]
+    page = UserPage(items=[UserResponse.from_orm(user) for user in users], next_cursor="abc")
+    fast = {"items": user_serializer.dump_many(users), "next_cursor": "abc", "estimated_total": None}
+    assert json.loads(dumps(page)) == json.loads(dumps(fast)) == jsonable_encoder(page)
+
+
+def test_users_me_fast_path(client, token, monkeypatch):
+    slow = client.get("/api/users/me/", headers={"Authorization": f"Bearer {token}"})
+    monkeypatch.setattr(settings, "fast_json", True)
+    fast = client.get("/api/users/me/", headers={"Authorization": f"Bearer {token}"})
+    assert slow.status_code == fast.status_code == 200
+    assert fast.json() == slow.json()
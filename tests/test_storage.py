@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+from unittest.mock import patch
+
+import pytest
+
+from main import app
+from src.services.storage import LocalStorage, SendfileResponse, IMMUTABLE, create_storage, CloudinaryStorage, \
+    get_avatar_storage
+
+IMAGE = b"\xff\xd8avatar\xff\xd9"
+NAME = hashlib.sha256(IMAGE).hexdigest()
+
+
+@pytest.fixture()
+def storage(tmp_path):
+    return LocalStorage(str(tmp_path), "/api/avatars/")
+
+
+def test_local_storage_is_content_addressed(storage, tmp_path):
+    url = storage.save("a@example.com", IMAGE)
+    assert url == f"/api/avatars/{NAME[:2]}/{NAME[2:4]}/{NAME}.jpg"
+    assert (tmp_path / NAME[:2] / NAME[2:4] / f"{NAME}.jpg").read_bytes() == IMAGE
+    assert storage.save("b@example.com", IMAGE) == url
+    assert [path.name for path in tmp_path.rglob("*") if path.is_file()] == [f"{NAME}.jpg"]
+
+
+def test_local_storage_path(storage):
+    storage.save("a@example.com", IMAGE)
+    assert storage.path(NAME).read_bytes() == IMAGE
+    assert storage.path("0" * 64) is None
+    assert storage.path("../../etc/passwd") is None
+
+
+def test_create_storage():
+    assert isinstance(create_storage("cloudinary"), CloudinaryStorage)
+    assert isinstance(create_storage("local"), LocalStorage)
+    with pytest.raises(ValueError):
+        create_storage("s3")
+
+
+def test_read_avatar(client, storage):
+    url = storage.save("a@example.com", IMAGE)
+    with patch.dict(app.dependency_overrides, {get_avatar_storage: lambda: storage}):
+        response = client.get(url)
+        assert response.status_code == 200, response.text
+        assert response.content == IMAGE
+        assert response.headers["content-type"] == "image/jpeg"
+        assert response.headers["cache-control"] == IMMUTABLE
+        assert response.headers["etag"] == f'"{NAME}"'
+
+        response = client.get(url, headers={"If-None-Match": f'"{NAME}"'})
+        assert response.status_code == 304
+        assert client.get(f"/api/avatars/00/00/{NAME}.jpg").status_code == 404
+        assert client.get(f"/api/avatars/00/00/{'0' * 64}.jpg").status_code == 404
+
+
+def test_read_avatar_needs_local_storage(client, storage):
+    url = storage.save("a@example.com", IMAGE)
+    assert client.get(url).status_code == 404
+
+
+def test_sendfile_response_uses_pathsend(storage):
+    storage.save("a@example.com", IMAGE)
+    path = storage.path(NAME)
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "extensions": {"http.response.pathsend": {}}}
+    asyncio.run(SendfileResponse(path, media_type="image/jpeg", stat_result=path.stat())(scope, None, send))
+    assert messages[0]["type"] == "http.response.start"
+    assert (b"content-length", str(len(IMAGE)).encode()) in messages[0]["headers"]
+    assert messages[1] == {"type": "http.response.pathsend", "path": str(path.resolve())}
@@ -0,0 +1,71 @@
+import time
+from unittest.mock import patch
+
+from jose import jwt
+
+from src.services.auth import auth_service
+from src.services.cache import TokenCache, token_cache
+
+
+def payload(sub="deadpool@example.com", ttl=60):
+    return {"sub": sub, "scope": "access_token", "exp": int(time.time()) + ttl}
+
+
+def test_get_set_and_counters():
+    cache = TokenCache(maxsize=10)
+    assert cache.get("a") is None
+    cache.set("a", payload())
+    assert cache.get("a")["sub"] == "deadpool@example.com"
+    assert cache.snapshot()["hits"] == 1
+    assert cache.snapshot()["misses"] == 1
+    assert cache.snapshot()["hit_ratio"] == 0.5
+
+
+def test_entries_expire_at_exp():
+    cache = TokenCache(maxsize=10)
+    cache.set("a", payload(ttl=-1))
+    cache.set("b", {"sub": "x"})
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_dropped():
+    cache = TokenCache(maxsize=2)
+    cache.set("a", payload())
+    cache.set("b", payload())
+    cache.get("a")
+    cache.set("c", payload())
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_evict_and_evict_subject():
+    cache = TokenCache(maxsize=10)
+    cache.set("a", payload("wade@example.com"))
+    cache.set("b", payload("wade@example.com"))
+    cache.set("c", payload("wanda@example.com"))
+    cache.evict("c")
+    cache.evict("unknown")
+    cache.evict_subject("wade@example.com")
+    assert len(cache) == 0
+    assert cache.snapshot()["evictions"] == 3
+
+
+def test_reused_token_is_decoded_once(client, token):
+    token_cache.clear()
+    with patch("src.services.auth.jwt.decode", wraps=jwt.decode) as decode:
+        for _ in range(3):
+            response = client.get("/api/users/me/", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200, response.text
+    assert decode.call_count == 1
+
+
+def test_refresh_token_is_not_accepted_as_access_token(client, user):
+    token_cache.clear()
+    refresh = jwt.encode({**payload(user["email"]), "scope": "refresh_token"}, auth_service.SECRET_KEY,
+                         algorithm=auth_service.ALGORITHM)
+    response = client.get("/api/users/me/", headers={"Authorization": f"Bearer {refresh}"})
+    assert response.status_code == 401
+    assert len(token_cache) == 0
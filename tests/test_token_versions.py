@@ -0,0 +1,43 @@
+import unittest
+from unittest.mock import AsyncMock
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.services.token_versions import TokenVersions
+
+
+class TestTokenVersions(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.r = AsyncMock()
+        self.r.get.return_value = None
+        self.versions = TokenVersions(self.r, maxsize=8, local_ttl=0, stale_ttl=900)
+
+    async def test_unknown_user_is_at_zero(self):
+        self.assertEqual(await self.versions.get(1), 0)
+        self.r.set.assert_not_awaited()
+
+    async def test_redis_failure_uses_last_known_version(self):
+        self.r.incr.return_value = 3
+        await self.versions.bump(1)
+        self.r.get.side_effect = ConnectionError()
+        self.assertEqual(await self.versions.get(1), 3)
+        self.assertEqual(self.versions.errors, 1)
+
+    async def test_redis_failure_without_known_version_is_503(self):
+        self.r.get.side_effect = ConnectionError()
+        with self.assertRaises(HTTPException) as err:
+            await self.versions.get(1)
+        self.assertEqual(err.exception.status_code, 503)
+        self.r.incr.side_effect = ConnectionError()
+        with self.assertRaises(HTTPException) as err:
+            await self.versions.bump(1)
+        self.assertEqual(err.exception.status_code, 503)
+
+    async def test_lost_counter_is_written_back(self):
+        self.r.incr.return_value = 2
+        await self.versions.bump(1)
+        self.r.get.side_effect = [None, b'2']
+        self.assertEqual(await self.versions.get(1), 2)
+        self.r.set.assert_awaited_once_with('tokver:1', 2, nx=True)
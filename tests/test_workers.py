@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import unittest
+
+from src.services.workers import WorkerPool, WorkerPoolBusy
+
+
+class TestWorkerPool(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def block(self):
+        self.release.wait(5)
+        return threading.current_thread().name
+
+    async def test_run_in_thread(self):
+        pool = WorkerPool(max_workers=1, max_queue=0, timeout=5, name='test')
+        self.release.set()
+        result = await pool.run(self.block)
+        self.assertTrue(result.startswith('test'))
+        self.assertEqual(pool.pending, 0)
+
+    async def test_rejects_over_queue_depth(self):
+        pool = WorkerPool(max_workers=1, max_queue=1, timeout=5, name='test')
+        running = asyncio.ensure_future(pool.run(self.block))
+        queued = asyncio.ensure_future(pool.run(self.block))
+        await asyncio.sleep(0)
+        with self.assertRaises(WorkerPoolBusy):
+            await pool.run(self.block)
+        self.release.set()
+        await asyncio.gather(running, queued)
+        self.assertEqual(pool.pending, 0)
+
+    async def test_timeout_keeps_slot_until_thread_finishes(self):
+        pool = WorkerPool(max_workers=1, max_queue=0, timeout=0.05, name='test')
+        with self.assertRaises(WorkerPoolBusy):
+            await pool.run(self.block)
+        self.assertEqual(pool.pending, 1)
+        with self.assertRaises(WorkerPoolBusy):
+            await pool.run(self.block)
+        self.release.set()
+        for _ in range(100):
+            if pool.pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(pool.pending, 0)
+        self.assertTrue((await pool.run(self.block)).startswith('test'))